@@ -0,0 +1,371 @@
+"""
+Distributed load generation: remote send agents and the coordinator that drives them.
+
+An agent (hl7-agent) listens on a TCP port. A coordinator (the UI or CLI with one or more agents
+configured) connects to every agent, deals the message stream round-robin across them and pushes the
+send options and each agent's share of the load profile; each agent runs runner.run_send on its share
+against the target and streams record batches and histogram snapshots back, which the coordinator
+merges into one live results dict exactly as workers.run_multiprocess does for local processes.
+
+The protocol is newline-delimited JSON over one connection per run:
+
+    coordinator -> agent   {"type": "job", "index": k, "options": {...}, "rate_samples": [...]}
+                           {"type": "messages", "messages": ["MSH|...", ...]}   (repeated)
+                           {"type": "start"}
+                           {"type": "stop"}                                      (optional, any time)
+    agent -> coordinator   {"type": "report", "rows": [...], "histogram": {...},
+                            "cycle_histograms": [...], "summary": null | {...}} (the last has a summary)
+
+Agents spool their share to a temporary file, so a large message set does not have to fit in memory;
+each message is stored length-prefixed as its UTF-8 bytes and sent exactly as the coordinator had it.
+There is no authentication: bind agents to loopback or a trusted load-generation network only.
+"""
+import argparse
+import dataclasses
+import functools
+import json
+import os
+import queue
+import socket
+import socketserver
+import struct
+import sys
+import tempfile
+import threading
+import time
+
+from histogram import LatencyHistogram
+from hl7 import MessageSource
+import metrics
+from mllp import ConnectionPool
+from runner import SendOptions, new_results, run_send
+from workers import SUMMARY_KEYS, Merger, Reporter, SampledProfile, collect_reports, shard_options
+
+DEFAULT_AGENT_PORT = 2580
+MESSAGE_BATCH = 500
+CONNECT_TIMEOUT = 10
+_SPOOL_LENGTH = struct.Struct(">I")
+
+
+def parse_agent(spec: str):
+    """Parse "host:port" (or just "host", on DEFAULT_AGENT_PORT) into (host, port)."""
+    host, _, port = spec.strip().rpartition(":")
+    if not host:
+        return port, DEFAULT_AGENT_PORT
+    try:
+        return host, int(port)
+    except ValueError:
+        raise ValueError(f"Invalid agent address: {spec!r} (expected host:port)") from None
+
+
+def options_to_json(options: SendOptions):
+    """The options as a JSON-safe dict; the rate profile travels separately as rate_samples."""
+    data = dataclasses.asdict(options)
+    del data["rate_profile"]
+    data["agents"] = []
+    return data
+
+
+def options_from_json(data: dict, rate_samples=None):
+    fields = {f.name for f in dataclasses.fields(SendOptions)}
+    options = SendOptions(**{key: value for key, value in data.items() if key in fields})
+    if rate_samples is not None:
+        options = dataclasses.replace(options, rate_profile=SampledProfile(rate_samples))
+    return options
+
+
+def _send_json(sock: socket.socket, message: dict, lock=None):
+    data = (json.dumps(message) + "\n").encode()
+    if lock is None:
+        sock.sendall(data)
+        return
+    with lock:
+        sock.sendall(data)
+
+
+def _spool_message(spool, text: str):
+    body = text.encode("utf-8")
+    spool.write(_SPOOL_LENGTH.pack(len(body)))
+    spool.write(body)
+
+
+def _iter_spool(path: str):
+    """Yield the messages written to a spool file by _AgentHandler, unchanged."""
+    with open(path, "rb") as f:
+        while header := f.read(_SPOOL_LENGTH.size):
+            (size,) = _SPOOL_LENGTH.unpack(header)
+            yield f.read(size).decode("utf-8")
+
+
+class _SocketReports:
+    """Stands in for a report queue on the agent side: put() writes each report to the coordinator."""
+
+    def __init__(self, sock: socket.socket):
+        self.sock = sock
+        self.lock = threading.Lock()
+
+    def put(self, report):
+        _, rows, histogram, cycle_histograms, summary, _ = report
+        _send_json(self.sock, {"type": "report", "rows": rows, "histogram": histogram.to_dict(),
+                               "cycle_histograms": [h.to_dict() for h in cycle_histograms],
+                               "summary": summary}, self.lock)
+
+
+class _AgentHandler(socketserver.StreamRequestHandler):
+    """One coordinator connection: receive a job and its messages, run it, report until done."""
+
+    def handle(self):
+        job = None
+        spool = tempfile.NamedTemporaryFile("wb", suffix=".spool", delete=False)
+        try:
+            for line in self.rfile:
+                message = json.loads(line)
+                if message["type"] == "job":
+                    job = message
+                elif message["type"] == "messages":
+                    for text in message["messages"]:
+                        _spool_message(spool, text)
+                elif message["type"] == "start":
+                    break
+            spool.close()
+            if job is not None:
+                self._run(job, spool.name)
+        finally:
+            spool.close()
+            os.unlink(spool.name)
+
+    def _run(self, job: dict, path: str):
+        reports = _SocketReports(self.request)
+        stop = threading.Event()
+        try:
+            options = options_from_json(job["options"], job.get("rate_samples"))
+            pool = ConnectionPool(timeout=options.timeout)
+            results = new_results(None, options, pool)
+            reporter = Reporter(job["index"], reports, results)
+        except Exception as e:
+            reports.put((job.get("index", 0), [], LatencyHistogram(), [],
+                         {"error_message": f"Error: bad job: {e}", "cancelled": False, "num_messages": None,
+                          "connects": None, "rate_reports": [], "breaker_trips": 0}, None))
+            return
+        # The coordinator's stop (or it going away) arrives on this connection while the run goes on.
+        threading.Thread(target=self._watch_for_stop, args=(stop,), daemon=True).start()
+        try:
+            run_send(MessageSource(functools.partial(_iter_spool, path)), options, results, pool=pool, on_record=reporter.add,
+                     on_cycle=lambda cycle, results: reporter.report(), should_stop=stop.is_set,
+                     sleep=stop.wait)
+        except Exception as e:
+            results["error_message"] = results["error_message"] or f"Error: {e}"
+        finally:
+            pool.close()
+            self.server.runs += 1
+            try:
+                reporter.report({key: results[key] for key in SUMMARY_KEYS})
+            except OSError:
+                pass
+
+    def _watch_for_stop(self, stop: threading.Event):
+        try:
+            for line in self.rfile:
+                if json.loads(line).get("type") == "stop":
+                    break
+        except (OSError, ValueError):
+            pass
+        stop.set()
+
+
+class AgentServer(socketserver.ThreadingTCPServer):
+    """A send agent; serve_forever() handles coordinator connections, one run per connection."""
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host="127.0.0.1", port=DEFAULT_AGENT_PORT):
+        super().__init__((host, port), _AgentHandler)
+        self.runs = 0
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+
+class ThreadedAgent:
+    """Run an AgentServer on a background thread, for tests and single-box setups."""
+
+    def __init__(self, host="127.0.0.1", port=0):
+        self.server = AgentServer(host, port)
+        self._thread = threading.Thread(target=self.server.serve_forever, kwargs={"poll_interval": 0.1}, daemon=True)
+        self._thread.start()
+
+    @property
+    def address(self):
+        return f"{self.server.server_address[0]}:{self.port}"
+
+    @property
+    def port(self):
+        return self.server.port
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self._thread.join(timeout=5)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class _AgentLink:
+    """Coordinator side of one agent connection; a reader thread turns its reports into report tuples."""
+
+    def __init__(self, index: int, address: str, reports: queue.Queue):
+        self.index = index
+        self.address = address
+        self.sock = socket.create_connection(parse_agent(address), timeout=CONNECT_TIMEOUT)
+        self.sock.settimeout(None)
+        self.lock = threading.Lock()
+        self.reports = reports
+        self._reader = threading.Thread(target=self._read, name=f"agent-{address}", daemon=True)
+
+    def send(self, message: dict):
+        _send_json(self.sock, message, self.lock)
+
+    def start(self):
+        self.send({"type": "start"})
+        self._reader.start()
+
+    def _read(self):
+        try:
+            with self.sock.makefile("rb") as lines:
+                for line in lines:
+                    report = json.loads(line)
+                    self.reports.put((self.index, [tuple(row) for row in report["rows"]],
+                                      LatencyHistogram.from_dict(report["histogram"]),
+                                      [LatencyHistogram.from_dict(h) for h in report["cycle_histograms"]],
+                                      report["summary"], None))
+                    if report["summary"] is not None:
+                        break
+        except (OSError, ValueError):
+            pass
+
+    @property
+    def ended(self):
+        return self._reader.ident is not None and not self._reader.is_alive()
+
+    def close(self):
+        try:
+            self.sock.close()
+        except OSError:
+            pass
+
+
+class _StopAgents:
+    """The coordinator's stop switch: setting it sends stop to every agent still connected."""
+
+    def __init__(self, links):
+        self.links = links
+        self._set = False
+
+    def is_set(self):
+        return self._set
+
+    def set(self):
+        if self._set:
+            return
+        self._set = True
+        for link in self.links:
+            try:
+                link.send({"type": "stop"})
+            except OSError:
+                pass
+
+
+def run_distributed(messages, options: SendOptions, results, on_record=None, on_status=None, should_stop=None):
+    """
+    Run a send job across the agents in options.agents ("host:port" strings), filling results in place
+    like runner.run_send. Message i goes to agent i % N; each agent gets 1/N of any open-loop rate and
+    runs with the rest of options as given (including its own processes and connections).
+    on_record(record) fires here for every attempt with run-wide message numbers; connection ids are
+    numbered per agent, each following the previous agent's. should_stop() is relayed to every agent,
+    and the first agent error stops the others and is recorded in results["error_message"].
+    """
+    agents = list(options.agents)
+    on_status = on_status or (lambda text: None)
+    reports = queue.Queue()
+    links = []
+    try:
+        for index, address in enumerate(agents):
+            try:
+                links.append(_AgentLink(index, address, reports))
+            except OSError as e:
+                results["error_message"] = f"Agent {address}: Error: could not connect: {e}"
+                results["batch_end_time"] = time.perf_counter()
+                return results
+        agent_options = shard_options(options, len(agents), agents=())
+        rate_samples = agent_options.rate_profile.rates if agent_options.rate_profile is not None else None
+        on_status(f"Sending messages to {len(agents)} agents...")
+        batches = [[] for _ in links]
+        for link in links:
+            link.send({"type": "job", "index": link.index, "options": options_to_json(agent_options),
+                       "rate_samples": rate_samples})
+        for i, message in enumerate(messages):
+            batch = batches[i % len(links)]
+            batch.append(message)
+            if len(batch) >= MESSAGE_BATCH:
+                links[i % len(links)].send({"type": "messages", "messages": batch})
+                batch.clear()
+        for link, batch in zip(links, batches):
+            if batch:
+                link.send({"type": "messages", "messages": batch})
+            link.start()
+        merger = Merger(options, results, on_record, [f"Agent {address}" for address in agents],
+                        options.connections * options.processes)
+        cancelled = collect_reports(reports, merger, _StopAgents(links),
+                                    lambda index: "agent closed the connection" if links[index].ended else None,
+                                    on_status, should_stop or (lambda: False), "agents")
+    except OSError as e:
+        results["error_message"] = f"Error: lost an agent connection: {e}"
+        results["batch_end_time"] = time.perf_counter()
+        return results
+    finally:
+        for link in links:
+            link.close()
+    merger.finish(cancelled)
+    results["batch_end_time"] = time.perf_counter()
+    return results
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="hl7-agent", description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1",
+                        help="Listen address (the protocol is unauthenticated; keep it on a trusted network).")
+    parser.add_argument("--port", type=int, default=DEFAULT_AGENT_PORT, help="Listen port.")
+    parser.add_argument("--metrics-port", type=int, help="Serve Prometheus metrics for this agent's sends.")
+    parser.add_argument("--otel", action="store_true", help="Emit an OpenTelemetry span per ACKed message.")
+    return parser
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    try:
+        if args.metrics_port:
+            metrics.serve(args.metrics_port, spans=args.otel)
+        elif args.otel:
+            metrics.enable(spans=True)
+    except (OSError, ValueError) as e:
+        parser.error(str(e))
+    server = AgentServer(args.host, args.port)
+    print(f"Send agent listening on {args.host}:{server.port}", file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    print(f"runs={server.runs}", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
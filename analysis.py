@@ -0,0 +1,68 @@
+"""
+Vectorised ACK analysis over a records.AckLog.
+
+The log's typed arrays are wrapped as numpy views (no per-record Python objects) and statuses and
+error codes become pandas categoricals, so the breakdowns below stay fast at a million attempts.
+Imports pandas, so the CLI leaves this module alone.
+"""
+import numpy as np
+import pandas as pd
+
+
+def ack_frame(log):
+    """
+    One row per retained attempt: cycle, message_idx, attempt, retry, duration_ms, timestamp, status,
+    error_code, and dns_ms, connect_ms, write_ms, first_byte_ms (NaN for attempts without phase timings).
+    """
+    columns = log.columns()
+
+    def view(name, dtype, source=columns):
+        return np.frombuffer(source[name], dtype=dtype) if len(source[name]) else np.empty(0, dtype=dtype)
+
+    return pd.DataFrame({
+        "cycle": view("cycle", np.uint32),
+        "message_idx": view("message_idx", np.uint32),
+        "attempt": view("attempt", np.uint32),
+        "retry": view("retry", np.uint16),
+        "duration_ms": view("duration", np.float64) * 1000,
+        "timestamp": view("timestamp", np.float64),
+        "status": pd.Categorical.from_codes(view("status_codes", np.uint8), categories=columns["statuses"]),
+        # Code 0 is "no error code", which from_codes spells -1.
+        "error_code": pd.Categorical.from_codes(view("error_codes", np.uint16).astype(np.int32) - 1,
+                                                categories=columns["errors"][1:]),
+        **{f"{phase}_ms": view(phase, np.float64, columns["phases"]) * 1000 for phase in columns["phases"]},
+    })
+
+
+def status_counts_by(frame: pd.DataFrame, key: str):
+    """Attempts per status for each value of key (e.g. "cycle" or "message_idx"), plus a NAK rate column."""
+    counts = frame.groupby([key, "status"], observed=True).size().unstack("status", fill_value=0)
+    counts.columns = counts.columns.astype(str)
+    total = counts.sum(axis=1)
+    counts["NAK rate"] = 1 - counts.get("AA", 0) / total
+    return counts
+
+
+def top_error_codes(frame: pd.DataFrame, n=10):
+    """The n most frequent ACK error codes with their counts."""
+    counts = frame["error_code"].value_counts()
+    counts = counts[counts > 0].head(n)
+    return counts.rename_axis("error_code").reset_index(name="attempts")
+
+
+def nak_rate_over_time(frame: pd.DataFrame, buckets=60):
+    """
+    Fraction of non-AA ACKs per time bucket, indexed by seconds since the first attempt. Bucket width
+    is chosen so the run splits into at most `buckets` buckets of whole seconds (at least 1 s).
+    """
+    stamped = frame[frame["timestamp"] > 0]
+    if stamped.empty:
+        return pd.Series(dtype=float, name="NAK rate")
+    elapsed = stamped["timestamp"].to_numpy() - stamped["timestamp"].min()
+    width = max(1.0, float(np.ceil(elapsed.max() / buckets)))
+    bucket = (elapsed // width).astype(np.int64)
+    totals = np.bincount(bucket)
+    naks = np.bincount(bucket, weights=(stamped["status"] != "AA").to_numpy())
+    seen = totals > 0
+    return pd.Series(naks[seen] / totals[seen], index=pd.Index(np.flatnonzero(seen) * width, name="seconds"),
+                     name="NAK rate")
@@ -1,16 +1,38 @@
 import streamlit as st
-import socket
+import hashlib
 import json
 import os
+import tempfile
 import time
 import math
 import pandas as pd
-import uuid
-
-MLLP_START_BLOCK = b'\x0b'
-MLLP_END_BLOCK = b'\x1c\r'
+from collections import deque
+
+from agent import parse_agent
+from analysis import ack_frame, nak_rate_over_time, status_counts_by, top_error_codes
+from cache import MessageCache
+from histogram import LatencyHistogram
+from hl7 import MessageSource, parse_ack_status, split_hl7_messages, with_message_control_id, build_fake_ack
+from loadgen import PROFILES
+import metrics
+from jobs import JobRegistry
+from mllp import MLLP_START_BLOCK, MLLP_END_BLOCK, send_hl7_message
+from records import ERROR_STATUS
+from resultlog import ResultLog
+from routing import Router, routing_from_config, routing_to_config
+from runner import SendOptions
+from templates import check_templates
 
 CONFIG_PATH = os.path.join(os.path.dirname(__file__), 'config.json')
+RESULTS_DB = os.environ.get('HL7_RESULTS_DB', os.path.join(os.path.dirname(__file__), 'results.db'))
+PREPARED_CACHE_MB = float(os.environ.get('HL7_PREPARED_CACHE_MB', 256))
+# Most recent attempts shown in the live table while a job runs, and in a finished job's summary.
+LIVE_ROWS = 200
+SUMMARY_ROWS = 10_000
+# Runs kept for the recent-runs chart, and saved runs listed in the history view.
+HISTORY_POINTS = 500
+HISTORY_RUNS = 200
+PHASE_LABELS = {"dns": "DNS lookup", "connect": "TCP connect", "write": "Write", "first_byte": "First ACK byte"}
 
 def load_config():
     if os.path.exists(CONFIG_PATH):
@@ -19,140 +41,117 @@ def load_config():
         return config.get('HOST', 'host.docker.internal'), config.get('PORT', 2575)
     return 'host.docker.internal', 2575
 
-def save_config(host, port):
-    with open(CONFIG_PATH, 'w') as f:
-        json.dump({'HOST': host, 'PORT': port}, f, indent=2)
+def _read_config():
+    if os.path.exists(CONFIG_PATH):
+        with open(CONFIG_PATH, 'r') as f:
+            return json.load(f)
+    return {}
 
-def send_hl7_message(message: str, host: str, port: int, timeout=10):
-    """Send HL7 message via MLLP and receive ACK."""
-    mllp_message = MLLP_START_BLOCK + message.encode() + MLLP_END_BLOCK
+def _write_config(changes):
+    # Each save updates its own keys and keeps the rest (host/port and routing are saved separately).
+    config = {**_read_config(), **changes}
+    with open(CONFIG_PATH, 'w') as f:
+        json.dump(config, f, indent=2)
 
-    try:
-        with socket.create_connection((host, port), timeout=timeout) as sock:
-            sock.sendall(mllp_message)
-            ack_data = b''
-            while True:
-                chunk = sock.recv(1024)
-                if not chunk:
-                    break
-                ack_data += chunk
-                if MLLP_END_BLOCK in chunk:
-                    break
-        ack = ack_data.strip(MLLP_START_BLOCK + MLLP_END_BLOCK).decode()
-        return ack
-    except Exception as e:
-        return f"Error: {e}"
-
-def parse_ack_status(ack_message: str):
-    """Return ACK status (AA, AE, AR) if available."""
-    for line in ack_message.strip().split("\r"):
-        if line.startswith("MSA"):
-            fields = line.split("|")
-            return fields[1] if len(fields) > 1 else "UNKNOWN"
-    return "UNKNOWN"
-
-def split_hl7_messages(raw_input: str):
-    """
-    Split pasted HL7 text into individual messages using lines that start with MSH as boundaries.
-    Falls back to one message if no MSH is found.
-    """
-    lines = [line.strip() for line in raw_input.splitlines() if line.strip()]
-    messages = []
-    current = []
-
-    for line in lines:
-        if line.startswith("MSH"):
-            if current:
-                messages.append("\r".join(current))
-                current = []
-        current.append(line)
-
-    if current:
-        messages.append("\r".join(current))
-
-    if not messages and raw_input.strip():
-        messages.append(raw_input.strip())
-
-    return messages
-
-def with_message_control_id(message: str, message_id: str):
-    """Return message with MSH-10 set to message_id when MSH is present."""
-    segments = message.split("\r")
-    for idx, segment in enumerate(segments):
-        if segment.startswith("MSH") and len(segment) >= 4:
-            field_sep = segment[3]
-            fields = segment.split(field_sep)
-            while len(fields) <= 9:
-                fields.append("")
-            fields[9] = message_id
-            segments[idx] = field_sep.join(fields)
-            return "\r".join(segments)
-    return message
-
-def build_fake_ack(message: str, message_id: str | None):
-    """Build a minimal AA ACK using the inbound MSH fields when available."""
-    ack_time = time.strftime("%Y%m%d%H%M%S")
-    segments = message.split("\r")
-    msh = next((s for s in segments if s.startswith("MSH")), "")
-    if msh:
-        field_sep = msh[3]
-        fields = msh.split(field_sep)
-        encoding_chars = fields[1] if len(fields) > 1 and fields[1] else "^~\\&"
-        comp_sep = encoding_chars[0] if encoding_chars else "^"
-        sending_app = fields[2] if len(fields) > 2 else ""
-        sending_fac = fields[3] if len(fields) > 3 else ""
-        recv_app = fields[4] if len(fields) > 4 else ""
-        recv_fac = fields[5] if len(fields) > 5 else ""
-        msg_type = fields[8] if len(fields) > 8 else ""
-        processing_id = fields[11] if len(fields) > 11 else "P"
-        version_id = fields[12] if len(fields) > 12 else "2.3"
-        msg_type_comps = msg_type.split(comp_sep) if msg_type else []
-        ack_msg_type = comp_sep.join(["ACK"] + msg_type_comps[1:]) if msg_type_comps else "ACK"
-    else:
-        field_sep = "|"
-        encoding_chars = "^~\\&"
-        comp_sep = "^"
-        sending_app = ""
-        sending_fac = ""
-        recv_app = ""
-        recv_fac = ""
-        processing_id = "P"
-        version_id = "2.3"
-        ack_msg_type = "ACK"
-    ack_id = uuid.uuid4().hex
-    control_id = message_id or (fields[9] if msh and len(fields) > 9 else "")
-    return (
-        f"MSH{field_sep}{encoding_chars}{field_sep}{recv_app}{field_sep}{recv_fac}"
-        f"{field_sep}{sending_app}{field_sep}{sending_fac}{field_sep}{ack_time}"
-        f"{field_sep}{field_sep}{ack_msg_type}{field_sep}{ack_id}{field_sep}{processing_id}"
-        f"{field_sep}{version_id}\r"
-        f"MSA{field_sep}AA{field_sep}{control_id}\r"
-    )
+def save_config(host, port):
+    _write_config({'HOST': host, 'PORT': port})
+
+def load_routing():
+    """Saved (endpoints, routes) from config.json; empty when none are configured."""
+    return routing_from_config(_read_config())
+
+def save_routing(endpoints, routes):
+    _write_config(routing_to_config(endpoints, routes))
+
+def routing_from_rows(endpoint_rows, route_rows):
+    """(endpoints, routes) from the routing editors' rows, skipping blank rows and cells."""
+    def filled(rows, required):
+        for row in rows:
+            row = {key: value for key, value in row.items()
+                   if value is not None and value != "" and not (isinstance(value, float) and math.isnan(value))}
+            if all(key in row for key in required):
+                yield row
+    return routing_from_config({"ENDPOINTS": list(filled(endpoint_rows, ("name", "host", "port"))),
+                                "ROUTES": list(filled(route_rows, ("endpoint",)))})
+
+def timing_file_path(uploaded):
+    """Save an uploaded replay timing file under a name derived from its content and return the path."""
+    data = uploaded.getvalue()
+    path = os.path.join(tempfile.gettempdir(), f"hl7-replay-timing-{hashlib.sha256(data).hexdigest()[:16]}.txt")
+    if not os.path.exists(path):
+        with open(path, 'wb') as f:
+            f.write(data)
+    return path
 
 def build_summary_rows(records, show_cycle):
-    """Build summary table rows from ACK records."""
+    """Build summary table rows from ACK records; rows whose ACK body was not kept have no preview."""
     rows = []
     for record in records:
-        preview = record["ack"].replace("\r", "\\r")
-        s = parse_ack_status(record["ack"])
-        label = {"AA": "\u2705 AA (Accept)", "AE": "\u26a0\ufe0f AE (Error)",
-                 "AR": "\u274c AR (Reject)"}.get(s, "\u26a0\ufe0f Unknown")
-        row = {"Message": record["message_idx"], "Attempt": record["attempt"],
-               "MSH-10": record["message_id"] or "", "Status": label,
+        preview = record.ack.replace("\r", "\\r") if record.ack is not None else ""
+        label = {"AA": "\u2705 AA (Accept)", "AE": "\u26a0\ufe0f AE (Error)", "AR": "\u274c AR (Reject)",
+                 ERROR_STATUS: "\U0001F6AB No ACK"}.get(record.status, "\u26a0\ufe0f Unknown")
+        row = {"Message": record.message_idx, "Attempt": record.attempt, "Retry": record.retry,
+               "MSH-10": record.message_id or "", "Status": label,
                "ACK Preview": (preview[:120] + "\u2026") if len(preview) > 120 else preview}
         if show_cycle:
-            row = {"Cycle": record["cycle"], **row}
+            row = {"Cycle": record.cycle, **row}
         rows.append(row)
     return rows
 
+def summary_rows_for(job, show_cycle):
+    """
+    Summary rows for a job, converting only the attempts added since the last render and keeping the
+    newest SUMMARY_ROWS, so redrawing a long run does not rebuild every row each time.
+    """
+    cache = st.session_state.setdefault("summary_rows", {})
+    entry = cache.get(job.job_id)
+    if entry is None or entry["show_cycle"] != show_cycle:
+        entry = cache[job.job_id] = {"show_cycle": show_cycle, "next": 0, "rows": deque(maxlen=SUMMARY_ROWS)}
+    records, entry["next"] = job.results["ack_records"].since(entry["next"])
+    entry["rows"].extend(build_summary_rows(records, show_cycle))
+    for job_id in [job_id for job_id in cache if registry.get(job_id) is None]:
+        del cache[job_id]
+    return list(entry["rows"])
+
+def latency_columns(histogram: LatencyHistogram):
+    """Return p50..p99.9, max and mean latency columns in milliseconds."""
+    return {f"{name} (ms)": round(value * 1000, 3)
+            for name, value in histogram.summary().items() if name != "count"}
+
 # --- Streamlit UI ---
 st.set_page_config(page_title="HL7 MLLP Test Sender", layout="wide")
 st.title("\U0001F4E4 HL7 MLLP Test Sender")
 
 if "metrics_history" not in st.session_state:
-    st.session_state["metrics_history"] = []
-if "send_results" not in st.session_state:
-    st.session_state["send_results"] = None
+    st.session_state["metrics_history"] = deque(maxlen=HISTORY_POINTS)
+if "selected_job_id" not in st.session_state:
+    st.session_state["selected_job_id"] = None
+
+
+@st.cache_resource
+def result_log():
+    return ResultLog(RESULTS_DB)
+
+
+@st.cache_resource
+def metrics_server(port: int):
+    """The /metrics endpoint, started once per port for the server process."""
+    return metrics.MetricsServer(port=port)
+
+
+@st.cache_resource
+def message_cache():
+    """Parsed and pre-encoded uploads and pasted text, shared across reruns and sessions."""
+    return MessageCache(max_bytes=int(PREPARED_CACHE_MB * 1024 * 1024))
+
+
+@st.cache_resource
+def job_registry():
+    """One registry per server process, so jobs keep running (and stay visible) across reruns."""
+    return JobRegistry(result_log=result_log())
+
+
+registry = job_registry()
 
 default_host, default_port = load_config()
 col1, col2, col3 = st.columns([1, 1, 1])
@@ -182,6 +181,178 @@ simulate_ack = st.checkbox(
     value=False,
     help="When enabled, returns a fake ACK without opening a socket."
 )
+templated = st.checkbox(
+    "Treat messages as templates",
+    value=False,
+    help="Each send renders a fresh variant: {{seq}} (or {{seq:8}} zero-padded), {{uuid}}, {{now}} "
+         "(or {{now:%Y%m%d}}), {{random:N}} digits and {{faker:name}} placeholders are filled in per send."
+)
+connection_mode = st.radio(
+    "Connection mode",
+    ["Pooled (keep-alive)", "Per-message"],
+    horizontal=True,
+    help="Pooled keeps MLLP connections open across attempts, repeats and cycles. "
+         "Per-message opens and closes a connection for every attempt."
+)
+use_pool = connection_mode.startswith("Pooled")
+wcol1, wcol2, wcol3, wcol4 = st.columns(4)
+window_size = wcol1.number_input(
+    "In-flight window", min_value=1, value=1, step=1,
+    help="Messages kept in flight on each connection before waiting for ACKs. "
+         "1 = stop-and-wait; ACKs are matched to requests by MSA-2 / MSH-10."
+)
+connection_count = wcol2.number_input(
+    "Parallel connections", min_value=1, value=1, step=1,
+    help="Messages are dealt round-robin across this many concurrent MLLP connections; "
+         "each connection keeps its own messages in order. Pooling does not apply above 1."
+)
+process_count = wcol3.number_input(
+    "Worker processes", min_value=1, value=1, step=1,
+    help="Shard messages across this many processes, each with its own connections, to use more "
+         "than one CPU core. Results and latency percentiles are merged live."
+)
+batch_size = wcol4.number_input(
+    "Batch size (FHS/BHS)", min_value=1, value=1, step=1,
+    help="Pack this many messages into each HL7 batch file (FHS/BHS ... BTS/FTS), sent as one MLLP frame "
+         "with one ACK. 1 sends every message on its own. Attempts and repeats then count batches; "
+         "compare msgs/sec and bytes per message against an unbatched run."
+)
+
+with st.expander("Open-loop load (target rate)"):
+    open_loop = st.checkbox(
+        "Send at a target rate without waiting for ACKs",
+        value=False,
+        help="Sends are paced by a token bucket; latency is measured from each send's scheduled time, "
+             "so a slow receiver shows up as higher latency rather than a quietly lower send rate."
+    )
+    lcol1, lcol2, lcol3 = st.columns(3)
+    load_profile = lcol1.selectbox("Profile", list(PROFILES))
+    target_rate = lcol2.number_input("Target rate (msg/s)", min_value=0.1, value=100.0, step=10.0)
+    load_seconds = lcol3.number_input("Run for (seconds)", min_value=0.1, value=10.0, step=1.0,
+                                      help="Length of each open-loop run (per cycle when scheduled).")
+    pcol1, pcol2, pcol3 = st.columns(3)
+    if load_profile == "ramp":
+        start_rate = pcol1.number_input("Start rate (msg/s)", min_value=0.0, value=0.0, step=10.0)
+        ramp_seconds = pcol2.number_input("Ramp over (seconds)", min_value=0.0, value=load_seconds / 2)
+        rate_profile = PROFILES["ramp"](start_rate, target_rate, ramp_seconds)
+    elif load_profile == "step":
+        steps = pcol1.number_input("Steps", min_value=1, value=4, step=1,
+                                   help="Rate climbs in equal steps up to the target rate.")
+        step_rates = [target_rate * (i + 1) / int(steps) for i in range(int(steps))]
+        rate_profile = PROFILES["step"](step_rates, load_seconds / int(steps))
+    elif load_profile == "spike":
+        spike_rate = pcol1.number_input("Spike rate (msg/s)", min_value=0.1, value=target_rate * 5, step=10.0)
+        spike_at = pcol2.number_input("Spike at (seconds)", min_value=0.0, value=load_seconds / 2)
+        spike_seconds = pcol3.number_input("Spike length (seconds)", min_value=0.0, value=1.0)
+        rate_profile = PROFILES["spike"](target_rate, spike_rate, spike_at, spike_seconds)
+    else:
+        rate_profile = PROFILES["constant"](target_rate)
+
+with st.expander("Traffic replay"):
+    replay = st.checkbox(
+        "Replay captured arrival times",
+        value=False,
+        help="Send each message once at its original arrival time, taken from MSH-7 or a timing file, "
+             "instead of as fast as possible. Sends are scheduled without waiting for ACKs, and the report "
+             "shows how far actual send times drifted from the schedule. Runs in a single process."
+    )
+    rpcol1, rpcol2 = st.columns(2)
+    replay_source = rpcol1.radio("Arrival times from", ["MSH-7 timestamps", "Timing file"], horizontal=True)
+    replay_speed = rpcol2.number_input("Speed-up", min_value=0.01, value=1.0, step=1.0,
+                                       help="1 = real time; 10 or 100 compress a captured day tenfold or a "
+                                            "hundredfold.")
+    timing_upload = None
+    if replay_source == "Timing file":
+        timing_upload = st.file_uploader(
+            "Timing file", type=["txt", "csv"], accept_multiple_files=False,
+            help="One line per message, in message order: seconds (epoch or relative) or an ISO 8601 "
+                 "timestamp in the first column.")
+
+with st.expander("Distributed agents"):
+    agent_input = st.text_input(
+        "Agent addresses",
+        placeholder="loadgen1:2580, loadgen2:2580",
+        help="Comma-separated host:port of running hl7-agent processes. When set, this app coordinates: "
+             "messages are dealt round-robin to the agents, each agent sends its share (with the options "
+             "above, and its share of any target rate) and metrics are merged here live."
+    )
+    agent_addresses = tuple(a.strip() for a in agent_input.split(",") if a.strip())
+
+with st.expander("Observability"):
+    ocol1, ocol2, ocol3 = st.columns(3)
+    expose_metrics = ocol1.checkbox(
+        "Expose Prometheus metrics", value=False,
+        help="Instrument the send path (sent/ACK/error/byte counters, DNS/connect/send/first-byte/ACK latency "
+             "histograms, in-flight and open-connection gauges) and serve it at /metrics for Grafana."
+    )
+    metrics_port = ocol2.number_input("Metrics port", min_value=1, max_value=65535, value=9464, step=1)
+    emit_spans = ocol3.checkbox("OpenTelemetry spans", value=False,
+                                help="One span per ACKed message keyed by MSH-10; needs opentelemetry-api.")
+    if expose_metrics:
+        try:
+            metrics_server(int(metrics_port))
+            metrics.enable(spans=emit_spans)
+            st.caption(f"Serving metrics on port {int(metrics_port)} at /metrics.")
+        except (OSError, ValueError) as e:
+            st.error(f"Metrics unavailable: {e}")
+    else:
+        metrics.disable()
+
+with st.expander("Routing (multiple endpoints)"):
+    use_routing = st.checkbox(
+        "Route messages to several endpoints",
+        value=False,
+        help="Send each message to the endpoint of the first matching route instead of Target Host/Port. "
+             "Endpoints run in parallel, each with its own connections and optional rate limit (msg/s, "
+             "0 = none), and results are broken down per endpoint."
+    )
+    saved_endpoints, saved_routes = load_routing()
+    endpoint_rows = st.data_editor(
+        pd.DataFrame([vars(e) for e in saved_endpoints], columns=["name", "host", "port", "max_rate"]),
+        num_rows="dynamic", hide_index=True, use_container_width=True, key="endpoint_editor",
+        column_config={"port": st.column_config.NumberColumn(min_value=1, max_value=65535, step=1),
+                       "max_rate": st.column_config.NumberColumn("max_rate (msg/s)", min_value=0.0)})
+    route_rows = st.data_editor(
+        pd.DataFrame([vars(r) for r in saved_routes],
+                     columns=["endpoint", "message_type", "receiving_application", "receiving_facility"]),
+        num_rows="dynamic", hide_index=True, use_container_width=True, key="route_editor",
+        column_config={"message_type": st.column_config.TextColumn(
+            "message_type (MSH-9)", help="e.g. ADT, ADT^A0*, OR[MU]^*; glob patterns, first match wins"),
+            "receiving_application": st.column_config.TextColumn("receiving_application (MSH-5)"),
+            "receiving_facility": st.column_config.TextColumn("receiving_facility (MSH-6)")})
+    routing_error = None
+    try:
+        endpoints, routes = routing_from_rows(endpoint_rows.to_dict("records"), route_rows.to_dict("records"))
+        Router(endpoints, routes)
+    except (KeyError, TypeError, ValueError) as e:
+        endpoints, routes, routing_error = (), (), f"Invalid routing: {e}"
+    if routing_error:
+        st.error(routing_error)
+    elif st.button("Save routing as default"):
+        save_routing(endpoints, routes)
+        st.success(f"Saved {len(endpoints)} endpoint(s) and {len(routes)} route(s).")
+
+with st.expander("Retries and circuit breaker"):
+    rtcol1, rtcol2, rtcol3 = st.columns(3)
+    retries = rtcol1.number_input(
+        "Retries per failed send", min_value=0, value=0, step=1,
+        help="Resend a try that fails with a connection error or timeout (keeping its MSH-10), waiting a "
+             "random backoff of up to base x 2^(retry-1) seconds first. Resends are counted and timed "
+             "separately from first tries. Not used by open-loop load or replay.")
+    retry_backoff = rtcol2.number_input("Backoff base (s)", min_value=0.0, value=0.1, step=0.1)
+    retry_max_backoff = rtcol3.number_input("Max backoff (s)", min_value=0.0, value=5.0, step=1.0)
+    retry_naks = st.checkbox("Also retry AE/AR NAKs", value=False)
+    bcol1, bcol2 = st.columns(2)
+    breaker_threshold = bcol1.number_input(
+        "Circuit breaker: consecutive failures", min_value=0, value=0, step=1,
+        help="After this many failed tries in a row (0 = off), stop sending to the endpoint for the reset "
+             "time, then probe it with one message. Each endpoint, worker and agent has its own breaker.")
+    breaker_reset = bcol2.number_input("Circuit breaker: reset (s)", min_value=0.1, value=30.0, step=5.0)
+    continue_on_error = st.checkbox(
+        "Continue on error",
+        value=False,
+        help="Record a send that fails after its retries as 'No ACK' and carry on, instead of stopping the "
+             "run at the first connection error; useful for long soak tests.")
 
 if st.button("Save Host/Port as Default"):
     save_config(host, int(port))
@@ -191,127 +362,169 @@ hl7_input = st.text_area("HL7 Message", height=300, placeholder="Paste your HL7
 uploaded_file = st.file_uploader("Or upload HL7 text file", type=["txt", "hl7"], accept_multiple_files=False)
 
 if st.button("Send HL7 Message"):
-    file_content = ""
+    # Uploads and pasted text are parsed and encoded once and cached by content, so sending the same
+    # input again starts right away; an upload too large for the cache is split lazily from its buffer.
+    hl7_messages = None
     if uploaded_file:
-        file_content = uploaded_file.getvalue().decode("utf-8", errors="replace")
-
-    input_source = file_content if file_content.strip() else hl7_input
-    hl7_messages = split_hl7_messages(input_source)
+        hl7_messages = message_cache().get(uploaded_file.getbuffer())
+        if hl7_messages is None:
+            hl7_messages = MessageSource.from_buffer(uploaded_file.getbuffer())
+    if hl7_messages is None or next(iter(hl7_messages), None) is None:
+        hl7_messages = message_cache().get(hl7_input)
+        if hl7_messages is None:
+            hl7_messages = split_hl7_messages(hl7_input)
+    template_error = None
+    if templated and hl7_messages:
+        try:
+            check_templates(hl7_messages)
+        except ValueError as e:
+            template_error = str(e)
+    agent_error = None
+    try:
+        for address in agent_addresses:
+            parse_agent(address)
+    except ValueError as e:
+        agent_error = str(e)
+    replay_error = None
+    if replay and open_loop:
+        replay_error = "Choose either open-loop load or traffic replay, not both."
+    elif replay and (int(process_count) > 1 or agent_addresses or use_routing):
+        replay_error = ("Traffic replay runs in a single process; set worker processes to 1, clear agents "
+                        "and turn routing off.")
+    elif int(batch_size) > 1 and (replay or templated):
+        replay_error = "Batch mode sends messages as given; turn off templates and traffic replay."
+    elif replay and replay_source == "Timing file" and timing_upload is None:
+        replay_error = "Upload a timing file, or replay by MSH-7 timestamps."
+    if use_routing and not routing_error and not endpoints:
+        routing_error = "Add at least one endpoint to route to."
     if not hl7_messages:
         st.warning("Please provide a valid HL7 message via text or file upload.")
+    elif use_routing and routing_error:
+        st.error(routing_error)
+    elif replay_error:
+        st.error(replay_error)
+    elif agent_error:
+        st.error(agent_error)
+    elif template_error:
+        st.error(f"Invalid template: {template_error}")
     else:
         num_cycles = math.floor(duration_minutes / interval_minutes) + 1 if scheduled_mode else 1
-        results = {
-            "ack_records": [],
-            "per_attempt_durations": [],
-            "batch_start_time": time.perf_counter(),
-            "batch_end_time": None,
-            "num_cycles": num_cycles,
-            "num_messages": len(hl7_messages),
-            "repeat_count": int(repeat_count),
-            "error_message": None,
-            "cancelled": False,
-        }
-        st.session_state["send_results"] = results
-
-        status_placeholder = st.empty()
-        stop_placeholder = st.empty()
-        live_table_placeholder = st.empty() if scheduled_mode else None
-
-        if scheduled_mode:
-            stop_placeholder.button("Stop Sending", key="stop_btn", type="secondary")
-
-        for cycle in range(1, num_cycles + 1):
-            if scheduled_mode:
-                status_placeholder.info(
-                    f"Cycle {cycle}/{num_cycles} — "
-                    f"sending {len(hl7_messages)} message(s) x {int(repeat_count)} repeat(s)..."
-                )
-            else:
-                status_placeholder.info(f"Sending {len(hl7_messages)} message(s) x {int(repeat_count)} repeat(s)...")
-
-            for msg_idx, message in enumerate(hl7_messages, start=1):
-                for attempt in range(1, int(repeat_count) + 1):
-                    attempt_start = time.perf_counter()
-                    message_to_send = message
-                    message_id = None
-                    if generate_message_id:
-                        message_id = uuid.uuid4().hex
-                        message_to_send = with_message_control_id(message_to_send, message_id)
-                    if simulate_ack:
-                        ack = build_fake_ack(message_to_send, message_id)
-                    else:
-                        ack = send_hl7_message(message_to_send, host, int(port))
-                    attempt_duration = time.perf_counter() - attempt_start
-                    if ack.startswith("Error:"):
-                        results["error_message"] = f"Cycle {cycle}, Message {msg_idx}, Attempt {attempt}: {ack}"
-                        break
-                    results["ack_records"].append({
-                        "cycle": cycle,
-                        "message_idx": msg_idx,
-                        "attempt": attempt,
-                        "ack": ack,
-                        "message_id": message_id,
-                        "duration": attempt_duration
-                    })
-                    results["per_attempt_durations"].append(attempt_duration)
-                if results["error_message"]:
-                    break
-            if results["error_message"]:
-                break
-
-            # Update live results table after each cycle
-            if live_table_placeholder and results["ack_records"]:
-                live_table_placeholder.dataframe(
-                    build_summary_rows(results["ack_records"], show_cycle=True),
-                    hide_index=True, use_container_width=True, height=240)
-
-            # Wait for next cycle if not the last one
-            if scheduled_mode and cycle < num_cycles:
-                wait_seconds = interval_minutes * 60
-                wait_end = time.perf_counter() + wait_seconds
-                while time.perf_counter() < wait_end:
-                    remaining = wait_end - time.perf_counter()
-                    mins, secs = divmod(int(remaining), 60)
-                    status_placeholder.info(
-                        f"Cycle {cycle}/{num_cycles} complete — "
-                        f"next send in {mins}:{secs:02d}"
-                    )
-                    time.sleep(min(1.0, remaining))
-
-        status_placeholder.empty()
-        stop_placeholder.empty()
-        if live_table_placeholder:
-            live_table_placeholder.empty()
-        results["batch_end_time"] = time.perf_counter()
-
-# --- Display results from session state ---
-results = st.session_state.get("send_results")
+        options = SendOptions(
+            host=host,
+            port=int(port),
+            repeat_count=int(repeat_count),
+            num_cycles=num_cycles,
+            interval_seconds=interval_minutes * 60,
+            generate_message_id=generate_message_id,
+            simulate_ack=simulate_ack,
+            use_pool=use_pool,
+            window=int(window_size),
+            connections=int(connection_count),
+            rate_profile=rate_profile if open_loop else None,
+            load_seconds=load_seconds,
+            templated=templated,
+            processes=int(process_count),
+            agents=agent_addresses,
+            replay=replay,
+            replay_speed=replay_speed,
+            replay_timing=timing_file_path(timing_upload) if replay and timing_upload else None,
+            endpoints=endpoints if use_routing else (),
+            routes=routes if use_routing else (),
+            retries=int(retries),
+            retry_backoff=retry_backoff,
+            retry_max_backoff=retry_max_backoff,
+            retry_naks=retry_naks,
+            breaker_threshold=int(breaker_threshold),
+            breaker_reset_seconds=breaker_reset,
+            continue_on_error=continue_on_error,
+            batch_size=int(batch_size),
+        )
+        target = f"{len(endpoints)} endpoints" if use_routing else f"{host}:{int(port)}"
+        label = uploaded_file.name if uploaded_file else target
+        job = registry.submit(hl7_messages, options,
+                              len(hl7_messages) if isinstance(hl7_messages, list) else None, label=label)
+        st.session_state["selected_job_id"] = job.job_id
+
+
+@st.fragment(run_every=1.0)
+def show_jobs():
+    """Live view of running and recent jobs; reruns the page once the selected job finishes."""
+    jobs = registry.jobs()
+    if not jobs:
+        return
+    st.subheader("\u23f3 Send Jobs")
+    for job in jobs:
+        jcol1, jcol2, jcol3, jcol4 = st.columns([1, 3, 5, 1])
+        jcol1.write(f"#{job.job_id}")
+        jcol2.write(job.label)
+        jcol3.write(f"{job.status_text} \u2014 {job.results['ack_records'].total} attempt(s)")
+        if job.running and jcol4.button("Stop", key=f"stop_job_{job.job_id}"):
+            job.cancel()
+    selected = registry.get(st.session_state.get("selected_job_id"))
+    if selected is None:
+        return
+    if selected.running and selected.results["ack_records"]:
+        # Same definitions as the final report, computed from the live log and histogram on each refresh.
+        live = selected.results
+        elapsed = time.perf_counter() - live["batch_start_time"]
+        latency = live["histogram"].summary()
+        lcol1, lcol2, lcol3, lcol4 = st.columns(4)
+        lcol1.metric("Messages/sec", f"{live['ack_records'].messages / elapsed if elapsed > 0 else 0:.2f}")
+        lcol2.metric("Avg send time (ms)", f"{latency['mean'] * 1000:.2f}")
+        lcol3.metric("p50 (ms)", f"{latency['p50'] * 1000:.2f}")
+        lcol4.metric("p99 (ms)", f"{latency['p99'] * 1000:.2f}")
+        st.dataframe(summary_rows_for(selected, show_cycle=selected.results["num_cycles"] > 1)[-LIVE_ROWS:],
+                     hide_index=True, use_container_width=True, height=240)
+    if selected.done and st.session_state.get("rendered_job") != (selected.job_id, True):
+        st.rerun()
+
+
+# --- Display results of the selected job ---
+finished = [job for job in registry.jobs() if job.done]
+if len(finished) > 1:
+    ids = [job.job_id for job in finished]
+    current = st.session_state.get("selected_job_id")
+    st.session_state["selected_job_id"] = st.selectbox(
+        "Show results for job", ids, index=ids.index(current) if current in ids else 0,
+        format_func=lambda job_id: f"#{job_id} {registry.get(job_id).label}")
+selected_job = registry.get(st.session_state.get("selected_job_id"))
+if selected_job:
+    st.session_state["rendered_job"] = (selected_job.job_id, selected_job.done)
+# Rendered after the state above so a full run never triggers the fragment's own rerun.
+show_jobs()
+# A running job is shown live by the jobs panel; the full report waits until it finishes.
+results = selected_job.results if selected_job and selected_job.done else None
 if results and results["ack_records"]:
     ack_records = results["ack_records"]
-    per_attempt_durations = results["per_attempt_durations"]
+    histogram = results["histogram"]
     num_cycles = results["num_cycles"]
     rpt = results["repeat_count"]
     batch_end = results["batch_end_time"] or time.perf_counter()
-    cancelled = results["batch_end_time"] is None
-
-    total_expected = results["num_messages"] * rpt * num_cycles
-    attempts_info = f"Sent {len(ack_records)} message attempt(s) successfully."
+    cancelled = results["cancelled"] or selected_job.cancelled
+
+    num_messages = results["num_messages"] or 0
+    total_expected = num_messages * rpt * num_cycles
+    attempts_info = f"Sent {ack_records.total} message attempt(s) successfully."
+    if ack_records.retries or ack_records.errors:
+        attempts_info = (f"Sent {ack_records.total} message attempt(s): {ack_records.retries} resend(s), "
+                         f"{ack_records.errors} without an ACK.")
     if cancelled:
         attempts_info += " Cancelled by user."
-    elif total_expected > len(ack_records):
+    elif total_expected > ack_records.total and not results["rate_reports"]:
         attempts_info += " Stopped early due to an error."
     st.info(attempts_info)
 
-    last_ack = ack_records[-1]["ack"]
-    last_message_id = ack_records[-1]["message_id"]
-    status = parse_ack_status(last_ack)
+    last_ack = ack_records.last_ack
+    last_message_id = ack_records[-1].message_id
+    status = ack_records[-1].status
     if status == "AA":
         st.success("\u2705 ACK Status: AA (Application Accept)")
     elif status == "AE":
         st.error("\u274c ACK Status: AE (Application Error)")
     elif status == "AR":
         st.error("\u274c ACK Status: AR (Application Reject)")
+    elif status == ERROR_STATUS:
+        st.error(f"\U0001F6AB No ACK: {ack_records[-1].text}")
     else:
         st.warning(f"\u26a0\ufe0f Unknown ACK status: {status}")
     if last_message_id:
@@ -326,32 +539,161 @@ if results and results["ack_records"]:
     for segment in segments:
         st.text(segment)
 
-    if rpt > 1 or results["num_messages"] > 1 or num_cycles > 1:
+    if rpt > 1 or num_messages > 1 or num_cycles > 1:
         st.subheader("\U0001F4CA ACK Summary")
-        summary_rows = build_summary_rows(ack_records, show_cycle=num_cycles > 1)
-        had_failures = any(parse_ack_status(r["ack"]) != "AA" for r in ack_records)
+        summary_rows = summary_rows_for(selected_job, show_cycle=num_cycles > 1)
+        had_failures = ack_records.failures > 0
+        if len(summary_rows) < ack_records.total:
+            st.caption(f"Showing the latest {len(summary_rows)} of {ack_records.total} attempts; "
+                       f"ACK previews are kept for failures and a sample of successes.")
         st.dataframe(summary_rows, hide_index=True, use_container_width=True, height=240)
         if had_failures:
             st.warning("Some ACKs indicate errors or rejects. Check the summary and raw ACK for details.")
 
-    total_attempts = len(ack_records)
+        with st.expander("ACK analysis", expanded=had_failures):
+            frame = ack_frame(ack_records)
+            if ack_records.dropped:
+                st.caption(f"Breakdowns cover the latest {len(ack_records)} attempts; "
+                           f"status totals cover all {ack_records.total}.")
+            counts = sorted(ack_records.status_counts.items())
+            for scol, (ack_status, count) in zip(st.columns(len(counts)), counts):
+                scol.metric(f"{ack_status} ACKs", count)
+            acol1, acol2 = st.columns(2)
+            acol1.caption("By cycle")
+            acol1.dataframe(status_counts_by(frame, "cycle"), use_container_width=True, height=200)
+            acol2.caption("By message")
+            acol2.dataframe(status_counts_by(frame, "message_idx"), use_container_width=True, height=200)
+            errors = top_error_codes(frame)
+            if not errors.empty:
+                st.caption("Top error codes")
+                st.dataframe(errors, hide_index=True)
+            nak_rate = nak_rate_over_time(frame)
+            if had_failures and len(nak_rate) > 1:
+                st.caption("NAK rate over time (seconds since first attempt)")
+                st.line_chart(nak_rate)
+
+    # Throughput and latency cover first tries that got an ACK; resends are counted and timed on their own below.
+    # Messages are counted inside batches, so batched and unbatched runs compare directly.
     total_elapsed = max(batch_end - results["batch_start_time"], 0)
-    messages_per_sec = (total_attempts / total_elapsed) if total_elapsed > 0 else 0
-    avg_time_ms = (sum(per_attempt_durations) / total_attempts * 1000) if total_attempts else 0
+    messages_per_sec = (ack_records.messages / total_elapsed) if total_elapsed > 0 else 0
+    bytes_per_sec = (ack_records.bytes_sent / total_elapsed) if total_elapsed > 0 else 0
+    bytes_per_message = ack_records.bytes_sent / ack_records.messages if ack_records.messages else 0
+    avg_time_ms = histogram.mean * 1000
 
     st.subheader("\U0001F4C8 Metrics")
-    mcol1, mcol2 = st.columns(2)
+    mcol1, mcol2, mcol3 = st.columns(3)
     mcol1.metric("Messages/sec", f"{messages_per_sec:.2f}")
     mcol2.metric("Avg send time (ms)", f"{avg_time_ms:.2f}")
-
-    st.session_state["metrics_history"].append({
-        "timestamp": time.strftime("%H:%M:%S"),
-        "messages_per_sec": messages_per_sec,
-        "avg_time_ms": avg_time_ms
-    })
-    history_df = pd.DataFrame(st.session_state["metrics_history"])
+    if results["connects"] is not None:
+        mcol3.metric("Connections opened", results["connects"],
+                     help="New TCP connections opened during this run, pooled or parallel.")
+    bcol1, bcol2, bcol3 = st.columns(3)
+    bcol1.metric("Bytes/sec", f"{bytes_per_sec:,.0f}", help="Framed bytes written per second, resends included.")
+    bcol2.metric("Bytes per message", f"{bytes_per_message:,.0f}",
+                 help="Framed bytes written per HL7 message, including MLLP framing and any batch envelope.")
+    if ack_records.messages != ack_records.acked_attempts:
+        bcol3.metric("Messages per frame", f"{ack_records.messages / max(ack_records.acked_attempts, 1):.1f}")
+    latency = histogram.summary()
+    pcols = st.columns(6)
+    for pcol, name in zip(pcols, ("p50", "p90", "p95", "p99", "p99.9", "max")):
+        pcol.metric(f"{name} (ms)", f"{latency[name] * 1000:.2f}")
+    phase_rows = [{"Phase": PHASE_LABELS[phase], "Attempts": h.total, **latency_columns(h)}
+                  for phase, h in results["phase_histograms"].items() if h.total]
+    if phase_rows:
+        st.caption("Where the time went (stop-and-wait sends; DNS and connect are 0 on reused connections)")
+        st.dataframe(phase_rows + [{"Phase": "Full ACK", "Attempts": histogram.total, **latency_columns(histogram)}],
+                     hide_index=True, use_container_width=True)
+    if ack_records.retries or ack_records.errors or results["breaker_trips"]:
+        rtcol1, rtcol2, rtcol3 = st.columns(3)
+        rtcol1.metric("Resends", ack_records.retries)
+        rtcol2.metric("Tries without an ACK", ack_records.errors)
+        rtcol3.metric("Circuit breaker trips", results["breaker_trips"])
+        retry_histogram = results["retry_histogram"]
+        if retry_histogram.total:
+            st.dataframe([{"Tries": "First tries", "Attempts": histogram.total, **latency_columns(histogram)},
+                          {"Tries": "Resends", "Attempts": retry_histogram.total,
+                           **latency_columns(retry_histogram)}],
+                         hide_index=True, use_container_width=True)
+    if results["endpoints"]:
+        st.caption("Per endpoint")
+        breakdown = []
+        for name, endpoint_results in results["endpoints"].items():
+            log = endpoint_results["ack_records"]
+            elapsed = (endpoint_results["batch_end_time"] or batch_end) - endpoint_results["batch_start_time"]
+            breakdown.append({
+                "Endpoint": name, "Attempts": log.total, "Failures": log.failures,
+                "Messages/sec": round(log.messages / elapsed, 2) if elapsed > 0 else 0.0,
+                "Bytes/sec": round(log.bytes_sent / elapsed) if elapsed > 0 else 0,
+                **latency_columns(endpoint_results["histogram"]),
+                "Error": endpoint_results["error_message"] or ""})
+        st.dataframe(breakdown, hide_index=True, use_container_width=True)
+    if num_cycles > 1:
+        st.dataframe([{"Cycle": idx, "Attempts": h.total, **latency_columns(h)}
+                      for idx, h in enumerate(results["cycle_histograms"], start=1)],
+                     hide_index=True, use_container_width=True)
+    distribution = pd.DataFrame(
+        [(f"{upper * 1000:.3f}", count) for upper, count in histogram.buckets()],
+        columns=["latency_ms", "attempts"])
+    if not distribution.empty:
+        st.caption("Latency distribution (bucket upper bound, ms)")
+        st.bar_chart(distribution.set_index("latency_ms"), sort=False)
+    if results["rate_reports"]:
+        reports = results["rate_reports"]
+        scheduled = sum(r["scheduled"] for r in reports)
+        rcol1, rcol2, rcol3, rcol4 = st.columns(4)
+        rcol1.metric("Target rate (msg/s)", f"{sum(r['target_rate'] for r in reports) / len(reports):.2f}")
+        rcol2.metric("Achieved rate (msg/s)", f"{sum(r['achieved_rate'] for r in reports) / len(reports):.2f}",
+                     help="ACKed messages per second of wall time, averaged over cycles.")
+        rcol3.metric("p99 send lag (ms)", f"{max(r['p99_send_lag'] for r in reports) * 1000:.3f}",
+                     help="How far sends drifted from their scheduled time, 99th percentile (worst cycle).")
+        rcol4.metric("Max send lag (ms)", f"{max(r['max_send_lag'] for r in reports) * 1000:.2f}",
+                     help="Largest gap between a message's scheduled and actual send time.")
+        if scheduled > sum(r["completed"] for r in reports):
+            st.warning(f"{scheduled - sum(r['completed'] for r in reports)} of {scheduled} scheduled sends "
+                       f"were not ACKed.")
+
+    # One history point per finished job, however often the page reruns.
+    recorded = st.session_state.setdefault("history_job_ids", set())
+    if selected_job.done and selected_job.job_id not in recorded:
+        recorded.add(selected_job.job_id)
+        st.session_state["metrics_history"].append({
+            "timestamp": time.strftime("%H:%M:%S"),
+            "messages_per_sec": messages_per_sec,
+            "avg_time_ms": avg_time_ms,
+            "p99_ms": latency["p99"] * 1000
+        })
+    history_df = pd.DataFrame(list(st.session_state["metrics_history"]))
     if not history_df.empty:
         st.line_chart(history_df.set_index("timestamp"))
 
     if results["error_message"]:
         st.error(results["error_message"])
+
+# --- Saved run history (read from the results database only when asked) ---
+st.subheader("\U0001F5C2 Run History")
+if st.toggle("Load saved runs", value=False, help=f"Every run is logged to {RESULTS_DB}."):
+    saved_runs = pd.DataFrame(result_log().runs(limit=HISTORY_RUNS))
+    if saved_runs.empty:
+        st.caption("No saved runs yet.")
+    else:
+        saved_runs["started"] = pd.to_datetime(saved_runs["started_at"], unit="s")
+        saved_runs["run"] = "#" + saved_runs["run_id"].astype(str) + " " + saved_runs["label"].fillna("")
+        st.dataframe(saved_runs[["run_id", "label", "started", "status", "attempts", "failures", "msgs_per_sec",
+                                 "p50_ms", "p99_ms", "p999_ms", "max_ms", "bytes", "error_message"]],
+                     hide_index=True, use_container_width=True, height=240)
+        compare = st.multiselect("Compare runs", saved_runs["run"].tolist(), default=saved_runs["run"].tolist()[:5])
+        if compare:
+            chosen = saved_runs[saved_runs["run"].isin(compare)].set_index("run")
+            ccol1, ccol2 = st.columns(2)
+            ccol1.caption("Throughput (msg/s)")
+            ccol1.bar_chart(chosen[["msgs_per_sec"]])
+            ccol2.caption("Latency percentiles (ms)")
+            ccol2.bar_chart(chosen[["p50_ms", "p90_ms", "p99_ms", "p999_ms"]], stack=False)
+        inspect = st.selectbox("Inspect attempts of run", [None] + saved_runs["run_id"].tolist(),
+                               format_func=lambda run_id: "\u2014" if run_id is None else
+                               saved_runs.set_index("run_id").loc[run_id, "run"])
+        if inspect is not None:
+            attempts = result_log().attempts(inspect, limit=SUMMARY_ROWS)
+            st.dataframe(attempts, hide_index=True, use_container_width=True, height=240)
+            if len(attempts) == SUMMARY_ROWS:
+                st.caption(f"Showing the first {SUMMARY_ROWS} attempts; query {RESULTS_DB} for the rest.")
@@ -0,0 +1,208 @@
+"""
+End-to-end sender benchmarks against the local mock receiver.
+
+Each scenario runs in a fresh spawned process so its peak RSS is its own, sends through
+runner.run_send exactly as the UI and CLI do, and reports msgs/sec, bytes/sec, p50/p99 latency and
+peak RSS as JSON so runs can be compared across commits. Latency is per frame, so the batched
+scenario's is per batch of messages.
+"""
+import argparse
+import base64
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from queue import Empty
+
+from hl7 import MessageSource
+from mllp import ConnectionPool
+from receiver import ThreadedReceiver
+from runner import SendOptions, new_results, run_send
+
+TINY_ADT = (
+    "MSH|^~\\&|SND|SNDFAC|RCV|RCVFAC|20250101120000||ADT^A01|MSG0001|P|2.5\r"
+    "EVN|A01|20250101120000\r"
+    "PID|1||123456^^^HOSP^MR||DOE^JOHN||19800101|M\r"
+    "PV1|1|I|4W^401^1"
+)
+
+# (name, body bytes of the embedded OBX payload, messages per full run)
+SIZES = {
+    "tiny": (0, 5000),
+    "medium": (10_000, 1000),
+    "large": (1_000_000, 40),
+}
+
+# (name, SendOptions overrides, stream the input from a file)
+SCENARIOS = {
+    "stop_and_wait": ({"use_pool": False}, False),
+    "pooled": ({"use_pool": True}, False),
+    "pipelined": ({"window": 32}, False),
+    "multi_connection": ({"connections": 4, "window": 32}, False),
+    "multi_process": ({"processes": 2, "window": 32}, False),
+    "streaming_file": ({"window": 32}, True),
+    "batched": ({"window": 4, "batch_size": 100}, False),
+}
+# How often run_isolated checks that a scenario's process is still alive.
+POLL_SECONDS = 1.0
+
+
+def build_message(payload_bytes: int):
+    """Return a tiny ADT, or an ORU carrying a base64 'PDF' of roughly payload_bytes in OBX-5."""
+    if not payload_bytes:
+        return TINY_ADT
+    pdf = b"%PDF-1.4\n" + os.urandom(payload_bytes * 3 // 4)
+    return (
+        "MSH|^~\\&|SND|SNDFAC|RCV|RCVFAC|20250101120000||ORU^R01|MSG0001|P|2.5\r"
+        "PID|1||123456^^^HOSP^MR||DOE^JOHN||19800101|M\r"
+        "OBR|1||RPT1|PDF^Report\r"
+        f"OBX|1|ED|PDF^Report||^application^pdf^Base64^{base64.b64encode(pdf).decode()}||||||F"
+    )
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process in MB (ru_maxrss is KB on Linux, bytes on macOS)."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def run_scenario(scenario: str, size: str, port: int, scale=1.0):
+    """Run one scenario/size against the receiver on port and return its result row."""
+    overrides, streamed = SCENARIOS[scenario]
+    payload_bytes, count = SIZES[size]
+    count = max(1, int(count * scale))
+    message = build_message(payload_bytes)
+    options = SendOptions(host="127.0.0.1", port=port, **overrides)
+    pool = ConnectionPool()
+    with tempfile.TemporaryDirectory() as tmp:
+        if streamed:
+            path = os.path.join(tmp, "batch.hl7")
+            with open(path, "w") as f:
+                for _ in range(count):
+                    f.write(message.replace("\r", "\n") + "\n")
+            del message
+            messages = MessageSource.from_paths([path])
+        else:
+            messages = [message] * count
+        results = new_results(count if not streamed else None, options, pool)
+        run_send(messages, options, results, pool=pool)
+    pool.close()
+    elapsed = results["batch_end_time"] - results["batch_start_time"]
+    sent = results["ack_records"].messages
+    latency = results["histogram"].summary()
+    return {
+        "scenario": scenario,
+        "size": size,
+        "message_bytes": payload_bytes,
+        "messages": sent,
+        "errors": results["error_message"],
+        "elapsed_s": round(elapsed, 4),
+        "msgs_per_sec": round(sent / elapsed, 2) if elapsed > 0 else 0.0,
+        "bytes_per_sec": round(results["ack_records"].bytes_sent / elapsed) if elapsed > 0 else 0,
+        "p50_ms": round(latency["p50"] * 1000, 3),
+        "p99_ms": round(latency["p99"] * 1000, 3),
+        "max_ms": round(latency["max"] * 1000, 3),
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+    }
+
+
+def _scenario_worker(queue, scenario, size, port, scale):
+    try:
+        queue.put(run_scenario(scenario, size, port, scale))
+    except Exception as e:
+        queue.put({"scenario": scenario, "size": size, "errors": f"Error: {e}"})
+
+
+def run_isolated(scenario: str, size: str, port: int, scale=1.0, target=_scenario_worker):
+    """
+    Run a scenario in a freshly spawned process so peak RSS reflects that scenario alone. A process
+    that dies without reporting (killed, out of memory, a crash) yields a failed row instead of a hang.
+    """
+    ctx = multiprocessing.get_context("spawn")
+    queue = ctx.Queue()
+    proc = ctx.Process(target=target, args=(queue, scenario, size, port, scale))
+    proc.start()
+    result = None
+    while result is None:
+        # Checked before waiting: a process that had exited flushed anything it put, so one more empty wait is final.
+        exited = proc.exitcode is not None
+        try:
+            result = queue.get(timeout=POLL_SECONDS)
+        except Empty:
+            if exited:
+                result = {"scenario": scenario, "size": size,
+                          "errors": f"Error: benchmark process exited with code {proc.exitcode} before reporting"}
+    proc.join()
+    return result
+
+
+def git_commit():
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                             cwd=os.path.dirname(os.path.abspath(__file__)), check=True)
+        return out.stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(current, baseline):
+    """Return lines showing msgs/sec and p99 change per scenario/size against a baseline report."""
+    base = {(r["scenario"], r["size"]): r for r in baseline["results"]}
+    lines = []
+    for row in current["results"]:
+        old = base.get((row["scenario"], row["size"]))
+        if not old or "msgs_per_sec" not in row or "msgs_per_sec" not in old:
+            continue
+        rate = (row["msgs_per_sec"] / old["msgs_per_sec"] - 1) * 100 if old["msgs_per_sec"] else 0.0
+        p99 = (row["p99_ms"] / old["p99_ms"] - 1) * 100 if old["p99_ms"] else 0.0
+        lines.append(f"{row['scenario']:>16} {row['size']:>6}  msgs/s {rate:+7.1f}%  p99 {p99:+7.1f}%")
+    return lines
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("-o", "--output", help="Write the JSON report here (default: stdout).")
+    parser.add_argument("--scenario", action="append", choices=list(SCENARIOS),
+                        help="Scenario to run; repeat for several (default: all).")
+    parser.add_argument("--size", action="append", choices=list(SIZES),
+                        help="Message size to run; repeat for several (default: all).")
+    parser.add_argument("--scale", type=float, default=1.0, help="Multiply message counts, e.g. 0.1 for a smoke run.")
+    parser.add_argument("--compare", help="Baseline JSON report to diff against.")
+    args = parser.parse_args(argv)
+
+    report = {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "scale": args.scale,
+        "results": [],
+    }
+    with ThreadedReceiver() as server:
+        for scenario in args.scenario or SCENARIOS:
+            for size in args.size or SIZES:
+                row = run_isolated(scenario, size, server.port, args.scale)
+                report["results"].append(row)
+                print(f"{scenario:>16} {size:>6}  {row.get('msgs_per_sec', 0):>10} msg/s  "
+                      f"p50 {row.get('p50_ms', 0)} ms  p99 {row.get('p99_ms', 0)} ms  "
+                      f"rss {row.get('peak_rss_mb', 0)} MB", file=sys.stderr)
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    if args.compare:
+        with open(args.compare) as f:
+            print("\n".join(compare(report, json.load(f))), file=sys.stderr)
+    return 1 if any(r.get("errors") for r in report["results"]) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,69 @@
+"""
+Warm-start cache of parsed and pre-encoded message sets, so re-sending the same upload or pasted text
+(or changing only repeat, rate, batch size or other settings) starts right away instead of splitting
+and encoding it again.
+
+Entries are keyed by a SHA-256 of the raw content, held as runner.PreparedMessages and evicted least
+recently used first once their estimated size passes max_bytes. Batch runs pack their batches from
+the cached messages, so one entry serves every batch size. Content too large to fit the budget on
+its own is not cached; the caller streams it lazily as before.
+"""
+import hashlib
+import io
+import threading
+from collections import OrderedDict
+
+from hl7 import iter_hl7_messages
+from runner import PreparedMessages
+
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+# Prepared messages hold their text and encoded forms; content larger than max_bytes / EXPANSION is not cached.
+EXPANSION = 4
+
+
+class MessageCache:
+    """A size-bounded LRU map from content hash to PreparedMessages; thread-safe."""
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, data):
+        """
+        PreparedMessages for data (the bytes of an upload, or pasted text), parsing and encoding it on
+        a miss; None when data is too large to cache. An empty list means data holds no messages.
+        """
+        if isinstance(data, str):
+            data = data.encode()
+        if len(data) * EXPANSION > self.max_bytes:
+            return None
+        key = hashlib.sha256(data).hexdigest()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry
+            self.misses += 1
+        # Parse outside the lock so one large miss does not hold up hits on other content.
+        entry = PreparedMessages(iter_hl7_messages(io.BytesIO(data)))
+        with self._lock:
+            if key not in self._entries:
+                self._entries[key] = entry
+                self.nbytes += entry.nbytes
+                while self.nbytes > self.max_bytes and len(self._entries) > 1:
+                    _, evicted = self._entries.popitem(last=False)
+                    self.nbytes -= evicted.nbytes
+            return self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
@@ -0,0 +1,188 @@
+import asyncio
+import time
+from collections import OrderedDict
+from contextlib import suppress
+
+from framing import MLLP_START_BLOCK, MLLP_END_BLOCK, as_buffers
+from hl7 import parse_ack
+import metrics
+
+
+def shard(items, connections: int):
+    """Deal items round-robin into per-connection lists of (index, item), preserving order within each."""
+    shards = [[] for _ in range(max(1, int(connections)))]
+    for idx, item in enumerate(items):
+        shards[idx % len(shards)].append((idx, item))
+    return [s for s in shards if s]
+
+
+class Engine:
+    """
+    Up to `connections` parallel MLLP connections that stay open across send() calls, so a run that
+    sends in chunks (to keep lazy sources lazy, or to pace a rate cap) pays for its connects once.
+    A connection that fails or is closed by the peer is dropped and reopened by the next call;
+    connects counts every connection opened. Use it as a context manager, or call close().
+    """
+
+    def __init__(self, host: str, port: int, connections=4, window=1, timeout=10):
+        self.host = host
+        self.port = port
+        self.window = max(1, int(window))
+        self.timeout = timeout
+        self.connects = 0
+        self._streams = [None] * max(1, int(connections))
+        self._runner = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def send(self, messages, written: list | None = None, infos: list | None = None):
+        """Blocking send_async for callers without an event loop; keeps its loop for the next call."""
+        if self._runner is None:
+            self._runner = asyncio.Runner()
+        return self._runner.run(self.send_async(messages, written, infos))
+
+    async def send_async(self, messages, written: list | None = None, infos: list | None = None):
+        """
+        Send (message_id, message) pairs across the connections; each message may be anything
+        mllp.send_hl7_message accepts. Messages are dealt round-robin so each connection sends its
+        share in input order; at most connections * window frames are outstanding at once. Returns
+        (ack, latency_seconds) per input, in input order, with "Error: ..." acks for attempts that
+        never completed. written, when given, is a list with a flag per input, set to True once that
+        input's frame has been written; infos, when given, gets the hl7.AckInfo of each input's ACK.
+        """
+        messages = list(messages)
+        results = [None] * len(messages)
+        await asyncio.gather(*(self._run_connection(slot, items, results, written, infos)
+                               for slot, items in enumerate(shard(messages, len(self._streams)))))
+        return results
+
+    def close(self):
+        if self._runner is not None:
+            self._runner.run(self.aclose())
+            self._runner.close()
+            self._runner = None
+
+    async def aclose(self):
+        writers = [streams[1] for streams in self._streams if streams is not None]
+        for slot in range(len(self._streams)):
+            self._drop(slot)
+        for writer in writers:
+            with suppress(Exception):
+                await writer.wait_closed()
+
+    def _drop(self, slot: int):
+        streams, self._streams[slot] = self._streams[slot], None
+        if streams is not None:
+            streams[1].close()
+            telemetry = metrics.active()
+            if telemetry is not None:
+                telemetry.disconnected()
+
+    async def _connection(self, slot: int):
+        """The open (reader, writer) for slot, connecting first when it has none or the peer closed it."""
+        streams = self._streams[slot]
+        if streams is not None:
+            # Give the loop a turn to poll the socket, so a close that arrived while idle shows as EOF.
+            for _ in range(2):
+                await asyncio.sleep(0)
+        if streams is not None and not (streams[0].at_eof() or streams[1].is_closing()):
+            return streams
+        self._drop(slot)
+        connect_start = time.perf_counter()
+        streams = await asyncio.wait_for(asyncio.open_connection(self.host, self.port), self.timeout)
+        self.connects += 1
+        telemetry = metrics.active()
+        if telemetry is not None:
+            telemetry.connected(time.perf_counter() - connect_start)
+        self._streams[slot] = streams
+        return streams
+
+    async def _run_connection(self, slot: int, items, results, written=None, infos=None):
+        """
+        Send one shard of (index, (message_id, message)) over one connection, in order, keeping up to
+        window frames in flight and matching ACKs back by MSA-2.
+        """
+        in_flight = OrderedDict()
+        slots = asyncio.Semaphore(self.window)
+        telemetry = metrics.active()
+
+        async def read_acks(reader):
+            try:
+                while in_flight or pending_sends:
+                    frame = await asyncio.wait_for(reader.readuntil(MLLP_END_BLOCK), self.timeout)
+                    received = time.perf_counter()
+                    ack = frame[:-len(MLLP_END_BLOCK)].lstrip(MLLP_START_BLOCK).decode()
+                    info = parse_ack(ack)
+                    key = info.control_id or None
+                    if key not in in_flight:
+                        key = next(iter(in_flight), None)
+                        if key is None:
+                            continue
+                    idx, sent_at = in_flight.pop(key)
+                    results[idx] = (ack, received - sent_at)
+                    if infos is not None:
+                        infos[idx] = info
+                    if telemetry is not None:
+                        telemetry.in_flight_changed(-1)
+                    slots.release()
+            finally:
+                # Unblock the sender so it notices the reader has stopped.
+                for _ in range(self.window):
+                    slots.release()
+
+        pending_sends = len(items)
+        try:
+            reader, writer = await self._connection(slot)
+            reader_task = asyncio.create_task(read_acks(reader))
+            try:
+                for idx, (message_id, message) in items:
+                    await slots.acquire()
+                    if reader_task.done():
+                        break
+                    key = message_id if message_id is not None else ("#", idx)
+                    sent_at = time.perf_counter()
+                    in_flight[key] = (idx, sent_at)
+                    if telemetry is not None:
+                        telemetry.in_flight_changed(1)
+                    pending_sends -= 1
+                    buffers = as_buffers(message)
+                    writer.writelines(buffers)
+                    await writer.drain()
+                    if written is not None:
+                        written[idx] = True
+                    if telemetry is not None:
+                        telemetry.frame_sent(sum(map(len, buffers)), time.perf_counter() - sent_at)
+                await reader_task
+            finally:
+                reader_task.cancel()
+        except Exception as e:
+            error = f"Error: {e or type(e).__name__}"
+            for idx, _ in items:
+                if results[idx] is None:
+                    results[idx] = (error, 0.0)
+            # The stream may hold late ACKs or be half-closed; the next call starts on a fresh connection.
+            self._drop(slot)
+        finally:
+            if telemetry is not None:
+                telemetry.in_flight_changed(-len(in_flight))
+
+
+async def send_messages(messages, host: str, port: int, connections=4, window=1, timeout=10):
+    """
+    Send (message_id, message) pairs once over fresh connections (see Engine.send_async), closing
+    them afterwards.
+    """
+    engine = Engine(host, port, connections=connections, window=window, timeout=timeout)
+    try:
+        return await engine.send_async(messages)
+    finally:
+        await engine.aclose()
+
+
+def send_messages_sync(messages, host: str, port: int, connections=4, window=1, timeout=10):
+    """Blocking wrapper around send_messages for callers without an event loop."""
+    return asyncio.run(send_messages(messages, host, port, connections=connections, window=window, timeout=timeout))
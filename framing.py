@@ -0,0 +1,207 @@
+import time
+
+from hl7 import with_message_control_id
+from hl7parse import DEFAULT_ENCODING, HL7Message
+import metrics
+
+MLLP_START_BLOCK = b'\x0b'
+MLLP_END_BLOCK = b'\x1c\r'
+
+# Never appears in HL7 text, so it can mark where MSH-10 goes.
+_CONTROL_ID_SLOT = "\x00"
+
+
+class PreparedMessage:
+    """
+    A message encoded once per run, split around its MSH-10 so each send can splice in a fresh
+    control ID as a separate buffer instead of re-encoding and re-concatenating the whole message.
+    """
+    __slots__ = ("text", "body", "_head", "_tail")
+
+    def __init__(self, message: str):
+        self.text = message
+        self.body = message.encode()
+        stamped = with_message_control_id(message, _CONTROL_ID_SLOT)
+        if stamped is message:
+            self._head = self._tail = None
+        else:
+            head, tail = stamped.split(_CONTROL_ID_SLOT, 1)
+            self._head, self._tail = head.encode(), tail.encode()
+
+    def buffers(self, message_id: str | None = None):
+        """Return the MLLP frame as a list of buffers, with MSH-10 set to message_id when given."""
+        if message_id is None or self._head is None:
+            return [MLLP_START_BLOCK, self.body, MLLP_END_BLOCK]
+        return [MLLP_START_BLOCK, self._head, message_id.encode(), self._tail, MLLP_END_BLOCK]
+
+    def text_with(self, message_id: str | None = None):
+        """Return the message text as it would be sent with message_id."""
+        return self.text if message_id is None else with_message_control_id(self.text, message_id)
+
+
+class BatchMessage:
+    """
+    Messages packed into one HL7 batch file (FHS, BHS, the messages, BTS, FTS) and sent as a single
+    MLLP frame answered by one ACK. Encoded once, like PreparedMessage: buffers(message_id) sets the
+    file and batch control IDs (FHS-11, BHS-11) to message_id and each message's MSH-10 to
+    message_id-n, so a batch and every message in it are unique per send. Without a message_id the
+    envelope carries control_id and the messages keep their own MSH-10. The envelope uses the
+    delimiters the first message declares in MSH-1/MSH-2.
+    """
+    __slots__ = ("text", "body", "count", "_pieces", "_numbered")
+
+    def __init__(self, messages, control_id="1"):
+        messages = [m.text if isinstance(m, PreparedMessage) else m.rstrip("\r") for m in messages]
+        self.count = len(messages)
+        # The envelope names the first message's sending and receiving applications and facilities (MSH-3..6).
+        first = HL7Message(messages[0]) if messages else None
+        msh = first.fields("MSH") if first is not None else None
+        enc = first.encoding if first is not None else DEFAULT_ENCODING
+        f = enc.field
+        parties = f.join(msh[n] if msh is not None and len(msh) > n else "" for n in range(2, 6))
+        header = f"{f}{enc.component}{enc.repetition}{enc.escape}{enc.subcomponent}{f}{parties}{f}"
+        header += time.strftime("%Y%m%d%H%M%S") + f * 4
+
+        def envelope(control_id, bodies):
+            return "\r".join([f"FHS{header}{control_id}", f"BHS{header}{control_id}",
+                              *bodies, f"BTS{f}{self.count}", f"FTS{f}1"]) + "\r"
+
+        stamped = [with_message_control_id(m, _CONTROL_ID_SLOT) for m in messages]
+        # Message numbers whose MSH-10 has a slot; messages without MSH go out unchanged.
+        self._numbered = [n for n, (m, s) in enumerate(zip(messages, stamped), start=1) if s is not m]
+        template = envelope(_CONTROL_ID_SLOT, [s.rstrip("\r") for s in stamped])
+        self._pieces = [piece.encode() for piece in template.split(_CONTROL_ID_SLOT)]
+        self.text = envelope(control_id, messages)
+        self.body = self.text.encode()
+
+    def __len__(self):
+        return self.count
+
+    def buffers(self, message_id: str | None = None):
+        """Return the MLLP frame as a list of buffers, with the control IDs stamped from message_id when given."""
+        if message_id is None:
+            return [MLLP_START_BLOCK, self.body, MLLP_END_BLOCK]
+        ids = [message_id, message_id, *(f"{message_id}-{n}" for n in self._numbered)]
+        buffers = [MLLP_START_BLOCK]
+        for piece, control_id in zip(self._pieces, ids):
+            buffers += (piece, control_id.encode())
+        buffers += (self._pieces[-1], MLLP_END_BLOCK)
+        return buffers
+
+    def text_with(self, message_id: str | None = None):
+        return b"".join(self.buffers(message_id)[1:-1]).decode()
+
+
+def as_buffers(message):
+    """Return MLLP frame buffers for a str, bytes body, PreparedMessage or already-framed buffer list."""
+    if isinstance(message, (PreparedMessage, BatchMessage)):
+        return message.buffers()
+    if isinstance(message, str):
+        return [MLLP_START_BLOCK, message.encode(), MLLP_END_BLOCK]
+    if isinstance(message, (bytes, bytearray, memoryview)):
+        return [MLLP_START_BLOCK, message, MLLP_END_BLOCK]
+    return list(message)
+
+
+def send_frame(sock, buffers):
+    """
+    Write one frame's buffers with scatter-gather sendmsg, resuming after partial writes.
+    Falls back to a single sendall where sendmsg is unavailable (e.g. Windows).
+    """
+    telemetry = metrics.active()
+    if telemetry is None:
+        _write_frame(sock, buffers)
+        return
+    start = time.perf_counter()
+    _write_frame(sock, buffers)
+    telemetry.frame_sent(sum(map(len, buffers)), time.perf_counter() - start)
+
+
+def _write_frame(sock, buffers):
+    if not hasattr(sock, "sendmsg"):
+        sock.sendall(b"".join(buffers))
+        return
+    views = [memoryview(b) for b in buffers if len(b)]
+    while views:
+        sent = sock.sendmsg(views)
+        while views and sent >= len(views[0]):
+            sent -= len(views[0])
+            views.pop(0)
+        if views and sent:
+            views[0] = views[0][sent:]
+
+
+class FrameReader:
+    """
+    Incremental MLLP frame parser over one reusable receive buffer filled with recv_into.
+    Handles end blocks split across reads and several frames arriving in one read; bytes past the
+    last complete frame stay buffered for the next call.
+    """
+
+    def __init__(self, size=65536):
+        # perf_counter() when the last read_frame() call first received bytes; None if it needed no read.
+        self.first_byte_at = None
+        self._buf = bytearray(size)
+        self._view = memoryview(self._buf)
+        self._start = 0
+        self._end = 0
+        self._scan = 0
+
+    @property
+    def pending(self):
+        """Number of buffered bytes not yet returned as a frame."""
+        return self._end - self._start
+
+    def next_frame(self):
+        """Return the next complete frame payload already buffered, or None."""
+        idx = self._buf.find(MLLP_END_BLOCK, max(self._scan, self._start), self._end)
+        if idx < 0:
+            # An end block may straddle the next read, so rescan its first byte.
+            self._scan = max(self._end - 1, self._start)
+            return None
+        first = self._buf.find(MLLP_START_BLOCK, self._start, idx)
+        frame = bytes(self._view[first + 1 if first >= 0 else self._start:idx])
+        self._start = self._scan = idx + len(MLLP_END_BLOCK)
+        if self._start == self._end:
+            self._start = self._end = self._scan = 0
+        return frame
+
+    def feed(self, data):
+        """Append received bytes, for callers that do their own reads."""
+        self._reserve(len(data))
+        self._buf[self._end:self._end + len(data)] = data
+        self._end += len(data)
+
+    def read_frame(self, sock):
+        """
+        Return the next frame payload, reading from sock as needed.
+        Returns None if the peer closes first; any partial frame is left in pending.
+        """
+        self.first_byte_at = None
+        while (frame := self.next_frame()) is None:
+            self._reserve(1)
+            received = sock.recv_into(self._view[self._end:])
+            if not received:
+                return None
+            if self.first_byte_at is None:
+                self.first_byte_at = time.perf_counter()
+            self._end += received
+        return frame
+
+    def _reserve(self, count: int):
+        if len(self._buf) - self._end >= count:
+            return
+        unread = self._end - self._start
+        if self._start and len(self._buf) - unread >= count:
+            self._buf[:unread] = bytes(self._view[self._start:self._end])
+        else:
+            size = len(self._buf)
+            while size - unread < count:
+                size *= 2
+            grown = bytearray(size)
+            grown[:unread] = self._view[self._start:self._end]
+            self._buf = grown
+            self._view = memoryview(self._buf)
+        self._scan -= self._start
+        self._start, self._end = 0, unread
+
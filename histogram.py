@@ -0,0 +1,125 @@
+import math
+
+DEFAULT_PERCENTILES = (50, 90, 95, 99, 99.9)
+
+
+class LatencyHistogram:
+    """
+    HDR-style log-bucketed latency histogram with O(1) record and fixed memory.
+    Values are kept in microseconds; below 2**sub_bucket_bits each microsecond has its own bucket,
+    above that every power of two is split into 2**(sub_bucket_bits - 1) linear buckets, so any
+    recorded value is reported within 1 / 2**(sub_bucket_bits - 1) of its true value.
+    Samples above max_seconds are clamped into the top bucket; the exact max is tracked separately.
+    """
+
+    def __init__(self, sub_bucket_bits=7, max_seconds=3600.0):
+        self.sub_bucket_bits = sub_bucket_bits
+        self.max_seconds = max_seconds
+        self._sub_count = 1 << sub_bucket_bits
+        self._half_count = self._sub_count >> 1
+        self._max_us = int(max_seconds * 1_000_000)
+        self.counts = [0] * (self._index(self._max_us) + 1)
+        self.total = 0
+        self.sum_us = 0
+        self.min_us = None
+        self.max_us = 0
+
+    def _index(self, value_us: int):
+        if value_us < self._sub_count:
+            return value_us
+        exponent = value_us.bit_length() - self.sub_bucket_bits
+        mantissa = value_us >> exponent
+        return self._sub_count + (exponent - 1) * self._half_count + (mantissa - self._half_count)
+
+    def _bucket_bounds(self, index: int):
+        """Return the (low, high) microsecond range a bucket covers, inclusive."""
+        if index < self._sub_count:
+            return index, index
+        exponent, offset = divmod(index - self._sub_count, self._half_count)
+        exponent += 1
+        mantissa = self._half_count + offset
+        return mantissa << exponent, ((mantissa + 1) << exponent) - 1
+
+    def record(self, seconds: float, count=1):
+        """Add a latency sample given in seconds."""
+        value_us = max(0, int(round(seconds * 1_000_000)))
+        self.counts[self._index(min(value_us, self._max_us))] += count
+        self.total += count
+        self.sum_us += value_us * count
+        if self.min_us is None or value_us < self.min_us:
+            self.min_us = value_us
+        if value_us > self.max_us:
+            self.max_us = value_us
+
+    def merge(self, other: "LatencyHistogram"):
+        """Fold other's samples into this histogram; both must share the same bucket layout."""
+        if (other.sub_bucket_bits, other._max_us) != (self.sub_bucket_bits, self._max_us):
+            raise ValueError("cannot merge histograms with different bucket layouts")
+        for idx, count in enumerate(other.counts):
+            if count:
+                self.counts[idx] += count
+        self.total += other.total
+        self.sum_us += other.sum_us
+        if other.min_us is not None and (self.min_us is None or other.min_us < self.min_us):
+            self.min_us = other.min_us
+        self.max_us = max(self.max_us, other.max_us)
+        return self
+
+    def copy(self):
+        """An independent snapshot, e.g. to hand to another thread or process while recording continues."""
+        snapshot = LatencyHistogram.__new__(LatencyHistogram)
+        snapshot.__dict__.update(self.__dict__)
+        snapshot.counts = list(self.counts)
+        return snapshot
+
+    def to_dict(self):
+        """JSON-friendly form with only the non-empty buckets, for sending to another host."""
+        return {"sub_bucket_bits": self.sub_bucket_bits, "max_seconds": self.max_seconds,
+                "counts": {str(idx): count for idx, count in enumerate(self.counts) if count},
+                "total": self.total, "sum_us": self.sum_us, "min_us": self.min_us, "max_us": self.max_us}
+
+    @classmethod
+    def from_dict(cls, data: dict):
+        hist = cls(data["sub_bucket_bits"], data["max_seconds"])
+        for idx, count in data["counts"].items():
+            hist.counts[int(idx)] = count
+        hist.total, hist.sum_us, hist.min_us, hist.max_us = (data["total"], data["sum_us"], data["min_us"],
+                                                             data["max_us"])
+        return hist
+
+    @property
+    def mean(self):
+        """Mean latency in seconds."""
+        return self.sum_us / self.total / 1_000_000 if self.total else 0.0
+
+    @property
+    def max(self):
+        """Largest recorded latency in seconds."""
+        return self.max_us / 1_000_000
+
+    def percentile(self, p: float):
+        """Return the latency in seconds at or below which p percent of samples fall."""
+        if not self.total:
+            return 0.0
+        rank = max(1, math.ceil(self.total * p / 100))
+        seen = 0
+        for idx, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                low, high = self._bucket_bounds(idx)
+                value_us = min((low + high) / 2, self.max_us)
+                return max(value_us, self.min_us or 0) / 1_000_000
+        return self.max
+
+    def summary(self, percentiles=DEFAULT_PERCENTILES):
+        """Return {"p50": seconds, ..., "max": seconds, "mean": seconds, "count": n}."""
+        out = {f"p{p:g}": self.percentile(p) for p in percentiles}
+        out["max"] = self.max
+        out["mean"] = self.mean
+        out["count"] = self.total
+        return out
+
+    def buckets(self):
+        """Return (upper_bound_seconds, count) for every non-empty bucket, lowest first."""
+        return [(self._bucket_bounds(idx)[1] / 1_000_000, count)
+                for idx, count in enumerate(self.counts) if count]
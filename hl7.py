@@ -0,0 +1,176 @@
+import codecs
+import functools
+import io
+import re
+import time
+import uuid
+from typing import NamedTuple
+
+from hl7parse import HL7Message
+
+DEFAULT_CHUNK_SIZE = 1 << 20
+BATCH_ENVELOPE_SEGMENTS = ("FHS", "BHS", "BTS", "FTS")
+# Segment terminators plus the MLLP start/end block bytes, so framed captures split cleanly too.
+_LINE_BREAK = re.compile(r"\r\n|[\r\n\x0b\x1c]")
+
+
+class AckInfo(NamedTuple):
+    """What a sender needs from an ACK, parsed once when it arrives."""
+    status: str
+    control_id: str | None = None
+    text: str = ""
+    error_code: str | None = None
+
+
+def parse_ack(ack_message):
+    """
+    Parse an ACK (text or HL7Message) into AckInfo: MSA-1 status (UNKNOWN without MSA), MSA-2
+    control ID, MSA-3 text, and the first error code from MSA-6, ERR-3 (v2.5+) or ERR-1.4 (v2.3).
+    """
+    msg = ack_message if isinstance(ack_message, HL7Message) else HL7Message(ack_message.strip())
+    msa = msg.fields("MSA")
+    if msa is None:
+        return AckInfo("UNKNOWN")
+    error_code = msg.get("MSA-6.1") or ("ERR" in msg and (msg.get("ERR-3.1") or msg.get("ERR-1.4.1"))) or None
+    return AckInfo(msa[1] if len(msa) > 1 else "UNKNOWN", msa[2] if len(msa) > 2 else None,
+                   msa[3] if len(msa) > 3 else "", error_code)
+
+
+def parse_ack_status(ack_message: str):
+    """Return ACK status (AA, AE, AR) if available."""
+    return parse_ack(ack_message).status
+
+
+def split_hl7_messages(raw_input: str):
+    """
+    Split pasted HL7 text into individual messages using lines that start with MSH as boundaries.
+    Falls back to one message if no MSH is found.
+    """
+    return list(iter_hl7_messages(io.StringIO(raw_input)))
+
+
+def _iter_lines(stream, chunk_size: int):
+    """Yield stripped, non-blank lines from a text or binary stream, reading chunk_size at a time."""
+    decoder = None
+    pending = ""
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            break
+        if isinstance(chunk, (bytes, bytearray, memoryview)):
+            if decoder is None:
+                decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+            chunk = decoder.decode(chunk)
+        lines = _LINE_BREAK.split(pending + chunk)
+        pending = lines.pop()
+        for line in lines:
+            line = line.strip()
+            if line:
+                yield line
+    if decoder is not None:
+        pending += decoder.decode(b"", final=True)
+    pending = pending.strip()
+    if pending:
+        yield pending
+
+
+def iter_hl7_messages(stream, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Lazily yield HL7 messages from a text or binary file-like object (binary is decoded as UTF-8 with
+    replacement), holding at most one message and one chunk in memory.
+    Segments may end in \\r, \\n or \\r\\n, stray MLLP framing bytes are ignored, and FHS/BHS/BTS/FTS
+    batch envelope segments are dropped so the messages inside a batch file come out one by one.
+    """
+    current = []
+    for line in _iter_lines(stream, chunk_size):
+        if line.startswith(BATCH_ENVELOPE_SEGMENTS):
+            continue
+        if line.startswith("MSH") and current:
+            yield "\r".join(current)
+            current = []
+        current.append(line)
+    if current:
+        yield "\r".join(current)
+
+
+def _iter_paths(paths, chunk_size: int):
+    for path in paths:
+        with open(path, "rb") as f:
+            yield from iter_hl7_messages(f, chunk_size)
+
+
+class _BufferOpener:
+    def __init__(self, data, chunk_size: int):
+        self.data = data
+        self.chunk_size = chunk_size
+
+    def __call__(self):
+        return iter_hl7_messages(io.BytesIO(self.data), self.chunk_size)
+
+    def __reduce__(self):
+        # memoryviews cannot be pickled, so a source sent to a worker process carries a copy of the bytes.
+        return _BufferOpener, (bytes(self.data), self.chunk_size)
+
+
+class MessageSource:
+    """
+    Re-iterable lazy message stream: every iteration calls open_messages() for a fresh iterator,
+    so repeats and scheduled cycles can walk a large file again without keeping it in memory.
+    Sources built by from_paths and from_buffer can be pickled, e.g. to hand to a worker process.
+    """
+
+    def __init__(self, open_messages):
+        self._open_messages = open_messages
+
+    def __iter__(self):
+        return iter(self._open_messages())
+
+    @classmethod
+    def from_paths(cls, paths, chunk_size=DEFAULT_CHUNK_SIZE):
+        """Stream messages from each file in paths, in order."""
+        paths = list(paths)
+        return cls(functools.partial(_iter_paths, paths, chunk_size))
+
+    @classmethod
+    def from_buffer(cls, data, chunk_size=DEFAULT_CHUNK_SIZE):
+        """Stream messages from an in-memory bytes-like object without copying it."""
+        return cls(_BufferOpener(data, chunk_size))
+
+
+def with_message_control_id(message, message_id: str):
+    """Return message (text or HL7Message) as text with MSH-10 set to message_id when MSH is present."""
+    msg = message if isinstance(message, HL7Message) else HL7Message(message)
+    if msg.segment_index("MSH") is None:
+        return message if isinstance(message, str) else msg.render()
+    msg["MSH-10"] = message_id
+    return msg.render()
+
+
+def build_fake_ack(message, message_id: str | None, status="AA"):
+    """
+    Build a minimal ACK (AA unless status says otherwise) using the inbound MSH fields when available.
+    A batch file (FHS/BHS) gets one ACK for the whole batch, referring to its batch control ID (BHS-11).
+    """
+    msg = message if isinstance(message, HL7Message) else HL7Message(message)
+    enc = msg.encoding
+    # MSH pieces: [1] is MSH-2, so MSH-n is [n - 1].
+    msh = msg.fields("MSH") or ["MSH"]
+    # BHS is numbered like MSH: BHS-11 is piece 10.
+    bhs = msg.fields("BHS")
+    batch_control_id = bhs[10] if bhs is not None and len(bhs) > 10 else None
+
+    def field(n, default=""):
+        return msh[n - 1] if n - 1 < len(msh) else default
+
+    msg_type_comps = field(9).split(enc.repetition, 1)[0].split(enc.component) if field(9) else []
+    ack_msg_type = enc.component.join(["ACK"] + msg_type_comps[1:]) if msg_type_comps else "ACK"
+    processing_id = field(11) or "P"
+    version_id = field(12) or "2.3"
+    control_id = message_id or batch_control_id or field(10)
+    sep = enc.field
+    return (
+        f"MSH{sep}{field(2) or '^~\\&'}{sep}{field(5)}{sep}{field(6)}{sep}{field(3)}{sep}{field(4)}"
+        f"{sep}{time.strftime('%Y%m%d%H%M%S')}{sep}{sep}{ack_msg_type}{sep}{uuid.uuid4().hex}"
+        f"{sep}{processing_id}{sep}{version_id}\r"
+        f"MSA{sep}{status}{sep}{control_id}\r"
+    )
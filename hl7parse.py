@@ -0,0 +1,240 @@
+"""
+Lightweight HL7 v2 message index.
+
+HL7Message indexes the segment boundaries (start and end offsets) in one pass over the text and reads
+the encoding characters from MSH-1/MSH-2; each segment is split into fields the first time it is
+accessed, and the pieces are cached.
+Values are read with terser-style paths:
+
+    msg["PID-3"]        whole field (all repetitions)
+    msg["PID-3.1"]      first component of the first repetition
+    msg["PID-3.1.2"]    subcomponent
+    msg["OBX(2)-5"]     field of the second OBX segment
+
+Assignments are kept as edits to the fields they touch. Python strings are immutable, so str(msg)
+builds a new string. It splices each edited field into its span of the original text, one join of
+untouched slices and new values, so changing MSH-10 neither re-splits nor re-joins the other
+segments or fields.
+"""
+import functools
+import re
+from typing import NamedTuple
+
+SEGMENT_SEPARATOR = "\r"
+
+_PATH = re.compile(r"([A-Z][A-Z0-9]{2})(?:\((\d+)\))?-(\d+)(?:\.(\d+))?(?:\.(\d+))?")
+
+
+class Encoding(NamedTuple):
+    """The delimiters a message declares in MSH-1 and MSH-2."""
+    field: str = "|"
+    component: str = "^"
+    repetition: str = "~"
+    escape: str = "\\"
+    subcomponent: str = "&"
+
+    @classmethod
+    def from_msh(cls, segment: str):
+        """Read the encoding from an MSH segment; missing MSH-2 characters take their defaults."""
+        return _encoding(segment[3:8])
+
+
+@functools.lru_cache(maxsize=64)
+def _encoding(declared: str):
+    # declared is MSH-1 plus up to four MSH-2 characters; messages almost always share a handful.
+    field = declared[0]
+    chars = declared[1:].split(field, 1)[0]
+    return Encoding(field, *(chars + "^~\\&"[len(chars):]))
+
+
+DEFAULT_ENCODING = Encoding()
+
+
+@functools.lru_cache(maxsize=1024)
+def parse_path(path: str):
+    """Split "SEG(n)-f.c.s" into (segment, occurrence, field, component, subcomponent); None for omitted parts."""
+    match = _PATH.fullmatch(path)
+    if not match:
+        raise ValueError(f"Invalid HL7 path: {path!r}")
+    name, occurrence, field, component, subcomponent = match.groups()
+    return (name, int(occurrence or 1), int(field),
+            int(component) if component else None, int(subcomponent) if subcomponent else None)
+
+
+class HL7Message:
+    """Offset index over one HL7 message with lazy field access and spliced-in field edits."""
+    __slots__ = ("text", "encoding", "_starts", "_ends", "_names", "_fields", "_edits")
+
+    def __init__(self, text: str):
+        self.text = text
+        # One pass over the text for segment boundaries; fields are found only in segments that are read.
+        starts, ends = [], []
+        pos = 0
+        while (end := text.find(SEGMENT_SEPARATOR, pos)) >= 0:
+            starts.append(pos)
+            ends.append(end)
+            pos = end + 1
+        starts.append(pos)
+        ends.append(len(text))
+        self._starts = starts
+        self._ends = ends
+        self._names = [text[start:min(start + 3, end)] for start, end in zip(starts, ends)]
+        self.encoding = DEFAULT_ENCODING
+        idx = self.segment_index("MSH")
+        if idx is not None:
+            self.encoding = Encoding.from_msh(self._segment(idx))
+        self._fields = {}
+        self._edits = {}  # segment position -> {piece: new value}
+
+    def __contains__(self, segment: str):
+        return segment in self._names
+
+    def __str__(self):
+        return self.render()
+
+    @property
+    def segment_names(self):
+        return [name for name in self._names if name]
+
+    def _segment(self, idx: int):
+        return self.text[self._starts[idx]:self._ends[idx]]
+
+    def segment_index(self, name: str, occurrence=1):
+        """Position of the occurrence-th (1-based) segment called name, or None."""
+        if name not in self._names:
+            return None
+        start = 0
+        while True:
+            try:
+                idx = self._names.index(name, start)
+            except ValueError:
+                return None
+            # An MSH too short to carry a field separator is not a header.
+            if name != "MSH" or self._ends[idx] - self._starts[idx] >= 4:
+                occurrence -= 1
+                if occurrence == 0:
+                    return idx
+            start = idx + 1
+
+    def _pieces(self, idx: int):
+        """Field-separated pieces of segment idx as in the original text; piece 0 is the segment name."""
+        pieces = self._fields.get(idx)
+        if pieces is None:
+            pieces = self._fields[idx] = self._segment(idx).split(self.encoding.field)
+        return pieces
+
+    def _value(self, idx: int, piece: int):
+        """Piece piece of segment idx with any edit applied; None past the end of the segment."""
+        edits = self._edits.get(idx)
+        if edits is not None and piece in edits:
+            return edits[piece]
+        pieces = self._pieces(idx)
+        if piece < len(pieces):
+            return pieces[piece]
+        return "" if edits is not None and piece < max(edits) else None
+
+    def fields(self, name: str, occurrence=1):
+        """
+        The raw field-separated pieces of a segment (piece 0 is its name, so for MSH piece n is MSH-(n+1)),
+        or None when absent. Cheaper than several get() calls on the same segment; do not modify the list.
+        """
+        idx = self.segment_index(name, occurrence)
+        if idx is None:
+            return None
+        pieces = self._pieces(idx)
+        edits = self._edits.get(idx)
+        if edits is None:
+            return pieces
+        pieces = pieces + [""] * (max(edits) + 1 - len(pieces))
+        for piece, value in edits.items():
+            pieces[piece] = value
+        return pieces
+
+    @staticmethod
+    def _piece(name: str, field: int):
+        # MSH-1 is the separator itself, so MSH-n is piece n-1; every other segment's field n is piece n.
+        return field - 1 if name == "MSH" else field
+
+    def get(self, path: str, default=None):
+        """The value at path, or default when the segment, field or component is absent."""
+        name, occurrence, field, component, subcomponent = parse_path(path)
+        idx = self.segment_index(name, occurrence)
+        if idx is None:
+            return default
+        if name == "MSH" and field == 1:
+            return self.encoding.field
+        value = self._value(idx, self._piece(name, field))
+        if value is None:
+            return default
+        if component is None:
+            return value
+        parts = value.split(self.encoding.repetition, 1)[0].split(self.encoding.component)
+        if component > len(parts):
+            return default
+        value = parts[component - 1]
+        if subcomponent is None:
+            return value
+        parts = value.split(self.encoding.subcomponent)
+        return parts[subcomponent - 1] if subcomponent <= len(parts) else default
+
+    def __getitem__(self, path: str):
+        return self.get(path, "")
+
+    def set(self, path: str, value: str):
+        """
+        Set the value at path, padding with empty fields or components as needed. The edit is kept
+        aside and spliced into the text by render(); the rest of the message is not re-split.
+        """
+        name, occurrence, field, component, subcomponent = parse_path(path)
+        idx = self.segment_index(name, occurrence)
+        if idx is None:
+            raise KeyError(f"No {name} segment (occurrence {occurrence}) in message")
+        if name == "MSH" and field <= 2:
+            raise ValueError("MSH-1 and MSH-2 hold the encoding characters and cannot be set")
+        piece = self._piece(name, field)
+        if component is not None:
+            enc = self.encoding
+            repetitions = (self._value(idx, piece) or "").split(enc.repetition)
+            components = repetitions[0].split(enc.component)
+            components += [""] * (component - len(components))
+            if subcomponent is not None:
+                subcomponents = components[component - 1].split(enc.subcomponent)
+                subcomponents += [""] * (subcomponent - len(subcomponents))
+                subcomponents[subcomponent - 1] = value
+                value = enc.subcomponent.join(subcomponents)
+            components[component - 1] = value
+            repetitions[0] = enc.component.join(components)
+            value = enc.repetition.join(repetitions)
+        self._edits.setdefault(idx, {})[piece] = value
+
+    def __setitem__(self, path: str, value: str):
+        self.set(path, value)
+
+    def render(self):
+        """
+        The message text with any edits applied. Each edit replaces its field's span of the original
+        text, so the result is one join of unchanged slices and new values.
+        """
+        if not self._edits:
+            return self.text
+        field = self.encoding.field
+        spans = []
+        for idx, edits in self._edits.items():
+            pieces = self._pieces(idx)
+            offset = self._starts[idx]
+            for piece, original in enumerate(pieces):
+                if piece in edits:
+                    spans.append((offset, offset + len(original), edits[piece]))
+                offset += len(original) + 1
+            if max(edits) >= len(pieces):
+                # Fields past the end of the segment are appended, padded with empty ones.
+                added = "".join(field + edits.get(piece, "") for piece in range(len(pieces), max(edits) + 1))
+                spans.append((self._ends[idx], self._ends[idx], added))
+        spans.sort(key=lambda span: span[0])
+        parts = []
+        pos = 0
+        for start, end, value in spans:
+            parts += (self.text[pos:start], value)
+            pos = end
+        parts.append(self.text[pos:])
+        return "".join(parts)
@@ -0,0 +1,128 @@
+import itertools
+import threading
+import time
+
+from mllp import ConnectionPool
+from runner import SendOptions, new_results, run_send
+
+
+class SendJob:
+    """
+    One send run executing on a background thread.
+    results fills in incrementally as attempts complete, so a UI can poll it while the job runs;
+    cancel() stops the job at the next attempt (or batch) and cuts any inter-cycle wait short.
+    """
+
+    def __init__(self, job_id: int, messages, options: SendOptions, num_messages: int | None = None,
+                 label: str = "", result_log=None):
+        self.job_id = job_id
+        self.options = options
+        self.label = label or f"{options.host}:{options.port}"
+        self.status_text = "Queued"
+        self.created_at = time.time()
+        self.pool = ConnectionPool(timeout=options.timeout)
+        self.results = new_results(num_messages, options, self.pool)
+        self.error = None
+        self.run_id = None
+        self._result_log = result_log
+        self._messages = messages
+        self._cancel = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f"send-job-{job_id}", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def _set_status(self, text: str):
+        self.status_text = text
+
+    def _run(self):
+        writer = None
+        try:
+            if self._result_log is not None:
+                writer = self._result_log.open_run(self.options, self.label)
+                self.run_id = writer.run_id
+            run_send(self._messages, self.options, self.results, pool=self.pool,
+                     on_record=writer.add if writer else None, on_status=self._set_status,
+                     should_stop=self._cancel.is_set, sleep=self._cancel.wait)
+        except Exception as e:
+            self.error = f"Error: {e}"
+            self.results["error_message"] = self.results["error_message"] or self.error
+            self.results["batch_end_time"] = self.results["batch_end_time"] or time.perf_counter()
+        finally:
+            self.pool.close()
+            self._messages = None
+            if writer is not None:
+                writer.finish(self.results)
+        if self.results["cancelled"]:
+            self.status_text = "Cancelled"
+        elif self.results["error_message"]:
+            self.status_text = "Stopped on error"
+        else:
+            self.status_text = "Finished"
+
+    def cancel(self):
+        self._cancel.set()
+
+    @property
+    def cancelled(self):
+        return self._cancel.is_set()
+
+    @property
+    def running(self):
+        return self._thread.is_alive()
+
+    @property
+    def done(self):
+        return self._thread.ident is not None and not self._thread.is_alive()
+
+    def wait(self, timeout: float | None = None):
+        """Block until the job finishes; returns True if it did within timeout."""
+        self._thread.join(timeout)
+        return not self._thread.is_alive()
+
+
+class JobRegistry:
+    """
+    Thread-safe registry of send jobs, shared across Streamlit reruns and sessions.
+    With a result_log (resultlog.ResultLog) every job's attempts are also written to disk.
+    """
+
+    def __init__(self, max_finished=20, result_log=None):
+        self.max_finished = max_finished
+        self.result_log = result_log
+        self._jobs = {}
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def submit(self, messages, options: SendOptions, num_messages: int | None = None, label: str = ""):
+        """Create, register and start a job; the oldest finished jobs are forgotten beyond max_finished."""
+        with self._lock:
+            job = SendJob(next(self._ids), messages, options, num_messages, label, self.result_log)
+            self._jobs[job.job_id] = job
+            finished = [j for j in self._jobs.values() if j.done]
+            for old in finished[:max(0, len(finished) - self.max_finished)]:
+                del self._jobs[old.job_id]
+        return job.start()
+
+    def get(self, job_id: int):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def jobs(self):
+        """All known jobs, newest first."""
+        with self._lock:
+            return sorted(self._jobs.values(), key=lambda j: j.job_id, reverse=True)
+
+    def running(self):
+        return [job for job in self.jobs() if job.running]
+
+    def remove(self, job_id: int):
+        with self._lock:
+            job = self._jobs.pop(job_id, None)
+        if job is not None:
+            job.cancel()
+
+    def cancel_all(self):
+        for job in self.jobs():
+            job.cancel()
@@ -0,0 +1,341 @@
+import asyncio
+import math
+import time
+import uuid
+from collections import OrderedDict
+
+from framing import MLLP_START_BLOCK, MLLP_END_BLOCK, BatchMessage, PreparedMessage
+from histogram import LatencyHistogram
+import metrics
+from hl7 import parse_ack
+from templates import MessageTemplate
+
+
+def constant_profile(rate: float):
+    """Hold rate msgs/sec for the whole run."""
+    return lambda t: rate
+
+
+def ramp_profile(start_rate: float, end_rate: float, ramp_seconds: float):
+    """Climb linearly from start_rate to end_rate over ramp_seconds, then hold end_rate."""
+    def rate_at(t):
+        if ramp_seconds <= 0 or t >= ramp_seconds:
+            return end_rate
+        return start_rate + (end_rate - start_rate) * t / ramp_seconds
+    return rate_at
+
+
+def step_profile(rates, step_seconds: float):
+    """Hold each rate in turn for step_seconds; the last rate holds until the run ends."""
+    rates = list(rates)
+
+    def rate_at(t):
+        idx = int(t // step_seconds) if step_seconds > 0 else len(rates) - 1
+        return rates[min(idx, len(rates) - 1)]
+    return rate_at
+
+
+def spike_profile(base_rate: float, spike_rate: float, spike_at: float, spike_seconds: float):
+    """Hold base_rate with a burst of spike_rate between spike_at and spike_at + spike_seconds."""
+    return lambda t: spike_rate if spike_at <= t < spike_at + spike_seconds else base_rate
+
+
+PROFILES = {
+    "constant": constant_profile,
+    "ramp": ramp_profile,
+    "step": step_profile,
+    "spike": spike_profile,
+}
+
+
+def default_profile(name: str, target_rate: float, duration: float):
+    """
+    Build a named profile with stock shapes for callers that only know a target rate and run length:
+    ramp climbs from 0 over the first half, step climbs in four equal steps, and spike holds the
+    target with a one-second 5x burst at the midpoint.
+    """
+    if name == "ramp":
+        return ramp_profile(0.0, target_rate, duration / 2)
+    if name == "step":
+        return step_profile([target_rate * (i + 1) / 4 for i in range(4)], duration / 4)
+    if name == "spike":
+        return spike_profile(target_rate, target_rate * 5, duration / 2, 1.0)
+    return constant_profile(target_rate)
+
+
+def profile_integral(profile, seconds: float, step=0.01):
+    """Messages profile schedules over its first seconds: the integral of its rate (midpoint rule)."""
+    steps = min(max(1, math.ceil(seconds / step)), 100_000)
+    width = seconds / steps
+    return sum(profile((i + 0.5) * width) for i in range(steps)) * width
+
+
+class TokenBucket:
+    """
+    Mint send tokens at profile(t) tokens/sec for duration seconds.
+    Each token carries the offset at which it became due, independent of when the sender gets
+    around to taking it, so latency measured from that offset includes any time the sender
+    spent queued behind a slow receiver (no coordinated omission).
+    """
+
+    IDLE_STEP = 0.001
+    EPSILON = 1e-9
+
+    def __init__(self, profile, duration: float):
+        self.profile = profile
+        self.duration = duration
+        self._next_due = 0.0
+
+    def take(self):
+        """Return the due offset of the next token, or None once the run is over."""
+        while self._next_due < self.duration - self.EPSILON:
+            due = self._next_due
+            rate = self.profile(due)
+            if rate > 0:
+                self._next_due = due + 1.0 / rate
+                return due
+            self._next_due = due + self.IDLE_STEP
+        return None
+
+
+class ScheduleStats:
+    """Running counts and send lags of a scheduled run, so its report needs no per-send records."""
+
+    def __init__(self):
+        self.scheduled = 0
+        self.completed = 0
+        self.lags = LatencyHistogram()
+
+    def sent(self, record):
+        self.scheduled += 1
+        self.lags.record(record["sent"] - record["intended"])
+
+    def finished(self, record):
+        if record["latency"] is not None:
+            self.completed += 1
+
+
+class _Connection:
+    """
+    One MLLP connection with a background reader matching ACKs to in-flight sends by MSA-2;
+    finish(record) fires as each send gets its ACK or fails.
+    """
+
+    def __init__(self, reader, writer, finish):
+        self.reader = reader
+        self.writer = writer
+        self.finish = finish
+        self.telemetry = metrics.active()
+        self.in_flight = OrderedDict()
+        self.drained = asyncio.Event()
+        self.drained.set()
+        self.error = None
+        self.task = asyncio.create_task(self._read_acks())
+
+    def send(self, key, record, buffers):
+        self.in_flight[key] = record
+        self.drained.clear()
+        self.writer.writelines(buffers)
+        if self.telemetry is not None:
+            # writelines only queues the frame; the event loop flushes it, so there is no write time to record.
+            self.telemetry.frame_sent(record["bytes"], None)
+            self.telemetry.in_flight_changed(1)
+
+    async def _read_acks(self):
+        try:
+            while True:
+                frame = await self.reader.readuntil(MLLP_END_BLOCK)
+                received = time.perf_counter()
+                ack = frame[:-len(MLLP_END_BLOCK)].lstrip(MLLP_START_BLOCK).decode()
+                info = parse_ack(ack)
+                key = info.control_id or None
+                if key not in self.in_flight:
+                    key = next(iter(self.in_flight), None)
+                    if key is None:
+                        continue
+                record = self.in_flight.pop(key)
+                if self.telemetry is not None:
+                    self.telemetry.in_flight_changed(-1)
+                record["ack"] = ack
+                record["info"] = info
+                record["latency"] = received - record["intended"]
+                record["service_time"] = received - record["sent"]
+                if not self.in_flight:
+                    self.drained.set()
+                self.finish(record)
+        except Exception as e:
+            self.fail(f"Error: {e or type(e).__name__}")
+
+    def fail(self, error: str):
+        self.error = self.error or error
+        failed = list(self.in_flight.values())
+        if self.telemetry is not None:
+            self.telemetry.in_flight_changed(-len(self.in_flight))
+        self.in_flight.clear()
+        self.drained.set()
+        for record in failed:
+            record["ack"] = self.error
+            self.finish(record)
+
+    async def close(self):
+        self.task.cancel()
+        self.writer.close()
+        if self.telemetry is not None:
+            self.telemetry.in_flight_changed(-len(self.in_flight))
+            self.telemetry.disconnected()
+
+
+# Sends wake this long before they are due and yield to the event loop for the rest, since a plain
+# sleep can overshoot by a millisecond or more (the selector's timeout granularity).
+SPIN_SECONDS = 0.002
+
+
+async def _wait_until(deadline: float):
+    """Return at the perf_counter time deadline, within a fraction of a millisecond; ACK readers keep running."""
+    delay = deadline - time.perf_counter()
+    if delay > SPIN_SECONDS:
+        await asyncio.sleep(delay - SPIN_SECONDS)
+    while time.perf_counter() < deadline:
+        await asyncio.sleep(0)
+
+
+async def _send_on_schedule(prepared, host: str, port: int, sends, connections, generate_message_id, timeout,
+                            max_in_flight, should_stop, on_record=None):
+    """
+    Send prepared[position] at start + due for each (due, position) in sends, calling on_record(record)
+    as each send gets its ACK or fails. Returns (stats, start, send_end, end, cancelled).
+    """
+    stats = ScheduleStats()
+
+    def finish(record):
+        stats.finished(record)
+        if on_record is not None:
+            on_record(record)
+
+    conns = []
+    attempts = [0] * len(prepared)
+    idx = 0
+    cancelled = False
+    start = send_end = time.perf_counter()
+    try:
+        telemetry = metrics.active()
+        for _ in range(max(1, int(connections))):
+            connect_start = time.perf_counter()
+            reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout)
+            if telemetry is not None:
+                telemetry.connected(time.perf_counter() - connect_start)
+            conns.append(_Connection(reader, writer, finish))
+        start = time.perf_counter()
+        for due, position in sends:
+            intended = start + due
+            await _wait_until(intended)
+            if should_stop and should_stop():
+                cancelled = True
+                break
+            conn = conns[idx % len(conns)]
+            while len(conn.in_flight) >= max_in_flight and conn.error is None:
+                await asyncio.sleep(0.001)
+            message = prepared[position]
+            message_id = uuid.uuid4().hex if generate_message_id else None
+            buffers = message.buffers(message_id)
+            attempts[position] += 1
+            record = {"index": idx, "message_idx": position + 1, "attempt": attempts[position],
+                      "message_id": message_id, "connection": idx % len(conns) + 1, "bytes": sum(map(len, buffers)),
+                      "intended": intended, "sent": time.perf_counter(), "ack": None, "info": None,
+                      "latency": None, "service_time": None}
+            stats.sent(record)
+            if conn.error is not None:
+                # The connection is gone, so nothing is written.
+                record["ack"] = conn.error
+                record["bytes"] = None
+                finish(record)
+            else:
+                conn.send(message_id if message_id is not None else ("#", idx), record, buffers)
+                await conn.writer.drain()
+            idx += 1
+        send_end = time.perf_counter()
+        for conn in conns:
+            try:
+                await asyncio.wait_for(conn.drained.wait(), timeout)
+            except TimeoutError:
+                conn.fail("Error: timed out waiting for ACK")
+    finally:
+        for conn in conns:
+            await conn.close()
+    return stats, start, send_end, time.perf_counter(), cancelled
+
+
+def _prepare(messages):
+    return [m if isinstance(m, (PreparedMessage, BatchMessage, MessageTemplate)) else PreparedMessage(m)
+            for m in messages]
+
+
+async def run_open_loop(messages, host: str, port: int, profile, duration: float, connections=1,
+                        generate_message_id=False, timeout=10, max_in_flight=10000, should_stop=None,
+                        on_record=None):
+    """
+    Send messages (cycled) at the rate given by profile for duration seconds, without waiting
+    for ACKs before sending the next message. With generate_message_id each send gets a fresh
+    MSH-10. Messages are encoded once up front; templates.MessageTemplate messages render a fresh
+    variant per send. should_stop() is polled before every send and ends the run early, leaving
+    report["cancelled"] set. on_record(record) fires as each send gets its ACK or fails, with a
+    record holding the message number and its attempt count, intended and actual send times,
+    connection number, framed size, ACK (and its hl7.AckInfo) and latency measured from the intended
+    time; records are not kept. Returns a report of target versus achieved rate.
+    """
+    prepared = _prepare(messages)
+    bucket = TokenBucket(profile, duration)
+    sends = ((due, idx % len(prepared)) for idx, due in enumerate(iter(bucket.take, None)))
+    stats, start, send_end, end, cancelled = await _send_on_schedule(
+        prepared, host, port, sends, connections, generate_message_id, timeout, max_in_flight, should_stop,
+        on_record)
+    return build_rate_report(stats, start, send_end, end, duration,
+                             lambda seconds: profile_integral(profile, seconds), cancelled)
+
+
+async def run_replay(messages, host: str, port: int, schedule, connections=1, generate_message_id=False,
+                     timeout=10, max_in_flight=10000, should_stop=None, on_record=None):
+    """
+    Send each message once at its offset in schedule (a replay.ReplaySchedule), without waiting for
+    ACKs, like run_open_loop. Records and report have the same shape; the report's send lag figures
+    say how far actual send times drifted from the captured schedule.
+    """
+    prepared = _prepare(messages)
+    stats, start, send_end, end, cancelled = await _send_on_schedule(
+        prepared, host, port, iter(schedule.take, None), connections, generate_message_id, timeout,
+        max_in_flight, should_stop, on_record)
+    return build_rate_report(stats, start, send_end, end, schedule.duration, schedule.due_by, cancelled)
+
+
+def build_rate_report(stats: ScheduleStats, start: float, send_end: float, end: float, duration: float, planned,
+                      cancelled=False):
+    """
+    Summarise target versus achieved rate and how far sends lagged their schedule. planned(seconds)
+    is how many sends the schedule makes due in its first seconds; the target rate is that over the
+    schedule's duration, or over the part a cancelled run reached before it stopped.
+    """
+    send_window = max(send_end - start, 1e-9)
+    window = min(send_end - start, duration) if cancelled else duration
+    return {
+        "scheduled": stats.scheduled,
+        "completed": stats.completed,
+        "errors": stats.scheduled - stats.completed,
+        "target_rate": planned(window) / window if window > 0 else 0.0,
+        "send_rate": stats.scheduled / send_window,
+        "achieved_rate": stats.completed / max(end - start, 1e-9),
+        "max_send_lag": stats.lags.max,
+        "p50_send_lag": stats.lags.percentile(50),
+        "p99_send_lag": stats.lags.percentile(99),
+        "elapsed": end - start,
+        "cancelled": cancelled,
+    }
+
+
+def run_open_loop_sync(messages, host: str, port: int, profile, duration: float, **kwargs):
+    """Blocking wrapper around run_open_loop for callers without an event loop."""
+    return asyncio.run(run_open_loop(messages, host, port, profile, duration, **kwargs))
+
+
+def run_replay_sync(messages, host: str, port: int, schedule, **kwargs):
+    """Blocking wrapper around run_replay for callers without an event loop."""
+    return asyncio.run(run_replay(messages, host, port, schedule, **kwargs))
@@ -0,0 +1,283 @@
+"""
+Optional instrumentation of the send path: Prometheus/OpenMetrics counters, histograms and gauges
+served on /metrics, and optionally one OpenTelemetry span per ACKed message keyed by MSH-10.
+
+Off by default. The send path asks active() for the current SendMetrics and skips all bookkeeping
+when it is None, so a run without instrumentation pays one function call per hook. With worker
+processes the coordinator counts every merged attempt, ACK status and ACK latency, and each worker
+ships its frame and byte counts, DNS/connect/send/first-byte timings and gauges to be merged in
+(take_transport, merge_transport), so /metrics covers the whole run. Agents run on other hosts:
+the coordinator counts their attempts, and their wire-level metrics come from each agent's own
+endpoint.
+"""
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from histogram import LatencyHistogram
+from records import ERROR_STATUS
+
+try:
+    from opentelemetry import trace
+except ImportError:
+    trace = None
+
+# Upper bounds (seconds) of the exported histogram buckets; the HDR histograms underneath are finer.
+EXPORT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+PHASES = {
+    "dns": "DNS lookup time, paid once per host per run (addresses are cached).",
+    "connect": "TCP connect time for new MLLP connections.",
+    "send": "Time to write one frame to the socket.",
+    "first_byte": "Time from the end of a write to the first byte of the ACK (stop-and-wait sends).",
+    "ack": "Full ACK latency per first try, as recorded in the run results (resends are not included).",
+}
+# Phases timed where the frames are written, which a worker process ships to its coordinator.
+TRANSPORT_PHASES = ("dns", "connect", "send", "first_byte")
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+_active = None
+
+
+def active():
+    """The enabled SendMetrics, or None when instrumentation is off."""
+    return _active
+
+
+def enable(spans=False):
+    """
+    Turn instrumentation on, with or without spans, and return the process-wide SendMetrics. Calling
+    it again keeps the counts so far.
+    """
+    global _active
+    metrics = _active or SendMetrics()
+    if not spans:
+        metrics.spans = None
+    elif metrics.spans is None:
+        metrics.spans = SpanEmitter()
+    _active = metrics
+    return metrics
+
+
+def disable():
+    global _active
+    _active = None
+
+
+class SpanEmitter:
+    """Emit an OpenTelemetry span per ACKed attempt through the globally configured tracer provider."""
+
+    def __init__(self):
+        if trace is None:
+            raise ValueError("OpenTelemetry spans need the opentelemetry-api package "
+                             "(pip install opentelemetry-api opentelemetry-sdk)")
+        self.tracer = trace.get_tracer("hl7_sender")
+
+    def emit(self, record):
+        # Records carry their wall-clock completion time and duration, so the span is built after the fact.
+        end = record.timestamp or time.time()
+        span = self.tracer.start_span("hl7.send", start_time=int((end - record.duration) * 1e9), attributes={
+            "hl7.message_control_id": record.message_id or "",
+            "hl7.ack_code": record.status,
+            "hl7.ack_error_code": record.error_code or "",
+            "hl7.cycle": record.cycle,
+            "hl7.message_index": record.message_idx,
+            "hl7.attempt": record.attempt,
+            "hl7.retry": record.retry,
+        })
+        if record.status != "AA":
+            span.set_status(trace.Status(trace.StatusCode.ERROR, record.status))
+        span.end(end_time=int(end * 1e9))
+
+
+class SendMetrics:
+    """Counters, phase histograms and gauges for one process's sends; every update is thread-safe."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.sent = 0
+        self.bytes_sent = 0
+        self.acked = 0
+        self.statuses = {}
+        self.errors = 0
+        self.retries = 0
+        self.in_flight = 0
+        self.open_connections = 0
+        self.histograms = {phase: LatencyHistogram() for phase in PHASES}
+        self.spans = None
+        # Latest (in_flight, open_connections) of each worker process still sending, by merge_transport source.
+        self._remote_gauges = {}
+
+    def dns(self, seconds: float):
+        with self._lock:
+            self.histograms["dns"].record(seconds)
+
+    def connected(self, seconds: float):
+        with self._lock:
+            self.histograms["connect"].record(seconds)
+            self.open_connections += 1
+
+    def disconnected(self):
+        with self._lock:
+            self.open_connections -= 1
+
+    def frame_sent(self, nbytes: int, seconds: float | None):
+        """Count a written frame; seconds is its write time, or None where the write is not timed."""
+        with self._lock:
+            self.sent += 1
+            self.bytes_sent += nbytes
+            if seconds is not None:
+                self.histograms["send"].record(seconds)
+
+    def first_byte(self, seconds: float):
+        with self._lock:
+            self.histograms["first_byte"].record(seconds)
+
+    def in_flight_changed(self, delta: int):
+        with self._lock:
+            self.in_flight += delta
+
+    def error(self):
+        with self._lock:
+            self.errors += 1
+
+    def take_transport(self):
+        """
+        Return and reset the wire-level counts gathered since the last call (frames, bytes and the
+        TRANSPORT_PHASES histograms), with the current gauges, for a worker to report to its coordinator.
+        """
+        with self._lock:
+            snapshot = {"sent": self.sent, "bytes_sent": self.bytes_sent,
+                        "histograms": {phase: self.histograms[phase] for phase in TRANSPORT_PHASES},
+                        "in_flight": self.in_flight, "open_connections": self.open_connections}
+            self.sent = self.bytes_sent = 0
+            for phase in TRANSPORT_PHASES:
+                self.histograms[phase] = LatencyHistogram()
+        return snapshot
+
+    def merge_transport(self, source, snapshot, final=False):
+        """Add a take_transport() snapshot from source (e.g. a worker index); final drops its gauges."""
+        with self._lock:
+            self.sent += snapshot["sent"]
+            self.bytes_sent += snapshot["bytes_sent"]
+            for phase, histogram in snapshot["histograms"].items():
+                self.histograms[phase].merge(histogram)
+            if final:
+                self._remote_gauges.pop(source, None)
+            else:
+                self._remote_gauges[source] = (snapshot["in_flight"], snapshot["open_connections"])
+
+    def forget(self, source):
+        """Drop the gauges of a source that ended without a final snapshot."""
+        with self._lock:
+            self._remote_gauges.pop(source, None)
+
+    def observe(self, record):
+        """
+        Count one recorded attempt (an records.AckRecord) and emit its span when spans are on. Tries
+        that got no ACK count as errors; resends are counted but kept out of the ACK latency histogram.
+        """
+        with self._lock:
+            if record.retry:
+                self.retries += 1
+            if record.status == ERROR_STATUS:
+                self.errors += 1
+                return
+            self.acked += 1
+            self.statuses[record.status] = self.statuses.get(record.status, 0) + 1
+            if not record.retry:
+                self.histograms["ack"].record(record.duration)
+        if self.spans is not None:
+            self.spans.emit(record)
+
+    def render(self):
+        """The current values in the Prometheus text exposition format."""
+        with self._lock:
+            lines = []
+
+            def metric(name, kind, help_text, samples):
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {kind}")
+                lines.extend(samples)
+
+            metric("hl7_messages_sent_total", "counter", "MLLP frames written.",
+                   [f"hl7_messages_sent_total {self.sent}"])
+            metric("hl7_bytes_sent_total", "counter", "Framed bytes written.",
+                   [f"hl7_bytes_sent_total {self.bytes_sent}"])
+            metric("hl7_acks_total", "counter", "ACKs received, by MSA-1 acknowledgment code.",
+                   [f'hl7_acks_total{{code="{code}"}} {count}' for code, count in sorted(self.statuses.items())]
+                   or ["hl7_acks_total 0"])
+            metric("hl7_acks_received_total", "counter", "ACKs received, first tries and resends.",
+                   [f"hl7_acks_received_total {self.acked}"])
+            metric("hl7_send_errors_total", "counter", "Attempts that failed without an ACK.",
+                   [f"hl7_send_errors_total {self.errors}"])
+            metric("hl7_retries_total", "counter", "Resends of failed tries (see the run's retry policy).",
+                   [f"hl7_retries_total {self.retries}"])
+            for phase, help_text in PHASES.items():
+                name = f"hl7_{phase}_seconds"
+                metric(name, "histogram", help_text, _histogram_samples(name, self.histograms[phase]))
+            in_flight = self.in_flight + sum(gauges[0] for gauges in self._remote_gauges.values())
+            open_connections = self.open_connections + sum(gauges[1] for gauges in self._remote_gauges.values())
+            metric("hl7_in_flight_messages", "gauge", "Frames written and still waiting for their ACK.",
+                   [f"hl7_in_flight_messages {in_flight}"])
+            metric("hl7_open_connections", "gauge", "MLLP connections currently open.",
+                   [f"hl7_open_connections {open_connections}"])
+        return "\n".join(lines) + "\n"
+
+
+def _histogram_samples(name: str, hist: LatencyHistogram):
+    samples = []
+    buckets = hist.buckets()
+    seen = 0
+    position = 0
+    for bound in EXPORT_BUCKETS:
+        while position < len(buckets) and buckets[position][0] <= bound:
+            seen += buckets[position][1]
+            position += 1
+        samples.append(f'{name}_bucket{{le="{bound:g}"}} {seen}')
+    samples.append(f'{name}_bucket{{le="+Inf"}} {hist.total}')
+    samples.append(f"{name}_sum {hist.sum_us / 1_000_000}")
+    samples.append(f"{name}_count {hist.total}")
+    return samples
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?", 1)[0] != "/metrics":
+            self.send_error(404)
+            return
+        # Whatever is enabled at scrape time; an empty set when instrumentation is off.
+        body = (active() or SendMetrics()).render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class MetricsServer:
+    """Serve the active SendMetrics on http://host:port/metrics from a background thread."""
+
+    def __init__(self, host="0.0.0.0", port=9464):
+        self.httpd = ThreadingHTTPServer((host, port), _MetricsHandler)
+        self.httpd.daemon_threads = True
+        self._thread = threading.Thread(target=self.httpd.serve_forever, kwargs={"poll_interval": 0.1},
+                                        name="metrics-server", daemon=True)
+        self._thread.start()
+
+    @property
+    def port(self):
+        return self.httpd.server_address[1]
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        self._thread.join(timeout=5)
+
+
+def serve(port=9464, host="0.0.0.0", spans=False):
+    """Enable instrumentation and expose it on /metrics; returns the MetricsServer."""
+    enable(spans=spans)
+    return MetricsServer(host, port)
@@ -0,0 +1,357 @@
+import select
+import socket
+import threading
+import time
+from collections import OrderedDict
+
+from framing import MLLP_START_BLOCK, MLLP_END_BLOCK, FrameReader, as_buffers, send_frame
+from hl7 import parse_ack
+from hl7parse import HL7Message
+import metrics
+
+
+def ack_control_id(ack: str):
+    """Return the MSA-2 control ID an ACK refers to, or None when absent."""
+    msa = HL7Message(ack.strip()).fields("MSA")
+    return msa[2] if msa is not None and len(msa) > 2 and msa[2] else None
+
+
+def _is_alive(sock):
+    """
+    Return True when an idle socket can be reused.
+    An idle MLLP connection should have nothing to read; readable means the peer
+    closed it (EOF) or sent unsolicited bytes, and either way it is not safe to reuse.
+    poll() is used where available: select() cannot watch descriptors numbered 1024 and up.
+    """
+    try:
+        if sock.fileno() < 0:
+            return False
+        if hasattr(select, "poll"):
+            poller = select.poll()
+            poller.register(sock, select.POLLIN)
+            return not poller.poll(0)
+        readable, _, _ = select.select([sock], [], [], 0)
+    except (OSError, ValueError):
+        return False
+    return not readable
+
+
+class AttemptTiming:
+    """
+    Where one stop-and-wait attempt's time went, in seconds, filled in by send_hl7_message: DNS lookup
+    and TCP connect (both 0 on a reused connection or cached address), the frame write, and the wait
+    from the end of the write to the first byte of the ACK. written tells whether the frame went out
+    at all, as opposed to the attempt failing before or while connecting.
+    """
+    __slots__ = ("dns", "connect", "write", "first_byte", "written")
+
+    def __init__(self):
+        self.dns = 0.0
+        self.connect = 0.0
+        self.write = 0.0
+        self.first_byte = 0.0
+        self.written = False
+
+    def astuple(self):
+        """The timings in records.PHASES order."""
+        return self.dns, self.connect, self.write, self.first_byte
+
+
+class Resolver:
+    """
+    Per-run cache of resolved addresses, so only the first connection to a host pays for DNS. Like
+    socket.create_connection, connecting tries each address in turn; the one that answers goes first.
+    """
+
+    def __init__(self):
+        self._addresses = {}
+
+    def resolve(self, host: str, port: int):
+        """Return (addresses, seconds): host's addresses, and the lookup time (0.0 when cached)."""
+        addresses = self._addresses.get((host, port))
+        if addresses is not None:
+            return addresses, 0.0
+        start = time.perf_counter()
+        infos = socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)
+        seconds = time.perf_counter() - start
+        addresses = self._addresses[(host, port)] = list(dict.fromkeys(info[4][0] for info in infos))
+        telemetry = metrics.active()
+        if telemetry is not None:
+            telemetry.dns(seconds)
+        return addresses, seconds
+
+    def connected(self, host: str, port: int, address: str):
+        addresses = self._addresses.get((host, port))
+        if addresses and addresses[0] != address:
+            self._addresses[(host, port)] = [address] + [a for a in addresses if a != address]
+
+
+def _connect(host: str, port: int, timeout, resolver: Resolver | None = None, timing: AttemptTiming | None = None):
+    """Open a TCP connection, via resolver's cached addresses when given one, timing it when asked or instrumented."""
+    telemetry = metrics.active()
+    if resolver is None and timing is None and telemetry is None:
+        return socket.create_connection((host, port), timeout=timeout)
+    addresses = [host]
+    if resolver is not None:
+        addresses, seconds = resolver.resolve(host, port)
+        if timing is not None:
+            timing.dns += seconds
+    start = time.perf_counter()
+    for position, address in enumerate(addresses):
+        try:
+            sock = socket.create_connection((address, port), timeout=timeout)
+            break
+        except OSError:
+            if position == len(addresses) - 1:
+                raise
+    seconds = time.perf_counter() - start
+    if resolver is not None:
+        resolver.connected(host, port, address)
+    if timing is not None:
+        timing.connect += seconds
+    if telemetry is not None:
+        telemetry.connected(seconds)
+    return sock
+
+
+def _close_quietly(sock):
+    # Every socket opened by _connect is closed here, which keeps the open-connections gauge honest.
+    telemetry = metrics.active()
+    if telemetry is not None and sock.fileno() >= 0:
+        telemetry.disconnected()
+    try:
+        sock.close()
+    except OSError:
+        pass
+
+
+class ConnectionPool:
+    """Keep MLLP connections open across sends, keyed by (host, port)."""
+
+    def __init__(self, timeout=10, max_idle_per_key=4, resolver: Resolver | None = None):
+        self.timeout = timeout
+        self.max_idle_per_key = max_idle_per_key
+        # Pools live for one run, so their address cache does too.
+        self.resolver = resolver or Resolver()
+        self.connects = 0
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, host: str, port: int, timing: AttemptTiming | None = None):
+        """Return (sock, reused), preferring a healthy idle connection over a new one."""
+        key = (host, port)
+        with self._lock:
+            idle = self._idle.get(key, [])
+            while idle:
+                sock = idle.pop()
+                if _is_alive(sock):
+                    return sock, True
+                _close_quietly(sock)
+        sock = _connect(host, port, self.timeout, self.resolver, timing)
+        with self._lock:
+            self.connects += 1
+        return sock, False
+
+    def release(self, host: str, port: int, sock):
+        """Return a connection to the pool once its exchange completed cleanly."""
+        with self._lock:
+            idle = self._idle.setdefault((host, port), [])
+            if len(idle) < self.max_idle_per_key:
+                idle.append(sock)
+                return
+        _close_quietly(sock)
+
+    def discard(self, sock):
+        """Drop a connection that failed or was left mid-frame."""
+        _close_quietly(sock)
+
+    def idle_count(self):
+        with self._lock:
+            return sum(len(idle) for idle in self._idle.values())
+
+    def close(self):
+        """Close every idle connection."""
+        with self._lock:
+            idle_lists = list(self._idle.values())
+            self._idle.clear()
+        for idle in idle_lists:
+            for sock in idle:
+                _close_quietly(sock)
+
+
+def _write(sock, buffers, timing: AttemptTiming | None = None):
+    """Write one frame; returns the perf_counter time it finished when timed (telemetry or timing), else None."""
+    if metrics.active() is None and timing is None:
+        send_frame(sock, buffers)
+        return None
+    start = time.perf_counter()
+    send_frame(sock, buffers)
+    sent_at = time.perf_counter()
+    if timing is not None:
+        timing.write += sent_at - start
+        timing.written = True
+    return sent_at
+
+
+def _read_ack(sock, reader: FrameReader, sent_at: float | None, timing: AttemptTiming | None = None):
+    """Read one ACK frame back (None if the peer closes first), timing its first byte from sent_at."""
+    frame = reader.read_frame(sock)
+    if sent_at is not None and reader.first_byte_at is not None:
+        telemetry = metrics.active()
+        if timing is not None:
+            timing.first_byte = reader.first_byte_at - sent_at
+        if telemetry is not None:
+            telemetry.first_byte(reader.first_byte_at - sent_at)
+    return frame
+
+
+def _exchange(sock, buffers, reader: FrameReader, timing: AttemptTiming | None = None):
+    """Write one frame and read one ACK frame back (None if the peer closes first)."""
+    return _read_ack(sock, reader, _write(sock, buffers, timing), timing)
+
+
+def _send_pooled(pool: ConnectionPool, buffers, host: str, port: int, timing: AttemptTiming | None = None):
+    """
+    Send one frame over a pooled connection and return the ACK payload.
+    A reused connection whose write fails is dropped and the send is retried on the next one, since
+    nothing reached the receiver. Once the frame is written, a failure is raised instead: the receiver
+    may have accepted the message, so resending is left to the run's retry policy.
+    """
+    while True:
+        sock, reused = pool.acquire(host, port, timing)
+        reader = FrameReader()
+        try:
+            sent_at = _write(sock, buffers, timing)
+        except TimeoutError:
+            pool.discard(sock)
+            raise
+        except OSError:
+            pool.discard(sock)
+            if reused:
+                continue
+            raise
+        try:
+            frame = _read_ack(sock, reader, sent_at, timing)
+        except OSError:
+            pool.discard(sock)
+            raise
+        if frame is None:
+            pool.discard(sock)
+            raise ConnectionError("connection closed before a complete ACK was received")
+        if reader.pending:
+            pool.discard(sock)
+        else:
+            pool.release(host, port, sock)
+        return frame
+
+
+def send_hl7_message(message, host: str, port: int, timeout=10, pool: ConnectionPool | None = None,
+                     resolver: Resolver | None = None, timing: AttemptTiming | None = None):
+    """
+    Send HL7 message via MLLP and receive ACK, reusing a pooled connection when given one.
+    message may be text, an encoded body, a framing.PreparedMessage or pre-framed buffers.
+    Unpooled connections look host up through resolver when given one (pooled ones use the pool's),
+    and timing, when given, is filled in with where the attempt's time went.
+    """
+    buffers = as_buffers(message)
+    telemetry = metrics.active()
+    if telemetry is not None:
+        telemetry.in_flight_changed(1)
+    try:
+        if pool is None:
+            with _connect(host, port, timeout, resolver, timing) as sock:
+                try:
+                    frame = _exchange(sock, buffers, FrameReader(), timing)
+                finally:
+                    if telemetry is not None:
+                        telemetry.disconnected()
+            if frame is None:
+                raise ConnectionError("connection closed before a complete ACK was received")
+        else:
+            frame = _send_pooled(pool, buffers, host, port, timing)
+        return frame.strip(MLLP_START_BLOCK + MLLP_END_BLOCK).decode()
+    except Exception as e:
+        return f"Error: {e}"
+    finally:
+        if telemetry is not None:
+            telemetry.in_flight_changed(-1)
+
+
+def send_pipelined(messages, host: str, port: int, window=8, timeout=10, pool: ConnectionPool | None = None,
+                   resolver: Resolver | None = None, written: list | None = None, infos: list | None = None):
+    """
+    Send (message_id, message) pairs over one connection keeping up to window frames in flight.
+    Each message may be anything send_hl7_message accepts.
+    ACKs are matched back to requests by MSA-2; an ACK without a known control ID is matched to
+    the oldest outstanding request. Returns (ack, latency_seconds) per input, in input order,
+    with "Error: ..." acks for attempts that never completed. An unpooled connection looks host up
+    through resolver when given one. written, when given, is a list with a flag per input, set to
+    True once that input's frame has been written. infos, when given, is a list with a slot per input
+    that gets the hl7.AckInfo of its ACK, parsed once while matching it.
+    """
+    messages = list(messages)
+    results = [None] * len(messages)
+    if not messages:
+        return results
+    window = max(1, int(window))
+    in_flight = OrderedDict()
+    reader = FrameReader()
+    sock = None
+    telemetry = metrics.active()
+    counted = 0  # frames this call added to the in-flight gauge and has not yet taken off
+    try:
+        if pool is None:
+            sock = _connect(host, port, timeout, resolver)
+        else:
+            sock, _ = pool.acquire(host, port)
+        next_idx = 0
+        while next_idx < len(messages) or in_flight:
+            while next_idx < len(messages) and len(in_flight) < window:
+                message_id, message = messages[next_idx]
+                key = message_id if message_id is not None else ("#", next_idx)
+                in_flight[key] = (next_idx, time.perf_counter())
+                send_frame(sock, as_buffers(message))
+                if written is not None:
+                    written[next_idx] = True
+                if telemetry is not None:
+                    telemetry.in_flight_changed(1)
+                    counted += 1
+                next_idx += 1
+            frame = reader.read_frame(sock)
+            if frame is None:
+                raise ConnectionError("connection closed with ACKs still in flight")
+            while frame is not None:
+                received = time.perf_counter()
+                ack = frame.decode()
+                info = parse_ack(ack)
+                key = info.control_id or None
+                if key not in in_flight:
+                    key = next(iter(in_flight), None)
+                if key is not None:
+                    idx, sent_at = in_flight.pop(key)
+                    results[idx] = (ack, received - sent_at)
+                    if infos is not None:
+                        infos[idx] = info
+                    if telemetry is not None:
+                        telemetry.in_flight_changed(-1)
+                        counted -= 1
+                frame = reader.next_frame()
+    except Exception as e:
+        if telemetry is not None:
+            telemetry.in_flight_changed(-counted)
+        if sock is not None:
+            if pool is None:
+                _close_quietly(sock)
+            else:
+                pool.discard(sock)
+            sock = None
+        error = f"Error: {e}"
+        results = [r if r is not None else (error, 0.0) for r in results]
+    if sock is not None:
+        if pool is None:
+            _close_quietly(sock)
+        elif reader.pending:
+            pool.discard(sock)
+        else:
+            pool.release(host, port, sock)
+    return results
@@ -0,0 +1,183 @@
+"""
+Local MLLP ACK responder for benchmarking and regression tests.
+
+Stands in for the interface engine: answers every inbound frame with an ACK built by
+hl7.build_fake_ack, with a configurable AA/AE/AR mix, injected latency, and dropped or slow ACKs.
+"""
+import argparse
+import asyncio
+import random
+import sys
+import threading
+from dataclasses import dataclass, field
+
+from framing import MLLP_START_BLOCK, MLLP_END_BLOCK, FrameReader
+from hl7 import build_fake_ack
+
+
+@dataclass
+class ResponderConfig:
+    """How the mock receiver answers; ratios are probabilities per inbound frame."""
+    ae_ratio: float = 0.0
+    ar_ratio: float = 0.0
+    delay_ms: float = 0.0
+    jitter_ms: float = 0.0
+    drop_ratio: float = 0.0
+    slow_ratio: float = 0.0
+    slow_ms: float = 1000.0
+    seed: int | None = None
+
+
+@dataclass
+class ResponderStats:
+    connections: int = 0
+    frames: int = 0
+    dropped: int = 0
+    slow: int = 0
+    statuses: dict = field(default_factory=lambda: {"AA": 0, "AE": 0, "AR": 0})
+
+
+class _AckProtocol(asyncio.Protocol):
+    """Per-connection protocol: parse frames as they arrive and schedule one ACK per frame."""
+
+    def __init__(self, responder: "MockReceiver"):
+        self.responder = responder
+        self.reader = FrameReader()
+        self.transport = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.responder.stats.connections += 1
+
+    def data_received(self, data):
+        self.reader.feed(data)
+        while (frame := self.reader.next_frame()) is not None:
+            self.responder.answer(self.transport, frame)
+
+
+class MockReceiver:
+    """asyncio MLLP listener that answers frames according to a ResponderConfig."""
+
+    def __init__(self, config: ResponderConfig | None = None, host="127.0.0.1", port=0):
+        self.config = config or ResponderConfig()
+        self.host = host
+        self.port = port
+        self.stats = ResponderStats()
+        self._random = random.Random(self.config.seed)
+        self._server = None
+        self._loop = None
+
+    def pick_status(self):
+        roll = self._random.random()
+        if roll < self.config.ar_ratio:
+            return "AR"
+        if roll < self.config.ar_ratio + self.config.ae_ratio:
+            return "AE"
+        return "AA"
+
+    def answer(self, transport, frame: bytes):
+        """Build and send (or drop, or delay) the ACK for one inbound frame."""
+        config = self.config
+        self.stats.frames += 1
+        if config.drop_ratio and self._random.random() < config.drop_ratio:
+            self.stats.dropped += 1
+            return
+        status = self.pick_status()
+        self.stats.statuses[status] += 1
+        ack = build_fake_ack(frame.decode(errors="replace"), None, status=status)
+        payload = MLLP_START_BLOCK + ack.encode() + MLLP_END_BLOCK
+        delay = config.delay_ms
+        if config.jitter_ms:
+            delay += self._random.uniform(0, config.jitter_ms)
+        if config.slow_ratio and self._random.random() < config.slow_ratio:
+            self.stats.slow += 1
+            delay += config.slow_ms
+        if delay > 0:
+            self._loop.call_later(delay / 1000, self._write, transport, payload)
+        else:
+            transport.write(payload)
+
+    @staticmethod
+    def _write(transport, payload: bytes):
+        if not transport.is_closing():
+            transport.write(payload)
+
+    async def start(self):
+        self._loop = asyncio.get_running_loop()
+        self._server = await self._loop.create_server(lambda: _AckProtocol(self), self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self
+
+    async def serve_forever(self):
+        await self.start()
+        async with self._server:
+            await self._server.serve_forever()
+
+    def close(self):
+        if self._server is not None:
+            self._server.close()
+
+
+class ThreadedReceiver:
+    """Run a MockReceiver on its own event loop thread, for tests and benchmarks in synchronous code."""
+
+    def __init__(self, config: ResponderConfig | None = None, host="127.0.0.1", port=0):
+        self.receiver = MockReceiver(config, host, port)
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, daemon=True)
+        self._thread.start()
+        asyncio.run_coroutine_threadsafe(self.receiver.start(), self._loop).result()
+
+    @property
+    def port(self):
+        return self.receiver.port
+
+    @property
+    def stats(self):
+        return self.receiver.stats
+
+    def close(self):
+        self._loop.call_soon_threadsafe(self.receiver.close)
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(timeout=5)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="hl7-receiver", description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1", help="Listen address.")
+    parser.add_argument("--port", type=int, default=2575, help="Listen port.")
+    parser.add_argument("--ae", type=float, default=0.0, help="Fraction of frames answered AE.")
+    parser.add_argument("--ar", type=float, default=0.0, help="Fraction of frames answered AR.")
+    parser.add_argument("--delay-ms", type=float, default=0.0, help="Fixed delay before every ACK.")
+    parser.add_argument("--jitter-ms", type=float, default=0.0, help="Extra uniform random delay up to this.")
+    parser.add_argument("--drop", type=float, default=0.0, help="Fraction of frames never ACKed.")
+    parser.add_argument("--slow", type=float, default=0.0, help="Fraction of frames ACKed after --slow-ms.")
+    parser.add_argument("--slow-ms", type=float, default=1000.0, help="Extra delay for slow ACKs.")
+    parser.add_argument("--seed", type=int, help="Random seed for reproducible mixes.")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    config = ResponderConfig(ae_ratio=args.ae, ar_ratio=args.ar, delay_ms=args.delay_ms, jitter_ms=args.jitter_ms,
+                             drop_ratio=args.drop, slow_ratio=args.slow, slow_ms=args.slow_ms, seed=args.seed)
+    receiver = MockReceiver(config, args.host, args.port)
+    print(f"Listening for MLLP on {args.host}:{args.port}", file=sys.stderr)
+    try:
+        asyncio.run(receiver.serve_forever())
+    except KeyboardInterrupt:
+        pass
+    stats = receiver.stats
+    print(f"connections={stats.connections} frames={stats.frames} dropped={stats.dropped} slow={stats.slow} "
+          + " ".join(f"{k}={v}" for k, v in stats.statuses.items()), file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,252 @@
+"""
+Compact, bounded storage for per-attempt ACK records.
+
+Long soak runs produce millions of attempts, so records are kept column-wise in typed arrays with
+ACK statuses interned to one byte each. Full ACK bodies are kept only for failures, a 1-in-N sample
+and the most recent attempt, and only the newest max_rows attempts are retained at all; totals and
+status counts always cover the whole run.
+"""
+import math
+import sys
+import threading
+from array import array
+
+from hl7 import parse_ack
+
+# Per-attempt phase timings carried by AckRecord.phases, in this order (see mllp.AttemptTiming).
+PHASES = ("dns", "connect", "write", "first_byte")
+_NO_PHASES = (float("nan"),) * len(PHASES)
+# Status of a try that got no ACK at all (connection error, timeout), recorded when the run carries on
+# past it: retried, or with continue-on-error. Errors that stop the run are not recorded as attempts.
+ERROR_STATUS = "ERROR"
+
+
+class AckRecord:
+    """
+    One ACK'd attempt, with the ACK parsed once on arrival into status, error code and MSA-3 text;
+    pass info (an hl7.AckInfo) when the send path already parsed it.
+    phases is a tuple of seconds per PHASES entry for stop-and-wait sends, None where the send path
+    does not time attempts separately (pipelined, open-loop, simulated). retry is 0 for the first
+    try of an attempt and n for its n-th resend (see resilience.RetryPolicy). messages is how many
+    HL7 messages the frame carried: 1, or the batch size in batch mode (see framing.BatchMessage).
+    Supports record["field"] access so callers can treat it like the old dicts.
+    """
+    __slots__ = ("cycle", "message_idx", "attempt", "message_id", "status", "duration", "ack",
+                 "error_code", "text", "timestamp", "bytes_sent", "connection_id", "phases", "retry",
+                 "messages")
+
+    def __init__(self, cycle, message_idx, attempt, message_id, ack, duration, status=None,
+                 timestamp=None, bytes_sent=None, connection_id=None, error_code=None, text=None, phases=None,
+                 retry=0, messages=1, info=None):
+        self.cycle = cycle
+        self.message_idx = message_idx
+        self.attempt = attempt
+        self.message_id = message_id
+        self.ack = ack
+        self.duration = duration
+        if status is None:
+            info = info or parse_ack(ack)
+            status, error_code, text = info.status, info.error_code, info.text
+        self.status = status
+        self.error_code = error_code
+        self.text = text
+        self.timestamp = timestamp
+        # Only set on live records (e.g. for the on-disk result log); AckLog does not retain them.
+        self.bytes_sent = bytes_sent
+        self.connection_id = connection_id
+        self.phases = phases
+        self.retry = retry
+        self.messages = messages
+
+    def __getitem__(self, key):
+        return getattr(self, key)
+
+    def __repr__(self):
+        return (f"AckRecord(cycle={self.cycle}, message_idx={self.message_idx}, attempt={self.attempt}, "
+                f"message_id={self.message_id!r}, status={self.status!r}, duration={self.duration!r}, "
+                f"retry={self.retry})")
+
+
+class AckLog:
+    """
+    Append-only columnar store of AckRecords.
+
+    len() and iteration cover the retained window (the newest max_rows attempts); total,
+    status_counts and retries (the resends among them) cover every attempt ever appended, as do
+    messages (HL7 messages carried by first tries that got an ACK, which batches make more than one
+    per attempt; throughput is measured on these), unacked (first tries that got no ACK) and
+    bytes_sent (framed bytes of every try that reported them). Records read back carry ack=None when
+    their body was not kept.
+
+    A send job appends from its own thread while the UI reads; append (with its trimming), indexing
+    and since() hold a lock so a reader never sees the window half-trimmed.
+    """
+
+    def __init__(self, max_rows=200_000, sample_every=100):
+        self.max_rows = max_rows
+        self.sample_every = sample_every
+        self.total = 0
+        self.status_counts = {}
+        self.retries = 0
+        self.messages = 0
+        self.unacked = 0
+        self.bytes_sent = 0
+        self.last_ack = None
+        self._first = 0  # absolute index of the oldest retained row
+        self._cycle = array("I")
+        self._message_idx = array("I")
+        self._attempt = array("I")
+        self._retry = array("H")
+        self._duration = array("d")
+        self._status = array("B")
+        self._error = array("H")  # 0 = no error code
+        self._timestamp = array("d")
+        self._phases = [array("d") for _ in PHASES]  # NaN for attempts without phase timings
+        self._message_ids = []
+        self._bodies = {}  # absolute index -> ACK text
+        self._codes = {}
+        self._statuses = []
+        self._error_codes = {None: 0}
+        self._errors = [None]
+        self._lock = threading.Lock()
+
+    def _code(self, status: str):
+        code = self._codes.get(status)
+        if code is None:
+            if len(self._statuses) == 255:
+                # One byte per row; garbage MSA-1 values beyond that share a bucket.
+                return self._code("UNKNOWN")
+            code = self._codes[status] = len(self._statuses)
+            self._statuses.append(sys.intern(status))
+        return code
+
+    def _error_code(self, error_code: str | None):
+        code = self._error_codes.get(error_code)
+        if code is None:
+            if len(self._errors) == 65535:
+                return self._error_code("OTHER")
+            code = self._error_codes[error_code] = len(self._errors)
+            self._errors.append(sys.intern(error_code))
+        return code
+
+    def append(self, record: AckRecord):
+        with self._lock:
+            self._append(record)
+
+    def _append(self, record: AckRecord):
+        index = self.total
+        self._cycle.append(record.cycle)
+        self._message_idx.append(record.message_idx)
+        self._attempt.append(record.attempt)
+        self._retry.append(record.retry)
+        if record.retry:
+            self.retries += 1
+        elif record.status == ERROR_STATUS:
+            self.unacked += 1
+        else:
+            self.messages += record.messages
+        self.bytes_sent += record.bytes_sent or 0
+        self._duration.append(record.duration)
+        self._status.append(self._code(record.status))
+        self._error.append(self._error_code(record.error_code))
+        self._timestamp.append(record.timestamp or 0.0)
+        for column, seconds in zip(self._phases, record.phases or _NO_PHASES):
+            column.append(seconds)
+        self._message_ids.append(record.message_id)
+        if record.status != "AA" or index % self.sample_every == 0:
+            self._bodies[index] = record.ack
+        self.status_counts[record.status] = self.status_counts.get(record.status, 0) + 1
+        self.last_ack = record.ack
+        self.total += 1
+        # Trim in quarter-window chunks so dropping old rows stays amortised O(1) per append.
+        if len(self._status) >= self.max_rows + max(1, self.max_rows // 4):
+            self._drop(len(self._status) - self.max_rows)
+
+    def _drop(self, count: int):
+        for column in (self._cycle, self._message_idx, self._attempt, self._retry, self._duration, self._status,
+                       self._error, self._timestamp, *self._phases):
+            del column[:count]
+        del self._message_ids[:count]
+        self._first += count
+        while self._bodies and next(iter(self._bodies)) < self._first:
+            del self._bodies[next(iter(self._bodies))]
+
+    @property
+    def failures(self):
+        """Attempts in the whole run whose ACK status was not AA."""
+        return self.total - self.status_counts.get("AA", 0)
+
+    @property
+    def errors(self):
+        """Recorded tries that got no ACK (see ERROR_STATUS)."""
+        return self.status_counts.get(ERROR_STATUS, 0)
+
+    @property
+    def first_attempts(self):
+        """Attempts in the whole run that were not resends."""
+        return self.total - self.retries
+
+    @property
+    def acked_attempts(self):
+        """First tries in the whole run that got an ACK (AA, AE or AR)."""
+        return self.first_attempts - self.unacked
+
+    @property
+    def dropped(self):
+        """Oldest attempts no longer retained row by row."""
+        return self._first
+
+    def __len__(self):
+        return len(self._status)
+
+    def _row(self, offset: int):
+        index = self._first + offset
+        ack = self.last_ack if index == self.total - 1 else self._bodies.get(index)
+        phases = tuple(column[offset] for column in self._phases)
+        return AckRecord(self._cycle[offset], self._message_idx[offset], self._attempt[offset],
+                         self._message_ids[offset], ack, self._duration[offset],
+                         status=self._statuses[self._status[offset]], timestamp=self._timestamp[offset] or None,
+                         error_code=self._errors[self._error[offset]],
+                         phases=None if math.isnan(phases[0]) else phases, retry=self._retry[offset])
+
+    def __getitem__(self, key):
+        with self._lock:
+            if isinstance(key, slice):
+                return [self._row(offset) for offset in range(*key.indices(len(self)))]
+            if key < 0:
+                key += len(self)
+            if not 0 <= key < len(self):
+                raise IndexError("AckLog index out of range")
+            return self._row(key)
+
+    def __iter__(self):
+        for offset in range(len(self)):
+            yield self._row(offset)
+
+    def since(self, index: int):
+        """
+        Return (records, next_index): retained records from absolute index onwards, and the index to
+        pass next time. Lets a view append only what is new instead of rebuilding from scratch.
+        """
+        with self._lock:
+            start = max(index - self._first, 0)
+            return [self._row(offset) for offset in range(start, len(self))], self.total
+
+    def columns(self):
+        """
+        The retained window as typed arrays plus the category tables their codes index into, for
+        vectorised analysis (see analysis.py) without materialising a record per row.
+        """
+        return {
+            "cycle": self._cycle,
+            "message_idx": self._message_idx,
+            "attempt": self._attempt,
+            "retry": self._retry,
+            "duration": self._duration,
+            "timestamp": self._timestamp,
+            "phases": dict(zip(PHASES, self._phases)),
+            "status_codes": self._status,
+            "statuses": list(self._statuses),
+            "error_codes": self._error,
+            "errors": list(self._errors),
+        }
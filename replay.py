@@ -0,0 +1,130 @@
+"""
+Traffic replay: send captured messages at their original inter-arrival times, optionally compressed.
+
+Arrival times come from each message's MSH-7 (date/time of message) or from a sidecar timing file
+with one line per message, in message order, holding seconds (epoch or relative) or an ISO 8601
+timestamp; only the differences between times matter. ReplaySchedule turns them into due offsets
+divided by the speed-up factor, and loadgen.run_replay sends each message when its offset comes up.
+"""
+import bisect
+import heapq
+import re
+from datetime import datetime, timedelta, timezone
+
+from hl7parse import HL7Message
+
+_TIMESTAMP = re.compile(r"(\d{4})(\d{2})?(\d{2})?(\d{2})?(\d{2})?(\d{2})?(?:\.(\d{1,6}))?([+-]\d{4})?")
+
+
+def parse_hl7_timestamp(value: str):
+    """
+    Seconds since the epoch for an HL7 DTM/TS value such as 20250101120000.1234-0500, or None when it
+    is not one. Values without a UTC offset are taken as UTC, which keeps differences between them exact.
+    """
+    match = _TIMESTAMP.fullmatch(value.split("^", 1)[0].strip())
+    if not match:
+        return None
+    year, month, day, hour, minute, second, fraction, offset = match.groups()
+    try:
+        moment = datetime(int(year), int(month or 1), int(day or 1), int(hour or 0), int(minute or 0),
+                          int(second or 0), tzinfo=timezone.utc)
+    except ValueError:
+        return None
+    seconds = moment.timestamp() + (float(f"0.{fraction}") if fraction else 0.0)
+    if offset:
+        sign = 1 if offset[0] == "+" else -1
+        seconds -= sign * timedelta(hours=int(offset[1:3]), minutes=int(offset[3:])).total_seconds()
+    return seconds
+
+
+def message_times(messages):
+    """
+    Arrival time of each message from its MSH-7. A message without a usable MSH-7 takes the time of
+    the one before it (or, at the start, the first one that has a time), so it is sent right after it.
+    """
+    times = []
+    for message in messages:
+        msh = HL7Message(message).fields("MSH")
+        times.append(parse_hl7_timestamp(msh[6]) if msh is not None and len(msh) > 6 else None)
+    known = [t for t in times if t is not None]
+    if not known:
+        raise ValueError("No message has an MSH-7 timestamp to replay; use a timing file instead")
+    previous = known[0]
+    for position, seconds in enumerate(times):
+        if seconds is None:
+            times[position] = previous
+        else:
+            previous = seconds
+    return times
+
+
+def _parse_time(value: str):
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        moment = datetime.fromisoformat(value)
+    except ValueError:
+        raise ValueError(f"Invalid time in timing file: {value!r}") from None
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return moment.timestamp()
+
+
+def load_timing(path: str):
+    """
+    Read a sidecar timing file: one time per non-blank line, taken from the first comma- or
+    whitespace-separated column so exported CSV works; a non-numeric header line is skipped.
+    """
+    times = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            value = re.split(r"[,\s]", line.strip(), maxsplit=1)[0]
+            if not value:
+                continue
+            try:
+                times.append(_parse_time(value))
+            except ValueError:
+                if times:
+                    raise
+    return times
+
+
+class ReplaySchedule:
+    """
+    Due offsets for a replay: message i is due (times[i] - earliest) / speed seconds into the run.
+    A heap orders sends by due time, so captures merged from several feeds, whose timestamps are not
+    in file order, still go out in arrival order; ties keep file order.
+    """
+
+    def __init__(self, times, speed=1.0):
+        if speed <= 0:
+            raise ValueError("Replay speed-up must be positive")
+        times = list(times)
+        origin = min(times, default=0.0)
+        self._heap = [((t - origin) / speed, position) for position, t in enumerate(times)]
+        heapq.heapify(self._heap)
+        self._dues = sorted(due for due, _ in self._heap)
+        self.duration = self._dues[-1] if self._dues else 0.0
+
+    def __len__(self):
+        return len(self._heap)
+
+    def due_by(self, seconds: float):
+        """Number of messages due within the first seconds of the replay, whether taken yet or not."""
+        return bisect.bisect_right(self._dues, seconds)
+
+    def take(self):
+        """Return (due offset, message position) of the next send, or None once every message is due."""
+        return heapq.heappop(self._heap) if self._heap else None
+
+
+def replay_schedule(messages, timing_path: str | None = None, speed=1.0):
+    """The ReplaySchedule for messages, timed by the sidecar file at timing_path or else by MSH-7."""
+    if timing_path is None:
+        return ReplaySchedule(message_times(messages), speed)
+    times = load_timing(timing_path)
+    if len(times) != len(messages):
+        raise ValueError(f"Timing file has {len(times)} times for {len(messages)} messages")
+    return ReplaySchedule(times, speed)
@@ -0,0 +1,77 @@
+"""
+Resilience around the send path: retries with jittered exponential backoff and a circuit breaker.
+
+A failed try (a connection error, timeout or missing ACK, and optionally an AE/AR NAK) is resent
+after a backoff of up to backoff * 2**(retry - 1) seconds, capped at max_backoff, with full jitter
+so many connections or workers retrying at once do not hammer a recovering endpoint in lockstep.
+A retry reuses the message's MSH-10, as a real sender's retransmission would.
+
+The circuit breaker counts consecutive failed tries against one endpoint (each run_send, and so each
+routed endpoint, worker process or agent, has its own). After threshold failures it opens: the
+sender stops trying that endpoint for reset_seconds, then lets one probe through. A probe that gets
+an ACK closes the breaker; one that fails opens it again.
+"""
+import random
+import time
+from dataclasses import dataclass
+
+# ACK statuses retried when retry_naks is set.
+RETRY_STATUSES = ("AE", "AR")
+
+
+@dataclass(frozen=True)
+class RetryPolicy:
+    """How many times to resend a failed try (0 = never) and how long to back off before each resend."""
+    retries: int = 0
+    backoff: float = 0.1
+    max_backoff: float = 5.0
+    retry_naks: bool = False
+
+    def retries_status(self, status: str):
+        """Whether an ACK with this MSA-1 status is retried (connection errors always are)."""
+        return self.retry_naks and status in RETRY_STATUSES
+
+    def delay(self, retry: int, rng=random):
+        """Seconds to wait before resend number retry (1-based): uniform up to the capped exponential step."""
+        return rng.uniform(0, min(self.max_backoff, self.backoff * 2 ** (retry - 1)))
+
+
+class CircuitBreaker:
+    """Opens after threshold consecutive failures (0 = never) and probes again after reset_seconds."""
+
+    def __init__(self, threshold=0, reset_seconds=30.0, clock=time.perf_counter):
+        self.threshold = threshold
+        self.reset_seconds = reset_seconds
+        self.clock = clock
+        self.failures = 0
+        self.opened_at = None
+        self.trips = 0
+
+    @property
+    def is_open(self):
+        return self.opened_at is not None
+
+    def remaining(self):
+        """Seconds until an open breaker lets a probe through; 0 when closed or due to probe."""
+        if self.opened_at is None:
+            return 0.0
+        return max(0.0, self.opened_at + self.reset_seconds - self.clock())
+
+    def success(self):
+        self.failures = 0
+        self.opened_at = None
+
+    def failure(self):
+        """Count a failed try; returns True when it opens the breaker."""
+        self.failures += 1
+        if not self.threshold:
+            return False
+        if self.opened_at is not None:
+            # A failed probe: stay open for another reset period.
+            self.opened_at = self.clock()
+            return False
+        if self.failures >= self.threshold:
+            self.opened_at = self.clock()
+            self.trips += 1
+            return True
+        return False
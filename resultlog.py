@@ -0,0 +1,184 @@
+"""
+On-disk SQLite log of send runs and every attempt in them.
+
+Attempts are buffered and written in batched transactions from the sending thread, so a soak run
+keeps memory flat however long it goes; runs are indexed by run id and summarised when they finish
+so history views can list and compare them without loading any attempts.
+"""
+import json
+import os
+import sqlite3
+import time
+from dataclasses import asdict
+
+FLUSH_EVERY = 1000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    label TEXT,
+    host TEXT,
+    port INTEGER,
+    options TEXT,
+    started_at REAL NOT NULL,
+    finished_at REAL,
+    status TEXT,
+    attempts INTEGER,
+    failures INTEGER,
+    bytes INTEGER,
+    msgs_per_sec REAL,
+    p50_ms REAL,
+    p90_ms REAL,
+    p95_ms REAL,
+    p99_ms REAL,
+    p999_ms REAL,
+    max_ms REAL,
+    mean_ms REAL,
+    error_message TEXT
+);
+CREATE TABLE IF NOT EXISTS attempts (
+    run_id INTEGER NOT NULL REFERENCES runs(run_id),
+    seq INTEGER NOT NULL,
+    ts REAL NOT NULL,
+    cycle INTEGER,
+    message_idx INTEGER,
+    attempt INTEGER,
+    message_id TEXT,
+    status TEXT,
+    latency_ms REAL,
+    bytes INTEGER,
+    connection_id INTEGER,
+    PRIMARY KEY (run_id, seq)
+) WITHOUT ROWID;
+"""
+
+RUN_COLUMNS = ["run_id", "label", "host", "port", "started_at", "finished_at", "status", "attempts",
+               "failures", "bytes", "msgs_per_sec", "p50_ms", "p90_ms", "p95_ms", "p99_ms", "p999_ms",
+               "max_ms", "mean_ms", "error_message"]
+ATTEMPT_COLUMNS = ["seq", "ts", "cycle", "message_idx", "attempt", "message_id", "status", "latency_ms",
+                   "bytes", "connection_id"]
+
+
+def _connect(path: str):
+    conn = sqlite3.connect(path, check_same_thread=False)
+    # WAL lets the UI read history while a job thread is appending.
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA foreign_keys=ON")
+    return conn
+
+
+class ResultLog:
+    """A results database; open_run() hands out a writer for one run, the rest are read-side queries."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._created = False
+
+    def _connect(self):
+        # The file is only created once something is written or read, not when the log is constructed.
+        if not self._created:
+            if os.path.dirname(self.path):
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            conn = _connect(self.path)
+            conn.executescript(SCHEMA)
+            self._created = True
+            return conn
+        return _connect(self.path)
+
+    def open_run(self, options, label: str = ""):
+        """Register a new run and return its RunWriter."""
+        return RunWriter(self._connect(), options, label)
+
+    def _query(self, sql: str, params=()):
+        conn = self._connect()
+        try:
+            cursor = conn.execute(sql, params)
+            columns = [c[0] for c in cursor.description]
+            return [dict(zip(columns, row)) for row in cursor.fetchall()]
+        finally:
+            conn.close()
+
+    def runs(self, limit=50):
+        """Newest runs first, summaries only."""
+        return self._query(f"SELECT {', '.join(RUN_COLUMNS)} FROM runs ORDER BY run_id DESC LIMIT ?", (limit,))
+
+    def run(self, run_id: int):
+        rows = self._query("SELECT * FROM runs WHERE run_id = ?", (run_id,))
+        return rows[0] if rows else None
+
+    def attempts(self, run_id: int, limit=10_000, offset=0):
+        """A page of one run's attempts in send order."""
+        return self._query(f"SELECT {', '.join(ATTEMPT_COLUMNS)} FROM attempts WHERE run_id = ? "
+                           f"ORDER BY seq LIMIT ? OFFSET ?", (run_id, limit, offset))
+
+    def delete_run(self, run_id: int):
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute("DELETE FROM attempts WHERE run_id = ?", (run_id,))
+                conn.execute("DELETE FROM runs WHERE run_id = ?", (run_id,))
+        finally:
+            conn.close()
+
+
+class RunWriter:
+    """
+    Appends one run's attempts, FLUSH_EVERY rows per transaction. Use add() as run_send's on_record
+    and call finish(results) once the run ends; both must be called from the same thread.
+    """
+
+    def __init__(self, conn: sqlite3.Connection, options, label: str = ""):
+        self._conn = conn
+        self._pending = []
+        self._seq = 0
+        self.bytes = 0
+        with self._conn:
+            cursor = self._conn.execute(
+                "INSERT INTO runs (label, host, port, options, started_at, status) VALUES (?, ?, ?, ?, ?, ?)",
+                (label, options.host, options.port, json.dumps(asdict(options), default=repr), time.time(),
+                 "running"))
+        self.run_id = cursor.lastrowid
+
+    def add(self, record):
+        self._seq += 1
+        self.bytes += record.bytes_sent or 0
+        self._pending.append((self.run_id, self._seq, record.timestamp or time.time(), record.cycle,
+                              record.message_idx, record.attempt, record.message_id, record.status,
+                              record.duration * 1000, record.bytes_sent, record.connection_id))
+        if len(self._pending) >= FLUSH_EVERY:
+            self.flush()
+
+    def flush(self):
+        if not self._pending:
+            return
+        with self._conn:
+            self._conn.executemany(f"INSERT INTO attempts (run_id, {', '.join(ATTEMPT_COLUMNS)}) "
+                                   f"VALUES ({', '.join('?' * (len(ATTEMPT_COLUMNS) + 1))})", self._pending)
+        self._pending.clear()
+
+    def finish(self, results):
+        """Write the remaining attempts and the run summary from a runner results dict, then close."""
+        try:
+            self.flush()
+            records = results["ack_records"]
+            end = results["batch_end_time"] or time.perf_counter()
+            elapsed = end - results["batch_start_time"]
+            latency = results["histogram"].summary()
+            if results["cancelled"]:
+                status = "cancelled"
+            elif results["error_message"]:
+                status = "error"
+            else:
+                status = "finished"
+            percentiles = [latency[name] * 1000 for name in ("p50", "p90", "p95", "p99", "p99.9")]
+            with self._conn:
+                self._conn.execute(
+                    "UPDATE runs SET finished_at = ?, status = ?, attempts = ?, failures = ?, bytes = ?, "
+                    "msgs_per_sec = ?, p50_ms = ?, p90_ms = ?, p95_ms = ?, p99_ms = ?, p999_ms = ?, max_ms = ?, "
+                    "mean_ms = ?, error_message = ? WHERE run_id = ?",
+                    (time.time(), status, records.total, records.failures, self.bytes,
+                     records.messages / elapsed if elapsed > 0 else 0.0, *percentiles,
+                     latency["max"] * 1000, latency["mean"] * 1000, results["error_message"], self.run_id))
+        finally:
+            self._conn.close()
@@ -0,0 +1,233 @@
+"""
+Multi-destination sending: named endpoints, and routing rules keyed on MSH-9 (message type) or
+MSH-5/MSH-6 (receiving application and facility).
+
+config.json may describe them next to the default HOST/PORT:
+
+    "ENDPOINTS": [{"name": "adt", "host": "adt-listener", "port": 2575, "max_rate": 0}, ...],
+    "ROUTES": [{"endpoint": "adt", "message_type": "ADT"},
+               {"endpoint": "lab", "message_type": "OR[MU]^*", "receiving_facility": "LAB*"}, ...]
+
+Routes are tried in order and the first match wins. Route fields are fnmatch patterns, and every
+field a route sets must match; a route that sets none catches everything. run_routed deals each
+message to its endpoint and runs every endpoint's share in parallel, each with its own options
+(host, port, max_rate, share of an open-loop rate), connection pool and results, merging attempts into the run's results as they
+complete and keeping each endpoint's results for a per-endpoint breakdown.
+"""
+import dataclasses
+import itertools
+import threading
+import time
+from array import array
+from dataclasses import dataclass
+from fnmatch import fnmatchcase
+
+from hl7parse import HL7Message
+from mllp import ConnectionPool
+from records import AckLog
+from runner import SendOptions, new_results, record_attempt, run_send
+from workers import SampledProfile
+
+# Rows each endpoint's own log keeps; the run's log holds every attempt, the endpoint logs feed the breakdown.
+ENDPOINT_ROWS = 1000
+
+
+@dataclass(frozen=True)
+class Endpoint:
+    """A named destination; max_rate caps its attempts per second (0 = as fast as it answers)."""
+    name: str
+    host: str
+    port: int
+    max_rate: float = 0.0
+
+
+@dataclass(frozen=True)
+class Route:
+    """
+    Send messages matching every pattern set here to endpoint. message_type is matched against
+    MSH-9 as type^event (e.g. "ADT^A0*"), or against MSH-9.1 alone when it has no "^" (e.g. "ORU").
+    """
+    endpoint: str
+    message_type: str = ""
+    receiving_application: str = ""
+    receiving_facility: str = ""
+
+    def matches(self, msh, component="^"):
+        """
+        Whether this route takes a message with these MSH pieces (HL7Message.fields("MSH")), whose
+        component separator (MSH-2) is component. Patterns always write type^event with "^".
+        """
+        def field(n):
+            # Piece n of MSH is MSH-(n+1); MSH-5 and MSH-6 are compared on their first component.
+            return msh[n] if msh is not None and len(msh) > n else ""
+
+        if self.message_type:
+            parts = field(8).split(component)
+            value = "^".join(parts[:2]) if "^" in self.message_type else parts[0]
+            if not fnmatchcase(value, self.message_type):
+                return False
+        if self.receiving_application and not fnmatchcase(field(4).split(component)[0],
+                                                          self.receiving_application):
+            return False
+        if self.receiving_facility and not fnmatchcase(field(5).split(component)[0], self.receiving_facility):
+            return False
+        return True
+
+
+class Router:
+    """Picks the endpoint for each message from an ordered list of routes."""
+
+    def __init__(self, endpoints, routes):
+        self.endpoints = list(endpoints)
+        self.routes = list(routes)
+        names = [endpoint.name for endpoint in self.endpoints]
+        if len(set(names)) != len(names):
+            raise ValueError("Endpoint names must be unique")
+        self._positions = {name: position for position, name in enumerate(names)}
+        for route in self.routes:
+            if route.endpoint not in self._positions:
+                raise ValueError(f"Route to unknown endpoint {route.endpoint!r}")
+        if not self.routes and len(self.endpoints) == 1:
+            # A single endpoint needs no rules.
+            self.routes = [Route(self.endpoints[0].name)]
+
+    def route(self, message: str):
+        """Position in endpoints of the endpoint for message, or None when no route matches."""
+        parsed = HL7Message(message)
+        msh = parsed.fields("MSH")
+        for route in self.routes:
+            if route.matches(msh, parsed.encoding.component):
+                return self._positions[route.endpoint]
+        return None
+
+
+def routing_from_config(config: dict):
+    """(endpoints, routes) from the ENDPOINTS and ROUTES entries of a config dict."""
+    endpoints = tuple(Endpoint(str(e["name"]), str(e["host"]), int(e["port"]), float(e.get("max_rate") or 0))
+                      for e in config.get("ENDPOINTS", []))
+    fields = {f.name for f in dataclasses.fields(Route)}
+    routes = tuple(Route(**{key: str(value) for key, value in r.items() if key in fields and value})
+                   for r in config.get("ROUTES", []))
+    return endpoints, routes
+
+
+def routing_to_config(endpoints, routes):
+    return {"ENDPOINTS": [dataclasses.asdict(e) for e in endpoints],
+            "ROUTES": [{key: value for key, value in dataclasses.asdict(r).items() if value} for r in routes]}
+
+
+class _Routed:
+    """The messages of a re-iterable source assigned to one endpoint; assignments holds one entry per message."""
+
+    def __init__(self, source, assignments, endpoint: int):
+        self.source = source
+        self.assignments = assignments
+        self.endpoint = endpoint
+
+    def __iter__(self):
+        return (message for message, assigned in zip(self.source, self.assignments) if assigned == self.endpoint)
+
+
+def run_routed(messages, options: SendOptions, results, on_record=None, on_status=None, should_stop=None):
+    """
+    Route every message to one of options.endpoints by options.routes and send each endpoint's share
+    in parallel, filling results in place like runner.run_send. Each endpoint runs with options as
+    given except for its host, port, max_rate and its share of any open-loop rate (by the messages
+    routed to it), so processes, agents, window and connections apply per endpoint. on_record(record) fires for every attempt with run-wide message numbers, and
+    results["endpoints"] maps each endpoint name to its own results dict. A message that matches no
+    route fails the run before anything is sent; the first endpoint error stops the others.
+    """
+    on_status = on_status or (lambda text: None)
+    should_stop = should_stop or (lambda: False)
+    try:
+        router = Router(options.endpoints, options.routes)
+        assignments = array("H")
+        positions = [array("I") for _ in router.endpoints]
+        for position, message in enumerate(messages, start=1):
+            endpoint = router.route(message)
+            if endpoint is None:
+                msh = HL7Message(message).fields("MSH")
+                message_type = msh[8] if msh is not None and len(msh) > 8 else ""
+                raise ValueError(f"message {position} ({message_type or 'no MSH-9'}) matches no route")
+            assignments.append(endpoint)
+            positions[endpoint].append(position)
+    except ValueError as e:
+        results["error_message"] = f"Error: {e}"
+        results["batch_end_time"] = time.perf_counter()
+        return results
+    results["num_messages"] = len(assignments)
+
+    lock = threading.Lock()
+    stop = threading.Event()
+    statuses = {}
+    endpoint_results = results["endpoints"]
+
+    def run_endpoint(index: int, endpoint: Endpoint):
+        if isinstance(messages, list):
+            share = [message for message, assigned in zip(messages, assignments) if assigned == index]
+        else:
+            share = _Routed(messages, assignments, index)
+        profile = options.rate_profile
+        if profile is not None:
+            # Each endpoint offers the open-loop rate in proportion to the messages routed to it.
+            profile = SampledProfile.sample(profile, options.load_seconds, len(positions[index]) / len(assignments))
+        endpoint_options = dataclasses.replace(options, host=endpoint.host, port=endpoint.port,
+                                               max_rate=endpoint.max_rate or options.max_rate, rate_profile=profile,
+                                               endpoints=(), routes=())
+        pool = ConnectionPool(timeout=options.timeout)
+        sub_results = new_results(len(positions[index]), endpoint_options, pool)
+        sub_results["ack_records"] = AckLog(max_rows=ENDPOINT_ROWS)
+        endpoint_results[endpoint.name] = sub_results
+
+        def add(record):
+            with lock:
+                # Batches are numbered per endpoint; only single messages map back to run-wide numbers.
+                if options.batch_size <= 1:
+                    record.message_idx = positions[index][record.message_idx - 1]
+                record_attempt(results, record)
+                if on_record:
+                    on_record(record)
+
+        def set_status(text):
+            with lock:
+                statuses[endpoint.name] = text
+                on_status(" | ".join(f"{name}: {status}" for name, status in statuses.items()))
+
+        try:
+            run_send(share, endpoint_options, sub_results, pool=pool, on_record=add, on_status=set_status,
+                     should_stop=lambda: stop.is_set() or should_stop(), sleep=stop.wait)
+        except Exception as e:
+            sub_results["error_message"] = sub_results["error_message"] or f"Error: {e}"
+            sub_results["batch_end_time"] = sub_results["batch_end_time"] or time.perf_counter()
+        finally:
+            pool.close()
+        if sub_results["error_message"]:
+            stop.set()
+
+    threads = [threading.Thread(target=run_endpoint, args=(index, endpoint), name=f"endpoint-{endpoint.name}",
+                                daemon=True)
+               for index, endpoint in enumerate(router.endpoints) if positions[index]]
+    for thread in threads:
+        thread.start()
+    # Poll the caller's stop here too, so a cancel reaches endpoints sleeping between cycles or rate slots.
+    cancelled = False
+    while any(thread.is_alive() for thread in threads):
+        if not stop.is_set() and should_stop():
+            cancelled = True
+            stop.set()
+        for thread in threads:
+            thread.join(timeout=0.1)
+
+    used = [endpoint_results[e.name] for e in router.endpoints if e.name in endpoint_results]
+    errors = [f"Endpoint {name}: {sub['error_message']}" for name, sub in endpoint_results.items()
+              if sub["error_message"]]
+    results["error_message"] = errors[0] if errors else None
+    # Endpoints stopped because another one failed report cancelled too; only a caller's stop counts.
+    results["cancelled"] = cancelled or (not errors and any(sub["cancelled"] for sub in used))
+    connects = [sub["connects"] for sub in used if sub["connects"] is not None]
+    if connects:
+        results["connects"] = sum(connects)
+    results["rate_reports"].extend(itertools.chain.from_iterable(sub["rate_reports"] for sub in used))
+    results["breaker_trips"] = sum(sub["breaker_trips"] for sub in used)
+    results["batch_end_time"] = time.perf_counter()
+    return results
@@ -0,0 +1,526 @@
+import itertools
+import time
+import uuid
+from dataclasses import dataclass
+from typing import Callable
+
+from engine import Engine
+from framing import BatchMessage, PreparedMessage
+from histogram import LatencyHistogram
+from hl7 import MessageSource, build_fake_ack
+from loadgen import run_open_loop_sync, run_replay_sync
+import metrics
+from mllp import AttemptTiming, ConnectionPool, Resolver, send_hl7_message, send_pipelined
+from records import ERROR_STATUS, PHASES, AckLog, AckRecord
+from replay import replay_schedule
+from resilience import CircuitBreaker, RetryPolicy
+from templates import MessageTemplate, TemplateSource
+
+# Attempts handed to the pipelined/parallel senders at a time, so lazy sources stay lazy; the
+# connections stay open from one batch to the next.
+PIPELINE_BATCH = 1000
+
+
+@dataclass
+class SendOptions:
+    """Everything that shapes a send run, independent of the UI or CLI that collected it."""
+    host: str
+    port: int
+    repeat_count: int = 1
+    num_cycles: int = 1
+    interval_seconds: float = 0.0
+    generate_message_id: bool = True
+    simulate_ack: bool = False
+    use_pool: bool = True
+    window: int = 1
+    connections: int = 1
+    rate_profile: Callable[[float], float] | None = None
+    load_seconds: float = 0.0
+    timeout: float = 10
+    templated: bool = False
+    processes: int = 1
+    agents: tuple[str, ...] = ()
+    # Replay each message once at its captured arrival time (MSH-7, or the sidecar timing file at
+    # replay_timing), compressed by replay_speed; takes the place of rate_profile.
+    replay: bool = False
+    replay_speed: float = 1.0
+    replay_timing: str | None = None
+    # Attempts per second at most (0 = no cap) for stop-and-wait and pipelined sends.
+    max_rate: float = 0.0
+    # routing.Endpoint and routing.Route entries; with endpoints set, host and port are not used.
+    endpoints: tuple = ()
+    routes: tuple = ()
+    # Resends of a failed try with jittered exponential backoff (resilience.RetryPolicy): connection
+    # errors always, AE/AR too with retry_naks. Stop-and-wait and pipelined sends only; open-loop and
+    # replay keep to their schedule.
+    retries: int = 0
+    retry_backoff: float = 0.1
+    retry_max_backoff: float = 5.0
+    retry_naks: bool = False
+    # Consecutive failed tries that open the circuit breaker (0 = none), and how long it stays open.
+    breaker_threshold: int = 0
+    breaker_reset_seconds: float = 30.0
+    # Record a try that ends in an error as an ERROR attempt and carry on instead of stopping the run.
+    continue_on_error: bool = False
+    # Pack this many messages into each FHS/BHS batch file, sent as one frame with one ACK (1 = no
+    # batching). Attempts, repeats and message numbers then count batches.
+    batch_size: int = 1
+
+
+def new_results(num_messages: int | None, options: SendOptions, pool: ConnectionPool | None = None):
+    """
+    Return an empty results dict for a run; batch_end_time stays None until the run finishes.
+    num_messages may be None for lazy sources; run_send fills it in after the first cycle.
+    """
+    return {
+        "ack_records": AckLog(),
+        "histogram": LatencyHistogram(),
+        "cycle_histograms": [],
+        # Per-phase latency of the attempts that carry phase timings (see records.PHASES).
+        "phase_histograms": {phase: LatencyHistogram() for phase in PHASES},
+        # Latency of resends, kept out of "histogram" and "cycle_histograms", which cover first tries.
+        "retry_histogram": LatencyHistogram(),
+        "batch_start_time": time.perf_counter(),
+        "batch_end_time": None,
+        "num_cycles": options.num_cycles,
+        "num_messages": num_messages,
+        "repeat_count": options.repeat_count,
+        "error_message": None,
+        "cancelled": False,
+        "connects_before": pool.connects if pool is not None else 0,
+        "connects": 0 if options.use_pool else None,
+        "rate_reports": [],
+        "endpoints": {},
+        "breaker_trips": 0,
+    }
+
+
+def record_attempt(results, record):
+    """
+    Store an AckRecord and fold its duration (and phases) into the run and current-cycle histograms,
+    or into the retry histogram for a resend. Tries that got no ACK are stored but not timed.
+    """
+    results["ack_records"].append(record)
+    while len(results["cycle_histograms"]) < record.cycle:
+        results["cycle_histograms"].append(LatencyHistogram())
+    if not record.retry and record.status != ERROR_STATUS:
+        results["histogram"].record(record.duration)
+        results["cycle_histograms"][record.cycle - 1].record(record.duration)
+    record_retry(results, record)
+    record_phases(results, record)
+
+
+def record_retry(results, record):
+    """Fold a resend's duration, if it got an ACK, into the retry histogram."""
+    if record.retry and record.status != ERROR_STATUS:
+        results["retry_histogram"].record(record.duration)
+
+
+def record_phases(results, record):
+    """Fold an AckRecord's phase timings, if it has any, into the per-phase histograms."""
+    if record.phases is not None:
+        for histogram, seconds in zip(results["phase_histograms"].values(), record.phases):
+            histogram.record(seconds)
+
+
+class PreparedMessages(list):
+    """
+    A list of message texts that also holds them encoded as framing.PreparedMessage, so runs that
+    send it in this process skip encoding, and batch runs pack their batches from the encoded
+    messages (see cache.MessageCache). Everything else, including templated runs and the shards
+    handed to workers, agents and endpoints, sees a plain list.
+    """
+
+    def __init__(self, texts):
+        super().__init__(texts)
+        self.prepared = [PreparedMessage(m) for m in self]
+        # Rough memory held: each encoded body about four times over (text, body, and the MSH-10 pieces).
+        self.nbytes = 4 * sum(len(message.body) for message in self.prepared)
+
+
+def prepare_messages(messages, templated=False, batch_size=1):
+    """
+    Encode messages once per run, or compile them as templates.MessageTemplate so every send renders
+    a fresh variant, or pack them batch_size at a time into framing.BatchMessage batch files. A list
+    is prepared up front; a lazy source stays lazy and each message is prepared as it streams past,
+    once per cycle (templates.TemplateSource carries template counters over, so with either they run
+    across repeats and cycles). PreparedMessages are used as they are, or packed into batches.
+    """
+    if isinstance(messages, PreparedMessages) and not templated:
+        if batch_size <= 1:
+            return messages.prepared
+        messages = messages.prepared
+    if batch_size > 1:
+        def batches():
+            return (BatchMessage(group, str(number))
+                    for number, group in enumerate(itertools.batched(messages, batch_size), start=1))
+        return list(batches()) if isinstance(messages, list) else MessageSource(batches)
+    prepare = MessageTemplate if templated else PreparedMessage
+    if isinstance(messages, list):
+        return [prepare(m) for m in messages]
+    if templated:
+        return TemplateSource(messages)
+    return MessageSource(lambda: map(prepare, messages))
+
+
+def _message_count(message):
+    """HL7 messages one prepared message puts on the wire: a batch's size, otherwise 1."""
+    return message.count if isinstance(message, BatchMessage) else 1
+
+
+class _Pacer:
+    """Spaces attempts to at most rate per second (0 = no cap); sleep is the run's, so a stop cuts a wait short."""
+
+    def __init__(self, rate: float, sleep):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self.sleep = sleep
+        self.next_at = None
+
+    def wait(self, count=1):
+        """Wait for the next slot, then book count attempts' worth of time."""
+        if not self.interval:
+            return
+        now = time.perf_counter()
+        if self.next_at is None or self.next_at < now:
+            # No catching up in a burst after a slow stretch.
+            self.next_at = now
+        elif self.next_at > now:
+            self.sleep(self.next_at - now)
+        self.next_at += count * self.interval
+
+
+class _Resilience:
+    """A run's retry policy and circuit breaker, deciding what happens after each try."""
+
+    def __init__(self, options: SendOptions, results, sleep, should_stop, on_status):
+        self.policy = RetryPolicy(options.retries, options.retry_backoff, options.retry_max_backoff,
+                                  options.retry_naks)
+        self.breaker = CircuitBreaker(options.breaker_threshold, options.breaker_reset_seconds)
+        self.continue_on_error = options.continue_on_error
+        self.target = f"{options.host}:{options.port}"
+        self.results = results
+        self.sleep = sleep
+        self.should_stop = should_stop
+        self.on_status = on_status
+
+    def wait_for_breaker(self):
+        """While the breaker is open, hold off until it lets a probe through; False if stopped meanwhile."""
+        while (remaining := self.breaker.remaining()) > 0:
+            if self.should_stop():
+                return False
+            self.on_status(f"Circuit open for {self.target} after {self.breaker.failures} failed tries "
+                           f"\u2014 probing again in {remaining:.0f}s")
+            self.sleep(min(1.0, remaining))
+        return True
+
+    def backoff(self, retry: int):
+        self.sleep(self.policy.delay(retry))
+
+    def settle(self, on_record, cycle, msg_idx, attempt, retry, ack, message_id, duration, bytes_sent=None,
+               connection_id=None, phases=None, messages=1, info=None):
+        """
+        Record one try. Returns True to resend it, False when the attempt is done, and None when an
+        error stops the run (recorded in results["error_message"], as before retries existed).
+        """
+        results = self.results
+        if ack.startswith("Error:"):
+            self.breaker.failure()
+            results["breaker_trips"] = self.breaker.trips
+            resend = retry < self.policy.retries
+            if not resend and not self.continue_on_error:
+                after = f" (after {retry} retries)" if retry else ""
+                _fail(results, f"Cycle {cycle}, Message {msg_idx}, Attempt {attempt}: {ack}{after}")
+                return None
+            _emit(results, on_record, cycle, msg_idx, attempt, ack, message_id, duration, bytes_sent,
+                  connection_id, status=ERROR_STATUS, retry=retry, messages=messages)
+            return resend
+        self.breaker.success()
+        record = _emit(results, on_record, cycle, msg_idx, attempt, ack, message_id, duration, bytes_sent,
+                       connection_id, phases, retry=retry, messages=messages, info=info)
+        return retry < self.policy.retries and self.policy.retries_status(record.status)
+
+
+def _stamp(message: PreparedMessage | MessageTemplate, options: SendOptions):
+    message_id = uuid.uuid4().hex if options.generate_message_id else None
+    return message_id, message.buffers(message_id)
+
+
+def _run_open_loop_cycle(messages, options: SendOptions, cycle: int, results, on_record, should_stop):
+    # The open-loop generator and replay pick messages by index, so they need them in memory.
+    messages = list(messages)
+    results["num_messages"] = len(messages)
+    # Send times are perf_counter readings; records carry the wall-clock time each message went out.
+    wall_offset = time.time() - time.perf_counter()
+
+    def record_send(record):
+        # Records arrive as ACKs come in; once one has stopped the run, the stragglers are not recorded.
+        if results["error_message"]:
+            return
+        status = None
+        if record["ack"] is None or record["ack"].startswith("Error:"):
+            if not options.continue_on_error:
+                _fail(results, f"Cycle {cycle}, Message {record['message_idx']}, "
+                               f"Attempt {record['attempt']}: {record['ack'] or 'Error: no ACK'}")
+                return
+            status = ERROR_STATUS
+        _emit(results, on_record, cycle, record["message_idx"], record["attempt"], record["ack"] or "Error: no ACK",
+              record["message_id"], record["latency"] or 0.0, record["bytes"], record["connection"], status=status,
+              messages=_message_count(messages[record["message_idx"] - 1]),
+              timestamp=record["sent"] + wall_offset, info=record["info"])
+
+    def stop():
+        return bool(results["error_message"]) or should_stop()
+
+    try:
+        if options.replay:
+            schedule = replay_schedule([m.text for m in messages], options.replay_timing, options.replay_speed)
+            report = run_replay_sync(
+                messages, options.host, options.port, schedule, connections=options.connections,
+                timeout=options.timeout, generate_message_id=options.generate_message_id, should_stop=stop,
+                on_record=record_send)
+        else:
+            report = run_open_loop_sync(
+                messages, options.host, options.port, options.rate_profile, options.load_seconds,
+                connections=options.connections, timeout=options.timeout,
+                generate_message_id=options.generate_message_id, should_stop=stop, on_record=record_send)
+    except Exception as e:
+        _fail(results, f"Cycle {cycle}: Error: {e}")
+        return
+    results["rate_reports"].append(report)
+    results["cancelled"] = report["cancelled"] and not results["error_message"]
+
+
+def _run_pipelined_cycle(messages, options: SendOptions, cycle: int, results, pool, resolver, pacer, resilience,
+                         on_record, should_stop):
+    if options.connections <= 1:
+        return _send_pipelined_batches(messages, options, cycle, results, pool, resolver, pacer, resilience,
+                                       on_record, should_stop)
+    # One set of parallel connections carries the whole cycle, across batches, pacing and resends.
+    engine = Engine(options.host, options.port, connections=options.connections, window=options.window,
+                    timeout=options.timeout)
+    try:
+        return _send_pipelined_batches(messages, options, cycle, results, pool, resolver, pacer, resilience,
+                                       on_record, should_stop, engine)
+    finally:
+        engine.close()
+        results["connects"] = (results["connects"] or 0) + engine.connects
+
+
+def _send_pipelined_batches(messages, options: SendOptions, cycle: int, results, pool, resolver, pacer, resilience,
+                            on_record, should_stop, engine=None):
+    sent = 0
+    # A rate cap is kept per batch, so batches shrink to about a tenth of a second's worth.
+    batch_size = min(PIPELINE_BATCH, max(1, int(options.max_rate / 10))) if options.max_rate else PIPELINE_BATCH
+    for chunk in itertools.batched(enumerate(messages, start=1), batch_size):
+        pacer.wait(len(chunk) * options.repeat_count)
+        if should_stop():
+            results["cancelled"] = True
+            return sent
+        pending = []
+        for msg_idx, message in chunk:
+            for attempt in range(1, options.repeat_count + 1):
+                pending.append((msg_idx, attempt, *_stamp(message, options), _message_count(message)))
+        # Failed tries are resent as a batch of their own after a backoff, keeping their MSH-10.
+        retry = 0
+        while pending:
+            if not resilience.wait_for_breaker():
+                results["cancelled"] = True
+                return sent
+            batch = [(a[2], a[3]) for a in pending]
+            # Only frames that went out count toward bytes sent; a failed connect writes nothing.
+            written = [False] * len(batch)
+            # ACKs are parsed once, while being matched to their frames, and the parse is reused for the records.
+            infos = [None] * len(batch)
+            if engine is not None:
+                outcomes = engine.send(batch, written, infos)
+            else:
+                outcomes = send_pipelined(batch, options.host, options.port, window=options.window,
+                                          timeout=options.timeout, pool=pool, resolver=resolver, written=written,
+                                          infos=infos)
+            # The engine deals attempts round-robin, so position picks the connection; one connection
+            # is whichever the pool has open.
+            single_connection = _connection_number(results, pool)
+            resends = []
+            for position, (stamped, (ack, duration)) in enumerate(zip(pending, outcomes)):
+                msg_idx, attempt, message_id, buffers, count = stamped
+                connection_id = position % options.connections + 1 if options.connections > 1 else single_connection
+                resend = resilience.settle(on_record, cycle, msg_idx, attempt, retry, ack, message_id, duration,
+                                           sum(map(len, buffers)) if written[position] else None, connection_id,
+                                           messages=count, info=infos[position])
+                if resend is None:
+                    return sent
+                if resend:
+                    resends.append(stamped)
+            pending = resends
+            if pending:
+                retry += 1
+                resilience.backoff(retry)
+                pacer.wait(len(pending))
+                if should_stop():
+                    results["cancelled"] = True
+                    return sent
+        sent += len(chunk)
+    return sent
+
+
+def _run_stop_and_wait_cycle(messages, options: SendOptions, cycle: int, results, pool, resolver, pacer,
+                             resilience, on_record, should_stop):
+    msg_idx = 0
+    for msg_idx, message in enumerate(messages, start=1):
+        for attempt in range(1, options.repeat_count + 1):
+            retry = 0
+            while True:
+                pacer.wait()
+                if should_stop() or not resilience.wait_for_breaker():
+                    results["cancelled"] = True
+                    return msg_idx - 1
+                if not retry:
+                    # A resend goes out with the MSH-10 (and rendered template) of the try it repeats.
+                    message_id, message_to_send = _stamp(message, options)
+                timing = None
+                # Timed from here, so stamping a fresh MSH-10 is not counted as send latency.
+                attempt_start = time.perf_counter()
+                if options.simulate_ack:
+                    # Built from the rendered frame, so templated sends are answered for the variant sent.
+                    ack = build_fake_ack(b"".join(message_to_send[1:-1]).decode(), message_id)
+                else:
+                    timing = AttemptTiming()
+                    ack = send_hl7_message(message_to_send, options.host, options.port,
+                                           timeout=options.timeout, pool=pool, resolver=resolver, timing=timing)
+                duration = time.perf_counter() - attempt_start
+                connection_id = None if options.simulate_ack else _connection_number(results, pool)
+                # A simulated ACK puts nothing on the wire, and a failed connect writes nothing.
+                bytes_sent = sum(map(len, message_to_send)) if timing is not None and timing.written else None
+                resend = resilience.settle(on_record, cycle, msg_idx, attempt, retry, ack, message_id, duration,
+                                           bytes_sent, connection_id, timing.astuple() if timing else None,
+                                           _message_count(message))
+                if resend is None:
+                    return msg_idx - 1
+                if not resend:
+                    break
+                retry += 1
+                resilience.backoff(retry)
+    return msg_idx
+
+
+def _connection_number(results, pool):
+    """Which pooled connection of this run carried the last attempt (1 = first opened); None unpooled."""
+    return pool.connects - results["connects_before"] if pool is not None else None
+
+
+def _fail(results, error_message: str):
+    results["error_message"] = error_message
+    telemetry = metrics.active()
+    if telemetry is not None:
+        telemetry.error()
+
+
+def _emit(results, on_record, cycle, msg_idx, attempt, ack, message_id, duration, bytes_sent=None,
+          connection_id=None, phases=None, status=None, retry=0, messages=1, timestamp=None, info=None):
+    # A try without an ACK carries its error text as the ACK body and as the MSA-3-style text.
+    text = ack if status == ERROR_STATUS else None
+    timestamp = time.time() if timestamp is None else timestamp
+    record = AckRecord(cycle, msg_idx, attempt, message_id, ack, duration, status=status, timestamp=timestamp,
+                       bytes_sent=bytes_sent, connection_id=connection_id, text=text, phases=phases, retry=retry,
+                       messages=messages, info=info)
+    record_attempt(results, record)
+    telemetry = metrics.active()
+    if telemetry is not None:
+        telemetry.observe(record)
+    if on_record:
+        on_record(record)
+    return record
+
+
+def run_send(messages, options: SendOptions, results, pool: ConnectionPool | None = None,
+             on_record=None, on_status=None, on_cycle=None, should_stop=None, sleep=time.sleep):
+    """
+    Run every cycle of a send job, filling results in place.
+    on_record(record) fires per ACKed attempt, on_status(text) with progress text, on_cycle(cycle, results)
+    after each cycle, and should_stop() is polled between attempts (between batches when pipelined) and
+    while waiting for the next cycle. sleep(seconds) paces that wait; pass an Event's wait to make a
+    cancellation cut the wait short.
+    Stops at the first error, recording it in results["error_message"], unless options retry it
+    (resilience.RetryPolicy) or continue past it (options.continue_on_error).
+    messages may be a list or any re-iterable lazy source such as hl7.MessageSource; every cycle
+    iterates it afresh. With options.endpoints messages are routed to several endpoints
+    (routing.run_routed); with options.processes > 1 the run is sharded across worker processes
+    (workers.run_multiprocess), and with options.agents across remote agents (agent.run_distributed);
+    pool and on_cycle then do not apply.
+    """
+    if options.replay and (options.agents or options.processes > 1 or options.endpoints):
+        # The schedule spans the whole capture; dealing it out to shards would skew it.
+        results["error_message"] = ("Error: replay runs in a single process, without worker processes, agents "
+                                    "or routing")
+        results["batch_end_time"] = time.perf_counter()
+        return results
+    if options.batch_size > 1 and (options.templated or options.replay):
+        results["error_message"] = "Error: batch mode packs messages as given; it does not take templates or replay"
+        results["batch_end_time"] = time.perf_counter()
+        return results
+    # routing, workers and agent import this module to run each share, so they are imported here, not at the top.
+    if options.endpoints:
+        from routing import run_routed
+        return run_routed(messages, options, results, on_record=on_record, on_status=on_status,
+                          should_stop=should_stop)
+    if options.agents:
+        from agent import run_distributed
+        return run_distributed(messages, options, results, on_record=on_record, on_status=on_status,
+                               should_stop=should_stop)
+    if options.processes > 1:
+        from workers import run_multiprocess
+        return run_multiprocess(messages, options, results, on_record=on_record, on_status=on_status,
+                                should_stop=should_stop)
+    on_status = on_status or (lambda text: None)
+    should_stop = should_stop or (lambda: False)
+    pool = pool if options.use_pool else None
+    # Addresses are looked up once per run, not per connection.
+    resolver = pool.resolver if pool is not None else Resolver()
+    pacer = _Pacer(options.max_rate, sleep)
+    resilience = _Resilience(options, results, sleep, should_stop, on_status)
+    messages = prepare_messages(messages, options.templated, options.batch_size)
+    scheduled = options.num_cycles > 1
+    open_loop = (options.rate_profile is not None or options.replay) and not options.simulate_ack
+    pipelined = (options.window > 1 or options.connections > 1) and not options.simulate_ack
+
+    for cycle in range(1, options.num_cycles + 1):
+        count = results["num_messages"] if results["num_messages"] is not None else "streamed"
+        if scheduled:
+            on_status(f"Cycle {cycle}/{options.num_cycles} — "
+                      f"sending {count} message(s) x {options.repeat_count} repeat(s)...")
+        else:
+            on_status(f"Sending {count} message(s) x {options.repeat_count} repeat(s)...")
+
+        if open_loop:
+            _run_open_loop_cycle(messages, options, cycle, results, on_record, should_stop)
+        elif pipelined:
+            sent = _run_pipelined_cycle(messages, options, cycle, results, pool, resolver, pacer, resilience,
+                                        on_record, should_stop)
+        else:
+            sent = _run_stop_and_wait_cycle(messages, options, cycle, results, pool, resolver, pacer, resilience,
+                                            on_record, should_stop)
+        if results["error_message"] or results["cancelled"]:
+            break
+        if not open_loop:
+            results["num_messages"] = sent
+
+        if on_cycle:
+            on_cycle(cycle, results)
+
+        # Wait for next cycle if not the last one
+        if scheduled and cycle < options.num_cycles:
+            wait_end = time.perf_counter() + options.interval_seconds
+            while (remaining := wait_end - time.perf_counter()) > 0:
+                if should_stop():
+                    results["cancelled"] = True
+                    break
+                mins, secs = divmod(int(remaining), 60)
+                on_status(f"Cycle {cycle}/{options.num_cycles} complete — next send in {mins}:{secs:02d}")
+                sleep(min(1.0, remaining))
+            if results["cancelled"]:
+                break
+
+    results["batch_end_time"] = time.perf_counter()
+    if pool is not None:
+        results["connects"] = (results["connects"] or 0) + pool.connects - results["connects_before"]
+    return results
@@ -1,9 +1,28 @@
-import socket
+"""
+Headless HL7 MLLP sender.
+
+Sends HL7 files (or the built-in sample message) using the same send engine as the Streamlit UI
+and streams one result per attempt as JSONL or CSV. Deliberately avoids importing streamlit or
+pandas so short runs start quickly from CI and cron.
+"""
+import argparse
+import csv
 import json
+import math
 import os
+import sys
+import time
 
-MLLP_START_BLOCK = b'\x0b'
-MLLP_END_BLOCK = b'\x1c\r'
+from agent import parse_agent
+from hl7 import MessageSource, iter_hl7_messages, split_hl7_messages
+from loadgen import PROFILES, default_profile
+import metrics
+from mllp import ConnectionPool
+from records import ERROR_STATUS
+from resultlog import ResultLog
+from routing import Router, routing_from_config
+from runner import SendOptions, new_results, run_send
+from templates import check_templates
 
 # Load HOST and PORT from config.json if available
 CONFIG_PATH = os.path.join(os.path.dirname(__file__), 'config.json')
@@ -22,22 +41,303 @@ hl7_message = (
     "PID|1||123456^^^MRN||DOE^JOHN||19800101|M|||123 Main St^^Pittsburgh^PA^15213\r"
 )
 
-# Wrap with MLLP framing
-mllp_message = MLLP_START_BLOCK + hl7_message.encode() + MLLP_END_BLOCK
-
-with socket.create_connection((HOST, PORT), timeout=10) as sock:
-    sock.sendall(mllp_message)
-    print(f"HL7 message sent to {HOST}:{PORT}.")
-
-    ack_data = b''
-    while True:
-        chunk = sock.recv(1024)
-        if not chunk:
-            break
-        ack_data += chunk
-        if MLLP_END_BLOCK in chunk:
-            break
-
-# Strip MLLP envelope
-ack = ack_data.strip(MLLP_START_BLOCK + MLLP_END_BLOCK).decode()
-print("\nReceived ACK:\n" + ack)
+HL7_SUFFIXES = (".hl7", ".txt")
+RESULT_FIELDS = ["cycle", "message_idx", "attempt", "retry", "message_id", "status", "error_code", "duration_ms"]
+
+EXIT_OK = 0
+EXIT_NAK_THRESHOLD = 1
+EXIT_SEND_ERROR = 2
+
+
+def iter_input_files(paths):
+    """Expand files and directories (recursively, .hl7/.txt only) into a sorted file list."""
+    for path in paths:
+        if path == "-" or not os.path.isdir(path):
+            yield path
+            continue
+        for root, _, names in sorted(os.walk(path)):
+            for name in sorted(names):
+                if name.lower().endswith(HL7_SUFFIXES):
+                    yield os.path.join(root, name)
+
+
+def load_messages(paths):
+    """
+    Return the messages to send: a lazy, re-iterable MessageSource over the input files, a list when
+    reading stdin (which can only be read once), or the built-in sample when no paths are given.
+    """
+    if not paths:
+        return split_hl7_messages(hl7_message)
+    if "-" in paths:
+        messages = []
+        for path in iter_input_files(paths):
+            if path == "-":
+                messages.extend(split_hl7_messages(sys.stdin.read()))
+            else:
+                with open(path, "rb") as f:
+                    messages.extend(iter_hl7_messages(f))
+        return messages
+    return MessageSource.from_paths(iter_input_files(paths))
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="hl7-sender", description=__doc__.strip().splitlines()[0])
+    parser.add_argument("paths", nargs="*", help="HL7 files or directories ('-' for stdin). "
+                                                 "Defaults to a built-in sample message.")
+    parser.add_argument("--host", default=HOST, help=f"Target host (default: {HOST}).")
+    parser.add_argument("--port", type=int, default=PORT, help=f"Target port (default: {PORT}).")
+    parser.add_argument("--repeat", type=int, default=1, help="Sends per message per cycle.")
+    parser.add_argument("-c", "--connections", type=int, default=1, help="Parallel MLLP connections.")
+    parser.add_argument("-p", "--processes", type=int, default=1,
+                        help="Worker processes to shard messages across; each opens its own connections.")
+    parser.add_argument("--agent", action="append", default=[], metavar="HOST:PORT",
+                        help="Send through this hl7-agent instead of locally (repeat for several agents).")
+    parser.add_argument("--routes", metavar="CONFIG",
+                        help="JSON file with ENDPOINTS and ROUTES (e.g. config.json): route each message to its "
+                             "endpoint by MSH-9 or MSH-5/6 instead of --host/--port.")
+    parser.add_argument("--max-rate", type=float, default=0.0,
+                        help="Cap attempts per second (per endpoint with --routes, where an endpoint's own "
+                             "max_rate wins).")
+    parser.add_argument("-w", "--window", type=int, default=1, help="In-flight messages per connection.")
+    parser.add_argument("--batch-size", type=int, default=1, metavar="N",
+                        help="Pack N messages into each FHS/BHS batch file, sent as one MLLP frame with one ACK; "
+                             "attempts and --repeat then count batches.")
+    parser.add_argument("--rate", type=float, help="Open-loop target rate in msg/s (requires --duration).")
+    parser.add_argument("--profile", choices=list(PROFILES), default="constant",
+                        help="Rate profile shape for --rate.")
+    parser.add_argument("--duration", type=float, default=0.0,
+                        help="Seconds: open-loop run length with --rate, otherwise total scheduled time "
+                             "together with --interval.")
+    parser.add_argument("--interval", type=float, default=0.0, help="Seconds between scheduled cycles.")
+    parser.add_argument("--replay", action="store_true",
+                        help="Replay messages at their captured arrival times (MSH-7, or --timing) instead of "
+                             "as fast as possible; each message is sent once per cycle.")
+    parser.add_argument("--speed", type=float, default=1.0, help="Replay speed-up factor (e.g. 10 or 100).")
+    parser.add_argument("--timing", metavar="FILE",
+                        help="Sidecar timing file for --replay: one time per message, in seconds or ISO 8601.")
+    parser.add_argument("--timeout", type=float, default=10, help="Socket timeout in seconds.")
+    parser.add_argument("--retries", type=int, default=0,
+                        help="Resend a try that fails with a connection error or timeout up to this many times, "
+                             "with jittered exponential backoff.")
+    parser.add_argument("--retry-backoff", type=float, default=0.1, metavar="SECONDS",
+                        help="Backoff before the first resend; it doubles per resend up to --retry-max-backoff.")
+    parser.add_argument("--retry-max-backoff", type=float, default=5.0, metavar="SECONDS",
+                        help="Longest backoff between resends.")
+    parser.add_argument("--retry-naks", action="store_true", help="Also resend tries answered AE or AR.")
+    parser.add_argument("--breaker", type=int, default=0, metavar="FAILURES",
+                        help="Open a circuit breaker after this many consecutive failed tries: hold off the "
+                             "endpoint for --breaker-reset seconds, then probe it with one message.")
+    parser.add_argument("--breaker-reset", type=float, default=30.0, metavar="SECONDS",
+                        help="How long an open circuit breaker waits before probing.")
+    parser.add_argument("--continue-on-error", action="store_true",
+                        help="Record a try that ends in an error (after any retries) as status ERROR and carry "
+                             "on, instead of stopping the run; errors count towards --max-nak-rate.")
+    parser.add_argument("--per-message", action="store_true", help="Open a new connection for every attempt.")
+    parser.add_argument("--keep-message-id", action="store_true",
+                        help="Send MSH-10 as-is instead of stamping a unique ID per attempt.")
+    parser.add_argument("--simulate", action="store_true", help="Build fake ACKs without opening sockets.")
+    parser.add_argument("--template", action="store_true",
+                        help="Treat messages as templates: {{seq}}, {{uuid}}, {{now}}, {{random:N}} and "
+                             "{{faker:name}} placeholders are rendered afresh for every send.")
+    parser.add_argument("--format", choices=["jsonl", "csv"], default="jsonl", help="Result stream format.")
+    parser.add_argument("-o", "--output", help="Write results here instead of stdout.")
+    parser.add_argument("--db", help="Also log the run and every attempt to this SQLite results database.")
+    parser.add_argument("--metrics-port", type=int,
+                        help="Serve Prometheus metrics for the send path on this port at /metrics during the run.")
+    parser.add_argument("--otel", action="store_true",
+                        help="Also emit an OpenTelemetry span per ACKed message (needs opentelemetry-api).")
+    parser.add_argument("--max-nak-rate", type=float,
+                        help="Exit 1 when the fraction of non-AA ACKs exceeds this (0-1).")
+    return parser
+
+
+def build_options(args):
+    if args.rate is not None and args.duration <= 0:
+        raise ValueError("--rate requires a positive --duration")
+    if args.duration > 0 and args.rate is None and args.interval <= 0:
+        raise ValueError("--duration requires --rate or a positive --interval")
+    for address in args.agent:
+        parse_agent(address)
+    if args.replay and (args.rate is not None or args.processes > 1 or args.agent):
+        raise ValueError("--replay cannot be combined with --rate, --processes or --agent")
+    if args.timing and not args.replay:
+        raise ValueError("--timing requires --replay")
+    if args.speed <= 0:
+        raise ValueError("--speed must be positive")
+    if args.batch_size < 1:
+        raise ValueError("--batch-size must be at least 1")
+    if args.batch_size > 1 and (args.template or args.replay):
+        raise ValueError("--batch-size cannot be combined with --template or --replay")
+    if args.retries < 0 or args.retry_backoff < 0 or args.retry_max_backoff < 0 or args.breaker < 0:
+        raise ValueError("--retries, --retry-backoff, --retry-max-backoff and --breaker cannot be negative")
+    if args.breaker_reset <= 0:
+        raise ValueError("--breaker-reset must be positive")
+    endpoints, routes = (), ()
+    if args.routes:
+        with open(args.routes, encoding="utf-8") as f:
+            endpoints, routes = routing_from_config(json.load(f))
+        if not endpoints:
+            raise ValueError(f"{args.routes} defines no ENDPOINTS")
+        Router(endpoints, routes)
+    open_loop = args.rate is not None
+    scheduled = not open_loop and args.interval > 0 and args.duration > 0
+    return SendOptions(
+        host=args.host,
+        port=args.port,
+        repeat_count=max(1, args.repeat),
+        num_cycles=math.floor(args.duration / args.interval) + 1 if scheduled else 1,
+        interval_seconds=args.interval,
+        generate_message_id=not args.keep_message_id,
+        simulate_ack=args.simulate,
+        use_pool=not args.per_message,
+        window=max(1, args.window),
+        connections=max(1, args.connections),
+        rate_profile=default_profile(args.profile, args.rate, args.duration) if open_loop else None,
+        load_seconds=args.duration if open_loop else 0.0,
+        timeout=args.timeout,
+        templated=args.template,
+        processes=max(1, args.processes),
+        agents=tuple(args.agent),
+        replay=args.replay,
+        replay_speed=args.speed,
+        replay_timing=args.timing,
+        max_rate=max(0.0, args.max_rate),
+        endpoints=endpoints,
+        routes=routes,
+        retries=args.retries,
+        retry_backoff=args.retry_backoff,
+        retry_max_backoff=args.retry_max_backoff,
+        retry_naks=args.retry_naks,
+        breaker_threshold=args.breaker,
+        breaker_reset_seconds=args.breaker_reset,
+        continue_on_error=args.continue_on_error,
+        batch_size=args.batch_size,
+    )
+
+
+class ResultWriter:
+    """Stream one row per attempt as JSONL or CSV, flushing so tails and pipes see results live."""
+
+    def __init__(self, stream, fmt: str):
+        self.stream = stream
+        self.fmt = fmt
+        self.total = 0
+        self.naks = 0
+        self.retries = 0
+        self.errors = 0
+        self._csv = None
+        if fmt == "csv":
+            self._csv = csv.DictWriter(stream, fieldnames=RESULT_FIELDS)
+            self._csv.writeheader()
+
+    def write(self, record):
+        status = record.status
+        self.total += 1
+        if status != "AA":
+            self.naks += 1
+        if status == ERROR_STATUS:
+            self.errors += 1
+        if record.retry:
+            self.retries += 1
+        row = {"cycle": record.cycle, "message_idx": record.message_idx, "attempt": record.attempt,
+               "retry": record.retry,
+               "message_id": record.message_id, "status": status, "error_code": record.error_code,
+               "duration_ms": round(record.duration * 1000, 3)}
+        if self._csv:
+            self._csv.writerow(row)
+        else:
+            self.stream.write(json.dumps(row) + "\n")
+        self.stream.flush()
+
+    @property
+    def nak_rate(self):
+        return self.naks / self.total if self.total else 0.0
+
+
+def summarize(results, writer: ResultWriter):
+    elapsed = max((results["batch_end_time"] or time.perf_counter()) - results["batch_start_time"], 1e-9)
+    latency = results["histogram"].summary()
+    # Throughput counts the messages of first tries that got an ACK; resends and tries without an ACK
+    # are reported on their own.
+    log = results["ack_records"]
+    lines = [f"attempts={writer.total} naks={writer.naks} nak_rate={writer.nak_rate:.4f} "
+             f"msgs_per_sec={log.messages / elapsed:.2f} bytes_per_sec={log.bytes_sent / elapsed:.0f} "
+             f"bytes_per_msg={log.bytes_sent / log.messages if log.messages else 0:.0f}",
+             "latency_ms " + " ".join(f"{k}={v * 1000:.3f}" for k, v in latency.items() if k != "count")]
+    if writer.retries or writer.errors or results["breaker_trips"]:
+        lines.append(f"retries={writer.retries} errors={writer.errors} breaker_trips={results['breaker_trips']}")
+    if results["retry_histogram"].total:
+        lines.append("retry_latency_ms " + " ".join(f"{k}={v * 1000:.3f}"
+                                                    for k, v in results["retry_histogram"].summary().items()
+                                                    if k != "count"))
+    for phase, histogram in results["phase_histograms"].items():
+        if histogram.total:
+            lines.append(f"{phase}_ms " + " ".join(f"{k}={v * 1000:.3f}" for k, v in histogram.summary().items()
+                                                   if k != "count"))
+    for report in results["rate_reports"]:
+        lines.append(f"target_rate={report['target_rate']:.2f} achieved_rate={report['achieved_rate']:.2f} "
+                     f"p50_send_lag_ms={report['p50_send_lag'] * 1000:.3f} "
+                     f"p99_send_lag_ms={report['p99_send_lag'] * 1000:.3f} "
+                     f"max_send_lag_ms={report['max_send_lag'] * 1000:.3f}")
+    for name, endpoint in results["endpoints"].items():
+        log = endpoint["ack_records"]
+        end = endpoint["batch_end_time"] or time.perf_counter()
+        endpoint_elapsed = max(end - endpoint["batch_start_time"], 1e-9)
+        endpoint_latency = endpoint["histogram"].summary()
+        lines.append(f"endpoint={name} attempts={log.total} naks={log.failures} "
+                     f"msgs_per_sec={log.messages / endpoint_elapsed:.2f} "
+                     f"p50_ms={endpoint_latency['p50'] * 1000:.3f} p99_ms={endpoint_latency['p99'] * 1000:.3f}")
+    if results["error_message"]:
+        lines.append(f"stopped: {results['error_message']}")
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    try:
+        options = build_options(args)
+        messages = load_messages(args.paths)
+        first = next(iter(messages), None)
+        if first is None:
+            parser.error("no HL7 messages found in input")
+        if options.templated:
+            check_templates(messages)
+        metrics_server = metrics.serve(args.metrics_port, spans=args.otel) if args.metrics_port else None
+        if args.otel and metrics_server is None:
+            metrics.enable(spans=True)
+    except (OSError, ValueError) as e:
+        parser.error(str(e))
+
+    pool = ConnectionPool(timeout=args.timeout)
+    out = open(args.output, "w", newline="") if args.output else sys.stdout
+    results = new_results(len(messages) if isinstance(messages, list) else None, options, pool)
+    run_log = ResultLog(args.db).open_run(options, label=" ".join(args.paths) or "sample") if args.db else None
+    try:
+        writer = ResultWriter(out, args.format)
+        sinks = [writer.write] if run_log is None else [writer.write, run_log.add]
+
+        def record_to_sinks(record):
+            for sink in sinks:
+                sink(record)
+
+        run_send(messages, options, results, pool=pool, on_record=record_to_sinks)
+    finally:
+        pool.close()
+        if out is not sys.stdout:
+            out.close()
+        if metrics_server is not None:
+            metrics_server.close()
+        if run_log is not None:
+            run_log.finish(results)
+
+    print(summarize(results, writer), file=sys.stderr)
+    if results["error_message"]:
+        return EXIT_SEND_ERROR
+    if args.max_nak_rate is not None and writer.nak_rate > args.max_nak_rate:
+        return EXIT_NAK_THRESHOLD
+    return EXIT_OK
+
+
+if __name__ == "__main__":
+    sys.exit(main())
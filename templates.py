@@ -0,0 +1,206 @@
+"""
+Pre-compiled HL7 message templates for synthetic load.
+
+A template is parsed once into literal byte runs and slot functions; each render only evaluates the
+slots and returns the MLLP frame as a buffer list ready for scatter-gather send, with no re-parsing
+or re-splitting of the message. Placeholders:
+
+    {{seq}} / {{seq:8}}     per-template counter, optionally zero-padded to a width
+    {{uuid}}                random 32-hex-digit UUID
+    {{now}} / {{now:%Y%m%d}} current local time, HL7 YYYYMMDDHHMMSS unless a strftime format is given
+    {{random:6}}            that many random digits (MRNs, visit numbers)
+    {{faker:name}}          a Faker provider when faker is installed; name/first_name/last_name
+                            fall back to a small built-in list otherwise. name renders as LAST^FIRST
+                            (with the message's own component separator), and Faker values are
+                            escaped with the message's own delimiters.
+"""
+import functools
+import itertools
+import random
+import re
+import time
+import uuid
+from array import array
+
+from framing import _CONTROL_ID_SLOT, MLLP_START_BLOCK, MLLP_END_BLOCK
+from hl7 import with_message_control_id
+from hl7parse import DEFAULT_ENCODING, Encoding, HL7Message
+
+try:
+    from faker import Faker
+except ImportError:
+    Faker = None
+
+PLACEHOLDER = re.compile(r"\{\{\s*(\w+)(?::([^}]*))?\s*\}\}")
+HL7_TIMESTAMP = "%Y%m%d%H%M%S"
+
+_FIRST_NAMES = ["JOHN", "JANE", "MARIA", "JAMES", "LINDA", "ROBERT", "PATRICIA", "DAVID", "SUSAN", "WEI",
+                "AHMED", "PRIYA", "CARLOS", "FATIMA", "OLIVIA", "NOAH"]
+_LAST_NAMES = ["DOE", "SMITH", "JOHNSON", "GARCIA", "NGUYEN", "PATEL", "BROWN", "KIM", "MILLER", "LOPEZ",
+               "WILSON", "CHEN", "KHAN", "MARTIN", "TAYLOR", "OKAFOR"]
+
+
+@functools.lru_cache(maxsize=16)
+def _hl7_escapes(encoding: Encoding):
+    """Translation table escaping an encoding's delimiters in generated text (\\F\\, \\S\\ and so on)."""
+    escape = encoding.escape
+    return str.maketrans({escape: f"{escape}E{escape}", encoding.field: f"{escape}F{escape}",
+                          encoding.component: f"{escape}S{escape}", encoding.subcomponent: f"{escape}T{escape}",
+                          encoding.repetition: f"{escape}R{escape}"})
+
+
+def _faker_slot(provider: str, rng: random.Random, encoding: Encoding):
+    component = encoding.component
+    if Faker is None:
+        builtin = {
+            "name": lambda _: f"{rng.choice(_LAST_NAMES)}{component}{rng.choice(_FIRST_NAMES)}",
+            "first_name": lambda _: rng.choice(_FIRST_NAMES),
+            "last_name": lambda _: rng.choice(_LAST_NAMES),
+        }
+        if provider not in builtin:
+            raise ValueError(f"{{{{faker:{provider}}}}} needs the faker package (pip install faker)")
+        return builtin[provider]
+    fake = Faker()
+    fake.seed_instance(rng.random())
+    escapes = _hl7_escapes(encoding)
+    if provider == "name":
+        return lambda _: (fake.last_name().upper().translate(escapes) + component
+                          + fake.first_name().upper().translate(escapes))
+    method = getattr(fake, provider, None)
+    if not callable(method):
+        raise ValueError(f"Unknown faker provider: {provider}")
+    return lambda _: str(method()).translate(escapes)
+
+
+def _slot(name: str, arg: str | None, rng: random.Random, encoding: Encoding = DEFAULT_ENCODING):
+    """Return a function of the render's sequence number that produces one placeholder's text."""
+    if name == "seq":
+        width = int(arg) if arg else 0
+        return lambda seq: str(seq).zfill(width)
+    if name == "uuid":
+        return lambda _: uuid.uuid4().hex
+    if name == "now":
+        fmt = arg or HL7_TIMESTAMP
+        return lambda _: time.strftime(fmt)
+    if name == "random":
+        digits = int(arg or 6)
+        return lambda _: str(rng.randrange(10 ** digits)).zfill(digits)
+    if name == "faker":
+        if not arg:
+            raise ValueError("{{faker:...}} needs a provider name, e.g. {{faker:name}}")
+        return _faker_slot(arg, rng, encoding)
+    raise ValueError(f"Unknown template placeholder: {{{{{name}}}}}")
+
+
+def _compile(text: str, rng: random.Random, encoding: Encoding = DEFAULT_ENCODING):
+    """Split text into encoded literal runs and slot functions, in order."""
+    parts = []
+    pos = 0
+    for match in PLACEHOLDER.finditer(text):
+        if match.start() > pos:
+            parts.append(text[pos:match.start()].encode())
+        parts.append(_slot(match.group(1), match.group(2), rng, encoding))
+        pos = match.end()
+    if pos < len(text):
+        parts.append(text[pos:].encode())
+    return parts
+
+
+def check_templates(messages):
+    """
+    Check every placeholder of every message before a run starts, so a bad one in a later message
+    does not stop the run partway. Each distinct placeholder is checked once; raises ValueError
+    naming the first message that holds a bad one.
+    """
+    checked = set()
+    rng = random.Random()
+    for number, message in enumerate(messages, start=1):
+        for match in PLACEHOLDER.finditer(message):
+            placeholder = match.group(1, 2)
+            if placeholder in checked:
+                continue
+            try:
+                _slot(*placeholder, rng)
+            except ValueError as e:
+                raise ValueError(f"message {number}: {e}") from None
+            checked.add(placeholder)
+
+
+class _PositionCounter:
+    """A {{seq}} counter kept in slot position of a shared array, so it outlives the template using it."""
+    __slots__ = ("counts", "position")
+
+    def __init__(self, counts, position: int):
+        self.counts = counts
+        self.position = position
+
+    def __next__(self):
+        self.counts[self.position] += 1
+        return self.counts[self.position]
+
+
+class TemplateSource:
+    """
+    Templates for a lazy message source: every pass compiles the messages afresh as they stream past,
+    but each message's {{seq}} counter carries on from the previous pass (at 8 bytes per message),
+    so counters run across repeats and cycles for the whole run, as they do for a list.
+    """
+
+    def __init__(self, messages):
+        self.messages = messages
+        self._counts = array("Q")
+
+    def __iter__(self):
+        for position, message in enumerate(self.messages):
+            if position == len(self._counts):
+                self._counts.append(0)
+            yield MessageTemplate(message, counter=_PositionCounter(self._counts, position))
+
+
+class MessageTemplate:
+    """
+    A message compiled once into literal byte runs and placeholder slots.
+
+    Drop-in for framing.PreparedMessage in the send paths: buffers(message_id) renders a fresh
+    variant (advancing {{seq}}) with MSH-10 set to message_id when given, otherwise to the template's
+    own MSH-10, which may itself hold placeholders. counter, when given, supplies the {{seq}} values
+    in place of the template's own count from 1.
+    """
+
+    def __init__(self, message: str, seed: int | None = None, counter=None):
+        self.text = message
+        self._seq = counter if counter is not None else itertools.count(1)
+        rng = random.Random(seed)
+        encoding = HL7Message(message).encoding
+        # Rendered as-is when no message_id is given and there is no MSH-10 slot to fill.
+        self._whole = None
+        stamped = with_message_control_id(message, _CONTROL_ID_SLOT)
+        if stamped is message:
+            self._whole = _compile(message, rng, encoding)
+            self._head = self._control_id = self._tail = None
+        else:
+            head, tail = stamped.split(_CONTROL_ID_SLOT, 1)
+            # with_message_control_id pads a short MSH to reach MSH-10; keep the original for plain renders.
+            if not (message.startswith(head) and message.endswith(tail)):
+                self._whole = _compile(message, rng, encoding)
+            self._head = _compile(head, rng, encoding)
+            control_id = message[len(head):len(message) - len(tail)] if self._whole is None else ""
+            self._control_id = _compile(control_id, rng, encoding)
+            self._tail = _compile(tail, rng, encoding)
+
+    @staticmethod
+    def _render(parts, seq: int):
+        return [part if type(part) is bytes else part(seq).encode() for part in parts]
+
+    def buffers(self, message_id: str | None = None):
+        """Render the next variant as MLLP frame buffers."""
+        seq = next(self._seq)
+        if self._whole is not None and (message_id is None or self._head is None):
+            return [MLLP_START_BLOCK, *self._render(self._whole, seq), MLLP_END_BLOCK]
+        control_id = [message_id.encode()] if message_id is not None else self._render(self._control_id, seq)
+        return [MLLP_START_BLOCK, *self._render(self._head, seq), *control_id, *self._render(self._tail, seq),
+                MLLP_END_BLOCK]
+
+    def render(self, message_id: str | None = None):
+        """Render the next variant as text."""
+        return b"".join(self.buffers(message_id)[1:-1]).decode()
@@ -0,0 +1,97 @@
+import pytest
+
+from agent import ThreadedAgent, _iter_spool, _spool_message, options_from_json, options_to_json, parse_agent
+from loadgen import constant_profile
+from receiver import ThreadedReceiver
+from runner import SendOptions, new_results, run_send
+from sender import EXIT_OK, main
+from workers import shard_options
+
+MESSAGES = [f"MSH|^~\\&|A|B|C|D|20250101||ADT^A01|{i}|P|2.3\rPID|{i}" for i in range(1, 21)]
+
+
+@pytest.fixture(scope="module")
+def server():
+    with ThreadedReceiver() as receiver:
+        yield receiver
+
+
+@pytest.fixture
+def agents():
+    with ThreadedAgent() as first, ThreadedAgent() as second, ThreadedAgent() as third:
+        yield [first, second, third]
+
+
+class TestProtocol:
+    def test_parse_agent(self):
+        assert parse_agent("loadgen1:2600") == ("loadgen1", 2600)
+        assert parse_agent("loadgen1") == ("loadgen1", 2580)
+        with pytest.raises(ValueError):
+            parse_agent("loadgen1:http")
+
+    def test_options_round_trip_with_rate_share(self):
+        options = SendOptions(host="h", port=1, window=8, agents=("a:1", "b:2"), load_seconds=2,
+                              rate_profile=constant_profile(100))
+        shared = shard_options(options, 2, agents=())
+        restored = options_from_json(options_to_json(shared), shared.rate_profile.rates)
+        assert restored.window == 8
+        assert restored.agents == []
+        assert restored.rate_profile(1.0) == pytest.approx(50)
+
+    def test_spool_keeps_messages_unchanged(self, tmp_path):
+        messages = [MESSAGES[0] + "\r", "BHS|^~\\&|A", "MSH|^~\\&|A\rNTE|1||two\nlines  \rMSH|again", "é", ""]
+        path = tmp_path / "share.spool"
+        with open(path, "wb") as spool:
+            for text in messages:
+                _spool_message(spool, text)
+        assert list(_iter_spool(path)) == messages
+
+
+class TestRunDistributed:
+    def test_agents_share_the_run(self, server, agents):
+        options = SendOptions(host="127.0.0.1", port=server.port, window=4, repeat_count=2, num_cycles=2,
+                              agents=tuple(agent.address for agent in agents))
+        results = new_results(len(MESSAGES), options)
+        seen = []
+        statuses = []
+        run_send(MESSAGES, options, results, on_record=seen.append, on_status=statuses.append)
+        assert results["error_message"] is None
+        assert results["ack_records"].status_counts == {"AA": 80}
+        assert results["histogram"].total == 80
+        assert [h.total for h in results["cycle_histograms"]] == [40, 40]
+        assert results["num_messages"] == 20
+        assert sorted({r.message_idx for r in seen}) == list(range(1, 21))
+        assert {r.connection_id for r in seen} == {1, 2, 3}
+        assert statuses[-1].startswith("3 agents: 80 sent")
+        assert [agent.server.runs for agent in agents] == [1, 1, 1]
+
+    def test_agent_error_stops_run(self, agents):
+        options = SendOptions(host="127.0.0.1", port=1, timeout=1, agents=(agents[0].address,))
+        results = new_results(len(MESSAGES), options)
+        run_send(MESSAGES, options, results)
+        assert results["error_message"].startswith(f"Agent {agents[0].address}: ")
+
+    def test_unreachable_agent(self):
+        options = SendOptions(host="127.0.0.1", port=1, agents=("127.0.0.1:1",))
+        results = new_results(len(MESSAGES), options)
+        run_send(MESSAGES, options, results)
+        assert "could not connect" in results["error_message"]
+        assert results["batch_end_time"] is not None
+
+    def test_should_stop_reaches_agents(self, agents):
+        options = SendOptions(host="unused", port=0, simulate_ack=True, num_cycles=2, interval_seconds=30,
+                              agents=(agents[0].address, agents[1].address))
+        results = new_results(len(MESSAGES), options)
+        run_send(MESSAGES, options, results, should_stop=lambda: results["ack_records"].total >= 20)
+        assert results["cancelled"]
+        assert results["ack_records"].total == 20
+        assert results["batch_end_time"] - results["batch_start_time"] < 15
+
+    def test_cli_coordinates_agents(self, server, agents, tmp_path):
+        path = tmp_path / "in.hl7"
+        path.write_text("\n".join(MESSAGES))
+        out = tmp_path / "out.jsonl"
+        code = main([str(path), "--host", "127.0.0.1", "--port", str(server.port), "-o", str(out),
+                     "--agent", agents[0].address, "--agent", agents[1].address])
+        assert code == EXIT_OK
+        assert len(out.read_text().splitlines()) == 20
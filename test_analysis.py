@@ -0,0 +1,58 @@
+from analysis import ack_frame, nak_rate_over_time, status_counts_by, top_error_codes
+from records import AckLog, AckRecord
+
+AA = "MSA|AA|1"
+AE = "MSA|AE|1\rERR|||207^Application error"
+AR = "MSA|AR|1\rERR|||100^Segment sequence error"
+
+
+def build_log(acks, start=1000.0, step=1.0, max_rows=200_000):
+    log = AckLog(max_rows=max_rows)
+    for i, ack in enumerate(acks):
+        log.append(AckRecord(i // 4 + 1, i % 2 + 1, 1, None, ack, 0.002, timestamp=start + i * step))
+    return log
+
+
+class TestAckFrame:
+    def test_columns_and_categories(self):
+        frame = ack_frame(build_log([AA, AE, AA, AR]))
+        assert list(frame["status"]) == ["AA", "AE", "AA", "AR"]
+        assert list(frame["error_code"].astype(object).where(frame["error_code"].notna(), None)) == \
+            [None, "207", None, "100"]
+        assert list(frame["message_idx"]) == [1, 2, 1, 2]
+        assert frame["duration_ms"].iloc[0] == 2.0
+        assert frame["first_byte_ms"].isna().all()
+
+    def test_empty_log(self):
+        frame = ack_frame(AckLog())
+        assert frame.empty
+        assert nak_rate_over_time(frame).empty
+        assert top_error_codes(frame).empty
+
+
+class TestAggregations:
+    def test_counts_by_cycle_and_message(self):
+        frame = ack_frame(build_log([AA, AE, AA, AA, AR, AA, AA, AA]))
+        by_cycle = status_counts_by(frame, "cycle")
+        assert by_cycle.loc[1, "AA"] == 3 and by_cycle.loc[1, "AE"] == 1
+        assert by_cycle.loc[2, "AR"] == 1
+        assert by_cycle.loc[1, "NAK rate"] == 0.25
+        by_message = status_counts_by(frame, "message_idx")
+        assert by_message.loc[2, "AE"] == 1 and by_message.loc[1, "AR"] == 1
+
+    def test_top_error_codes(self):
+        frame = ack_frame(build_log([AE, AE, AR, AA]))
+        top = top_error_codes(frame, n=1)
+        assert top.to_dict("records") == [{"error_code": "207", "attempts": 2}]
+
+    def test_nak_rate_over_time(self):
+        frame = ack_frame(build_log([AA, AE, AE, AE, AA, AA], step=10.0))
+        rate = nak_rate_over_time(frame, buckets=3)
+        assert list(rate.index) == [0.0, 17.0, 34.0]
+        assert list(rate) == [0.5, 1.0, 0.0]
+
+    def test_window_after_drop(self):
+        log = build_log([AA] * 30 + [AE] * 10, max_rows=10)
+        frame = ack_frame(log)
+        assert len(frame) == len(log)
+        assert frame["status"].iloc[-1] == "AE"
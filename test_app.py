@@ -11,6 +11,9 @@ from app import (
     MLLP_END_BLOCK,
     load_config,
     save_config,
+    load_routing,
+    save_routing,
+    routing_from_rows,
     send_hl7_message,
     parse_ack_status,
     split_hl7_messages,
@@ -170,49 +173,73 @@ class TestBuildFakeAck:
         msa_line = [s for s in ack.split("\r") if s.startswith("MSA")][0]
         assert "12345" in msa_line
 
+    def test_batch_acked_by_batch_control_id(self):
+        batch = f"FHS|^~\\&|A|B|C|D|20250101||||F1\rBHS|^~\\&|A|B|C|D|20250101||||B7\r{SAMPLE_MESSAGE}\rBTS|1\rFTS|1"
+        msa_line = [s for s in build_fake_ack(batch, None).split("\r") if s.startswith("MSA")][0]
+        assert msa_line == "MSA|AA|B7"
+
 
 # ============================================================
 # send_hl7_message (mocked socket)
 # ============================================================
 
+def _mock_socket(*chunks):
+    """MagicMock socket whose recv_into replays chunks and whose sendmsg records each frame sent."""
+    sock = MagicMock()
+    sock.sent = []
+    pending = list(chunks)
+
+    def recv_into(view):
+        if not pending:
+            return 0
+        chunk = pending.pop(0)
+        view[:len(chunk)] = chunk
+        return len(chunk)
+
+    def sendmsg(buffers):
+        sock.sent.append(b"".join(bytes(b) for b in buffers))
+        return len(sock.sent[-1])
+
+    sock.recv_into.side_effect = recv_into
+    sock.sendmsg.side_effect = sendmsg
+    return sock
+
+
 class TestSendHl7Message:
     def test_successful_send_and_receive(self):
         ack_bytes = MLLP_START_BLOCK + SAMPLE_ACK.encode() + MLLP_END_BLOCK
-        mock_sock = MagicMock()
-        mock_sock.recv.side_effect = [ack_bytes, b'']
+        mock_sock = _mock_socket(ack_bytes, b'')
 
-        with patch("app.socket.create_connection") as mock_conn:
+        with patch("mllp.socket.create_connection") as mock_conn:
             mock_conn.return_value.__enter__ = MagicMock(return_value=mock_sock)
             mock_conn.return_value.__exit__ = MagicMock(return_value=False)
             result = send_hl7_message("MSH|test", "localhost", 2575)
 
         assert "MSA|AA" in result
-        mock_sock.sendall.assert_called_once()
-        sent = mock_sock.sendall.call_args[0][0]
+        assert len(mock_sock.sent) == 1
+        sent = mock_sock.sent[0]
         assert sent.startswith(MLLP_START_BLOCK)
         assert sent.endswith(MLLP_END_BLOCK)
 
     def test_connection_error_returns_error_string(self):
-        with patch("app.socket.create_connection", side_effect=ConnectionRefusedError("refused")):
+        with patch("mllp.socket.create_connection", side_effect=ConnectionRefusedError("refused")):
             result = send_hl7_message("MSH|test", "localhost", 9999)
         assert result.startswith("Error:")
 
     def test_timeout_returns_error_string(self):
-        with patch("app.socket.create_connection", side_effect=socket.timeout("timed out")):
+        with patch("mllp.socket.create_connection", side_effect=socket.timeout("timed out")):
             result = send_hl7_message("MSH|test", "localhost", 2575, timeout=1)
         assert result.startswith("Error:")
 
     def test_mllp_framing(self):
-        mock_sock = MagicMock()
-        mock_sock.recv.side_effect = [MLLP_START_BLOCK + b"ACK" + MLLP_END_BLOCK]
+        mock_sock = _mock_socket(MLLP_START_BLOCK + b"ACK" + MLLP_END_BLOCK)
 
-        with patch("app.socket.create_connection") as mock_conn:
+        with patch("mllp.socket.create_connection") as mock_conn:
             mock_conn.return_value.__enter__ = MagicMock(return_value=mock_sock)
             mock_conn.return_value.__exit__ = MagicMock(return_value=False)
             send_hl7_message("HELLO", "localhost", 2575)
 
-        sent = mock_sock.sendall.call_args[0][0]
-        assert sent == b'\x0bHELLO\x1c\r'
+        assert mock_sock.sent == [b'\x0bHELLO\x1c\r']
 
 
 # ============================================================
@@ -243,3 +270,23 @@ class TestConfig:
             host, port = load_config()
         assert host == "second"
         assert port == 2222
+
+    def test_routing_saved_alongside_host(self, tmp_path):
+        from routing import Endpoint, Route
+        config_file = tmp_path / "config.json"
+        endpoints = (Endpoint("adt", "adt-host", 2575),)
+        routes = (Route("adt", message_type="ADT"),)
+        with patch("app.CONFIG_PATH", str(config_file)):
+            save_config("myhost", 1234)
+            save_routing(endpoints, routes)
+            save_config("otherhost", 4321)
+            assert load_config() == ("otherhost", 4321)
+            assert load_routing() == (endpoints, routes)
+
+    def test_routing_from_rows_skips_blanks(self):
+        endpoints, routes = routing_from_rows(
+            [{"name": "adt", "host": "h", "port": 1, "max_rate": float("nan")},
+             {"name": None, "host": "", "port": None}],
+            [{"endpoint": "adt", "message_type": "ADT", "receiving_facility": None}, {"endpoint": ""}])
+        assert [(e.name, e.max_rate) for e in endpoints] == [("adt", 0.0)]
+        assert [(r.message_type, r.receiving_facility) for r in routes] == [("ADT", "")]
@@ -0,0 +1,45 @@
+import json
+import os
+
+import pytest
+
+from bench import SCENARIOS, build_message, compare, main, run_isolated, run_scenario
+from hl7 import split_hl7_messages
+from receiver import ThreadedReceiver
+
+
+@pytest.fixture(scope="module")
+def server():
+    with ThreadedReceiver() as receiver:
+        yield receiver
+
+
+def _die_without_reporting(queue, *args):
+    os._exit(3)
+
+
+class TestBench:
+    def test_large_message_size(self):
+        message = build_message(1_000_000)
+        assert len(message) > 1_000_000
+        assert len(split_hl7_messages(message)) == 1
+
+    @pytest.mark.parametrize("scenario", list(SCENARIOS))
+    def test_scenarios_run_clean(self, scenario, server):
+        row = run_scenario(scenario, "tiny", server.port, scale=0.005)
+        assert row["errors"] is None
+        assert row["messages"] == 25
+        assert row["msgs_per_sec"] > 0
+        assert row["p99_ms"] >= row["p50_ms"]
+
+    def test_main_writes_comparable_report(self, tmp_path):
+        out = tmp_path / "bench.json"
+        assert main(["--scenario", "pooled", "--size", "tiny", "--scale", "0.002", "-o", str(out)]) == 0
+        report = json.loads(out.read_text())
+        assert report["results"][0]["peak_rss_mb"] > 0
+        assert len(compare(report, report)) == 1
+
+    def test_isolated_process_that_dies_reports_a_failed_row(self):
+        row = run_isolated("pooled", "tiny", 1, target=_die_without_reporting)
+        assert row == {"scenario": "pooled", "size": "tiny",
+                       "errors": "Error: benchmark process exited with code 3 before reporting"}
@@ -0,0 +1,72 @@
+from cache import EXPANSION, MessageCache
+from framing import BatchMessage
+from runner import PreparedMessages, SendOptions, new_results, prepare_messages, run_send
+
+TWO_MESSAGES = b"MSH|^~\\&|A|B|C|D|20250101||ADT^A01|1|P|2.3\rPID|1\rMSH|^~\\&|A|B|C|D|20250101||ADT^A03|2|P|2.3\rPID|2\r"
+
+
+def other_content(n):
+    return TWO_MESSAGES.replace(b"PID|1", f"PID|{n:05}".encode())
+
+
+class TestPreparedMessages:
+    def test_is_a_list_of_texts_with_prepared_form(self):
+        messages = PreparedMessages(["MSH|A", "MSH|B"])
+        assert messages == ["MSH|A", "MSH|B"]
+        assert prepare_messages(messages) is messages.prepared
+        assert [m.text for m in messages.prepared] == ["MSH|A", "MSH|B"]
+
+    def test_other_preparations_start_from_the_texts(self):
+        messages = PreparedMessages(["MSH|A", "MSH|B", "MSH|C"])
+        batches = prepare_messages(messages, batch_size=2)
+        assert [type(b) for b in batches] == [BatchMessage, BatchMessage]
+        assert prepare_messages(messages, templated=True) is not messages.prepared
+
+    def test_run_send_uses_the_prepared_messages(self):
+        messages = PreparedMessages(["MSH|^~\\&|A|B|C|D|1||ADT^A01|1|P|2.3"] * 3)
+        options = SendOptions(host="unused", port=0, repeat_count=2, simulate_ack=True)
+        results = new_results(len(messages), options)
+        run_send(messages, options, results)
+        assert results["error_message"] is None
+        assert len(results["ack_records"]) == 6
+
+
+class TestMessageCache:
+    def test_hit_returns_the_same_entry(self):
+        cache = MessageCache()
+        first = cache.get(TWO_MESSAGES)
+        assert len(first) == 2 and first[0].startswith("MSH") and first[0].endswith("PID|1")
+        assert cache.get(memoryview(TWO_MESSAGES)) is first
+        assert (cache.hits, cache.misses) == (1, 1)
+
+    def test_text_and_bytes_share_a_key(self):
+        cache = MessageCache()
+        assert cache.get(TWO_MESSAGES.decode()) is cache.get(TWO_MESSAGES)
+
+    def test_batches_are_packed_from_the_cached_messages(self):
+        cache = MessageCache()
+        entry = cache.get(TWO_MESSAGES)
+        batches = prepare_messages(cache.get(TWO_MESSAGES), batch_size=2)
+        assert len(cache) == 1 and cache.hits == 1
+        assert [type(b) for b in batches] == [BatchMessage] and len(batches[0]) == 2
+        assert all(text in batches[0].text for text in entry)
+
+    def test_evicts_least_recently_used(self):
+        entry_bytes = MessageCache().get(other_content(0)).nbytes
+        cache = MessageCache(max_bytes=entry_bytes * 2)
+        first = cache.get(other_content(1))
+        cache.get(other_content(2))
+        cache.get(other_content(1))
+        cache.get(other_content(3))
+        assert len(cache) == 2 and cache.nbytes <= cache.max_bytes
+        assert cache.get(other_content(1)) is first
+        cache.get(other_content(2))
+        assert cache.misses == 4
+
+    def test_content_too_large_is_not_cached(self):
+        cache = MessageCache(max_bytes=len(TWO_MESSAGES) * EXPANSION - 1)
+        assert cache.get(TWO_MESSAGES) is None
+        assert len(cache) == 0 and cache.misses == 0
+
+    def test_empty_content_has_no_messages(self):
+        assert MessageCache().get("") == []
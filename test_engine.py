@@ -0,0 +1,90 @@
+import asyncio
+import socket
+import time
+
+from engine import Engine, send_messages, send_messages_sync, shard
+from mllp import ack_control_id
+from test_mllp import LoopbackReceiver, SAMPLE_MESSAGE
+
+
+def _stamped(control_id):
+    return SAMPLE_MESSAGE.replace("|12345|", f"|{control_id}|")
+
+
+class TestShard:
+    def test_round_robin_preserves_order(self):
+        shards = shard("abcdefg", 3)
+        assert shards == [[(0, "a"), (3, "d"), (6, "g")], [(1, "b"), (4, "e")], [(2, "c"), (5, "f")]]
+
+    def test_drops_empty_shards(self):
+        assert len(shard("ab", 5)) == 2
+
+
+class TestSendMessages:
+    def test_fans_out_across_connections(self):
+        server = LoopbackReceiver(echo_control_id=True)
+        try:
+            batch = [(f"ID{i}", _stamped(f"ID{i}")) for i in range(12)]
+            outcomes = send_messages_sync(batch, "127.0.0.1", server.port, connections=3, window=2, timeout=2)
+        finally:
+            server.close()
+        assert [ack_control_id(ack) for ack, _ in outcomes] == [f"ID{i}" for i in range(12)]
+        assert server.connections == 3
+        assert server.frames == 12
+
+    def test_out_of_order_acks_within_connection(self):
+        server = LoopbackReceiver(echo_control_id=True, reverse_batch=2)
+        try:
+            batch = [(f"ID{i}", _stamped(f"ID{i}")) for i in range(8)]
+            outcomes = asyncio.run(send_messages(batch, "127.0.0.1", server.port, connections=2, window=2, timeout=2))
+        finally:
+            server.close()
+        assert [ack_control_id(ack) for ack, _ in outcomes] == [f"ID{i}" for i in range(8)]
+
+    def test_connection_refused_marks_every_attempt(self):
+        probe = socket.create_server(("127.0.0.1", 0))
+        port = probe.getsockname()[1]
+        probe.close()
+        outcomes = send_messages_sync([("A", SAMPLE_MESSAGE)] * 4, "127.0.0.1", port, connections=2, timeout=1)
+        assert len(outcomes) == 4
+        assert all(ack.startswith("Error:") for ack, _ in outcomes)
+
+    def test_peer_close_reports_unanswered_attempts(self):
+        server = LoopbackReceiver(close_after_ack=True)
+        try:
+            outcomes = send_messages_sync([(None, SAMPLE_MESSAGE)] * 3, "127.0.0.1", server.port,
+                                          connections=1, window=1, timeout=2)
+        finally:
+            server.close()
+        assert "MSA|AA" in outcomes[0][0]
+        assert all(ack.startswith("Error:") for ack, _ in outcomes[1:])
+
+    def test_empty_input(self):
+        assert send_messages_sync([], "127.0.0.1", 1) == []
+
+
+class TestEngine:
+    def test_connections_stay_open_across_sends(self):
+        server = LoopbackReceiver(echo_control_id=True)
+        try:
+            with Engine("127.0.0.1", server.port, connections=2, window=2, timeout=2) as engine:
+                for batch_number in range(3):
+                    batch = [(f"B{batch_number}-{i}", _stamped(f"B{batch_number}-{i}")) for i in range(4)]
+                    outcomes = engine.send(batch)
+                    assert [ack_control_id(ack) for ack, _ in outcomes] == [control_id for control_id, _ in batch]
+        finally:
+            server.close()
+        assert engine.connects == server.connections == 2
+        assert server.frames == 12
+
+    def test_reconnects_after_the_peer_closes(self):
+        server = LoopbackReceiver(close_after_ack=True)
+        try:
+            with Engine("127.0.0.1", server.port, connections=1, timeout=2) as engine:
+                first = engine.send([(None, SAMPLE_MESSAGE)])
+                time.sleep(0.05)
+                second = engine.send([(None, SAMPLE_MESSAGE)])
+        finally:
+            server.close()
+        assert "MSA|AA" in first[0][0] and "MSA|AA" in second[0][0]
+        assert engine.connects == 2
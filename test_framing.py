@@ -0,0 +1,142 @@
+import io
+import socket
+
+from framing import (MLLP_END_BLOCK, MLLP_START_BLOCK, BatchMessage, FrameReader, PreparedMessage, as_buffers,
+                     send_frame)
+from hl7 import iter_hl7_messages, with_message_control_id
+
+SAMPLE_MESSAGE = "MSH|^~\\&|SendingApp|SendingFac|RecvApp|RecvFac|20250101120000||ADT^A01|12345|P|2.3\rPID|1"
+
+
+def _frame(payload: bytes):
+    return MLLP_START_BLOCK + payload + MLLP_END_BLOCK
+
+
+class ChunkedSocket:
+    """Socket stand-in that hands out a byte stream in fixed-size recv_into chunks."""
+
+    def __init__(self, data: bytes, chunk=1):
+        self.data = data
+        self.chunk = chunk
+
+    def recv_into(self, view):
+        n = min(self.chunk, len(view), len(self.data))
+        view[:n] = self.data[:n]
+        self.data = self.data[n:]
+        return n
+
+
+class PartialWriter:
+    """Socket stand-in whose sendmsg accepts at most `limit` bytes per call."""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.received = b""
+
+    def sendmsg(self, buffers):
+        data = b"".join(bytes(b) for b in buffers)[:self.limit]
+        self.received += data
+        return len(data)
+
+
+# ============================================================
+# FrameReader
+# ============================================================
+
+class TestFrameReader:
+    def test_end_block_split_across_reads(self):
+        reader = FrameReader()
+        sock = ChunkedSocket(_frame(b"ACK1"), chunk=1)
+        assert reader.read_frame(sock) == b"ACK1"
+        assert reader.pending == 0
+
+    def test_coalesced_frames(self):
+        reader = FrameReader()
+        sock = ChunkedSocket(_frame(b"A") + _frame(b"B") + _frame(b"C")[:3], chunk=64)
+        assert reader.read_frame(sock) == b"A"
+        assert reader.next_frame() == b"B"
+        assert reader.next_frame() is None
+        assert reader.pending == 3
+
+    def test_grows_for_large_frames(self):
+        payload = b"x" * 100_000
+        reader = FrameReader(size=16)
+        assert reader.read_frame(ChunkedSocket(_frame(payload), chunk=4096)) == payload
+
+    def test_compacts_buffer_between_frames(self):
+        reader = FrameReader(size=16)
+        stream = b"".join(_frame(f"F{i}".encode()) for i in range(50))
+        sock = ChunkedSocket(stream, chunk=5)
+        assert [reader.read_frame(sock) for _ in range(50)] == [f"F{i}".encode() for i in range(50)]
+
+    def test_peer_close_returns_none(self):
+        reader = FrameReader()
+        assert reader.read_frame(ChunkedSocket(MLLP_START_BLOCK + b"partial")) is None
+        assert reader.pending == 8
+
+    def test_feed(self):
+        reader = FrameReader(size=4)
+        reader.feed(_frame(b"one")[:4])
+        assert reader.next_frame() is None
+        reader.feed(_frame(b"one")[4:])
+        assert reader.next_frame() == b"one"
+
+
+# ============================================================
+# send_frame / PreparedMessage
+# ============================================================
+
+class TestSendFrame:
+    def test_resumes_after_partial_writes(self):
+        sock = PartialWriter(limit=3)
+        send_frame(sock, as_buffers("HELLO WORLD"))
+        assert sock.received == _frame(b"HELLO WORLD")
+
+    def test_scatter_gather_over_real_socket(self):
+        left, right = socket.socketpair()
+        with left, right:
+            send_frame(left, PreparedMessage(SAMPLE_MESSAGE).buffers("NEWID"))
+            assert FrameReader().read_frame(right) == with_message_control_id(SAMPLE_MESSAGE, "NEWID").encode()
+
+
+class TestPreparedMessage:
+    def test_buffers_match_text_stamping(self):
+        prepared = PreparedMessage(SAMPLE_MESSAGE)
+        assert b"".join(prepared.buffers("ABC")) == _frame(with_message_control_id(SAMPLE_MESSAGE, "ABC").encode())
+        assert b"".join(prepared.buffers()) == _frame(SAMPLE_MESSAGE.encode())
+        assert prepared.text_with("ABC") == with_message_control_id(SAMPLE_MESSAGE, "ABC")
+
+    def test_without_msh_ignores_control_id(self):
+        prepared = PreparedMessage("PID|1")
+        assert b"".join(prepared.buffers("ABC")) == _frame(b"PID|1")
+
+
+class TestBatchMessage:
+    MESSAGES = [SAMPLE_MESSAGE, with_message_control_id(SAMPLE_MESSAGE, "67890"), "PID|no msh"]
+
+    def test_envelope(self):
+        batch = BatchMessage(self.MESSAGES, control_id="B1")
+        segments = batch.text.rstrip("\r").split("\r")
+        assert segments[0].startswith("FHS|^~\\&|SendingApp|SendingFac|RecvApp|RecvFac|")
+        assert segments[0].endswith("||||B1") and segments[1].startswith("BHS|") and segments[1].endswith("||||B1")
+        assert segments[-2:] == ["BTS|3", "FTS|1"]
+        assert len(batch) == 3
+        assert b"".join(batch.buffers()) == _frame(batch.text.encode())
+        # Unpacking the batch gives back the messages as they were.
+        assert list(iter_hl7_messages(io.StringIO(BatchMessage(self.MESSAGES[:2]).text))) == self.MESSAGES[:2]
+
+    def test_stamping_sets_batch_and_message_control_ids(self):
+        text = BatchMessage(self.MESSAGES).text_with("XYZ")
+        assert text.split("\r")[1].endswith("||||XYZ")
+        assert [m.split("|")[9] for m in iter_hl7_messages(io.StringIO(text)) if m.startswith("MSH")] == \
+            ["XYZ-1", "XYZ-2"]
+        assert "PID|no msh" in text
+
+    def test_envelope_uses_the_first_message_delimiters(self):
+        message = "MSH#$~\\!#App#Fac#Rcv#RFac#20250101##ADT$A01#C1#P#2.3\rPID#1"
+        text = BatchMessage([message], control_id="B1").text_with("XYZ")
+        segments = text.rstrip("\r").split("\r")
+        assert segments[0].startswith("FHS#$~\\!#App#Fac#Rcv#RFac#") and segments[0].endswith("####XYZ")
+        assert segments[1].startswith("BHS#$~\\!#") and segments[1].endswith("####XYZ")
+        assert segments[2].split("#")[9] == "XYZ-1"
+        assert segments[-2:] == ["BTS#1", "FTS#1"]
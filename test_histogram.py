@@ -0,0 +1,76 @@
+import json
+import random
+
+import pytest
+
+from histogram import LatencyHistogram
+
+
+class TestLatencyHistogram:
+    def test_empty(self):
+        hist = LatencyHistogram()
+        assert hist.percentile(99) == 0.0
+        assert hist.summary()["count"] == 0
+
+    def test_percentiles_within_precision(self):
+        rng = random.Random(7)
+        samples = [rng.expovariate(1 / 0.02) for _ in range(20000)]
+        hist = LatencyHistogram()
+        for s in samples:
+            hist.record(s)
+        samples.sort()
+        for p in (50, 90, 99, 99.9):
+            exact = samples[int(len(samples) * p / 100) - 1]
+            assert hist.percentile(p) == pytest.approx(exact, rel=0.02)
+        assert hist.max == pytest.approx(samples[-1], abs=1e-6)
+        assert hist.mean == pytest.approx(sum(samples) / len(samples), rel=1e-3)
+
+    def test_memory_is_constant(self):
+        hist = LatencyHistogram()
+        size = len(hist.counts)
+        for i in range(10000):
+            hist.record(i / 1000)
+        assert len(hist.counts) == size
+
+    def test_clamps_above_max_but_tracks_true_max(self):
+        hist = LatencyHistogram(max_seconds=1)
+        hist.record(5.0)
+        assert hist.max == 5.0
+        assert hist.percentile(100) == pytest.approx(5.0)
+
+    def test_merge_matches_single_histogram(self):
+        a, b, both = LatencyHistogram(), LatencyHistogram(), LatencyHistogram()
+        for i in range(1000):
+            (a if i % 2 else b).record(i / 10000)
+            both.record(i / 10000)
+        a.merge(b)
+        assert a.summary() == both.summary()
+
+    def test_merge_rejects_different_layout(self):
+        with pytest.raises(ValueError):
+            LatencyHistogram().merge(LatencyHistogram(sub_bucket_bits=5))
+
+    def test_buckets_cover_samples(self):
+        hist = LatencyHistogram()
+        for s in (0.001, 0.001, 0.5):
+            hist.record(s)
+        buckets = hist.buckets()
+        assert sum(count for _, count in buckets) == 3
+        assert buckets[0][0] >= 0.001
+
+    def test_copy_is_independent(self):
+        hist = LatencyHistogram()
+        hist.record(0.001)
+        snapshot = hist.copy()
+        hist.record(0.5)
+        assert snapshot.total == 1
+        assert snapshot.max == pytest.approx(0.001)
+        assert hist.total == 2
+
+    def test_dict_round_trip(self):
+        hist = LatencyHistogram()
+        for s in (0.0005, 0.002, 0.002, 1.5):
+            hist.record(s)
+        restored = LatencyHistogram.from_dict(json.loads(json.dumps(hist.to_dict())))
+        assert restored.summary() == hist.summary()
+        assert restored.counts == hist.counts
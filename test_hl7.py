@@ -0,0 +1,108 @@
+import io
+import pickle
+
+from hl7 import AckInfo, MessageSource, iter_hl7_messages, parse_ack, split_hl7_messages
+
+BATCH_FILE = (
+    "FHS|^~\\&|SND|FAC|||20250101\r"
+    "BHS|^~\\&|SND|FAC|||20250101\r"
+    "MSH|^~\\&|A|B|C|D|20250101||ADT^A01|1|P|2.3\rPID|1\r"
+    "MSH|^~\\&|A|B|C|D|20250101||ADT^A03|2|P|2.3\rPID|2\r"
+    "BTS|2\r"
+    "FTS|1\r"
+)
+
+
+# ============================================================
+# iter_hl7_messages
+# ============================================================
+
+class TestIterHl7Messages:
+    def test_mixed_terminators(self):
+        raw = "MSH|A\r\nPID|1\rPV1|1\nMSH|B\r\nPID|2"
+        assert list(iter_hl7_messages(io.StringIO(raw))) == ["MSH|A\rPID|1\rPV1|1", "MSH|B\rPID|2"]
+
+    def test_drops_batch_envelope(self):
+        msgs = list(iter_hl7_messages(io.StringIO(BATCH_FILE)))
+        assert len(msgs) == 2
+        assert all(m.startswith("MSH") for m in msgs)
+        assert "BTS" not in msgs[1]
+
+    def test_tiny_chunks_match_whole_read(self):
+        raw = BATCH_FILE.replace("\r", "\r\n")
+        whole = list(iter_hl7_messages(io.StringIO(raw)))
+        for chunk_size in (1, 2, 3, 7):
+            assert list(iter_hl7_messages(io.StringIO(raw), chunk_size=chunk_size)) == whole
+
+    def test_binary_stream_with_split_multibyte_char(self):
+        raw = "MSH|A\rPID|1||Müller\r".encode()
+        msgs = list(iter_hl7_messages(io.BytesIO(raw), chunk_size=1))
+        assert msgs == ["MSH|A\rPID|1||Müller"]
+
+    def test_ignores_mllp_framing_bytes(self):
+        raw = b"\x0bMSH|A\rPID|1\r\x1c\r\x0bMSH|B\rPID|2\r\x1c\r"
+        assert list(iter_hl7_messages(io.BytesIO(raw))) == ["MSH|A\rPID|1", "MSH|B\rPID|2"]
+
+    def test_is_lazy(self):
+        class CountingReader(io.StringIO):
+            reads = 0
+
+            def read(self, size=-1):
+                self.reads += 1
+                return super().read(size)
+
+        reader = CountingReader("MSH|A\rPID|1\r" * 1000)
+        first = next(iter_hl7_messages(reader, chunk_size=64))
+        assert first == "MSH|A\rPID|1"
+        assert reader.reads < 5
+
+    def test_split_matches_stream(self):
+        assert split_hl7_messages(BATCH_FILE) == list(iter_hl7_messages(io.StringIO(BATCH_FILE)))
+
+
+class TestMessageSource:
+    def test_from_paths_is_reiterable(self, tmp_path):
+        (tmp_path / "a.hl7").write_bytes(BATCH_FILE.encode())
+        (tmp_path / "b.hl7").write_bytes(b"MSH|C\rPID|3\r")
+        source = MessageSource.from_paths([tmp_path / "a.hl7", tmp_path / "b.hl7"])
+        assert len(list(source)) == 3
+        assert list(source) == list(source)
+
+    def test_from_buffer(self):
+        source = MessageSource.from_buffer(memoryview(BATCH_FILE.encode()))
+        assert len(list(source)) == 2
+
+    def test_picklable(self, tmp_path):
+        (tmp_path / "a.hl7").write_bytes(BATCH_FILE.encode())
+        for source in (MessageSource.from_paths([tmp_path / "a.hl7"]),
+                       MessageSource.from_buffer(memoryview(BATCH_FILE.encode()))):
+            assert list(pickle.loads(pickle.dumps(source))) == list(source)
+
+
+# ============================================================
+# parse_ack
+# ============================================================
+
+class TestParseAck:
+    def test_accept(self):
+        ack = "MSH|^~\\&|R|R|S|S|20250101||ACK|9|P|2.5\rMSA|AA|MSG1"
+        assert parse_ack(ack) == AckInfo("AA", "MSG1", "", None)
+
+    def test_v25_err_code_and_text(self):
+        ack = ("MSH|^~\\&|R|R|S|S|20250101||ACK|9|P|2.5\rMSA|AE|MSG1|Bad PID\r"
+               "ERR||PID^1^3|207^Application internal error^HL70357|E")
+        assert parse_ack(ack) == AckInfo("AE", "MSG1", "Bad PID", "207")
+
+    def test_v23_err_location_code(self):
+        ack = "MSH|^~\\&|R|R|S|S|20250101||ACK|9|P|2.3\rMSA|AR|MSG1\rERR|PID^1^3^101&Required field missing"
+        assert parse_ack(ack).error_code == "101"
+
+    def test_msa6_error_condition(self):
+        assert parse_ack("MSA|AE|MSG1|text|||204^Unknown key").error_code == "204"
+
+    def test_custom_encoding_characters(self):
+        ack = "MSH#*~\\&#R#R#S#S#20250101##ACK#9#P#2.5\rMSA#AE#MSG1\rERR###103*Table value not found"
+        assert parse_ack(ack) == AckInfo("AE", "MSG1", "", "103")
+
+    def test_missing_msa(self):
+        assert parse_ack("MSH|^~\\&|A|B\r") == AckInfo("UNKNOWN")
@@ -0,0 +1,122 @@
+import pytest
+
+from hl7parse import DEFAULT_ENCODING, Encoding, HL7Message, parse_path
+
+ORU = (
+    "MSH|^~\\&|LAB|FAC|EHR|HOSP|20250101||ORU^R01^ORU_R01|CTRL1|P|2.5\r"
+    "PID|1||123^^^MRN&1.2.3&ISO~456^^^SSN||DOE^JOHN\r"
+    "OBX|1|NM|GLU||98\r"
+    "OBX|2|NM|NA||140"
+)
+
+
+class TestParsePath:
+    def test_parts(self):
+        assert parse_path("PID-3") == ("PID", 1, 3, None, None)
+        assert parse_path("OBX(2)-5.1.2") == ("OBX", 2, 5, 1, 2)
+
+    @pytest.mark.parametrize("path", ["PID", "pid-3", "PID-", "PID-3.x", "PID(0-3"])
+    def test_invalid(self, path):
+        with pytest.raises(ValueError):
+            parse_path(path)
+
+
+class TestGet:
+    def test_fields_components_subcomponents(self):
+        msg = HL7Message(ORU)
+        assert msg["PID-3"] == "123^^^MRN&1.2.3&ISO~456^^^SSN"
+        assert msg["PID-3.1"] == "123"
+        assert msg["PID-3.4.2"] == "1.2.3"
+        assert msg["PID-5.2"] == "JOHN"
+
+    def test_msh_numbering(self):
+        msg = HL7Message(ORU)
+        assert msg["MSH-1"] == "|"
+        assert msg["MSH-2"] == "^~\\&"
+        assert msg["MSH-9.2"] == "R01"
+        assert msg["MSH-10"] == "CTRL1"
+        assert msg["MSH-12"] == "2.5"
+
+    def test_occurrence(self):
+        msg = HL7Message(ORU)
+        assert msg["OBX-3"] == "GLU"
+        assert msg["OBX(2)-3"] == "NA"
+        assert msg.get("OBX(3)-3") is None
+
+    def test_missing_values(self):
+        msg = HL7Message(ORU)
+        assert msg.get("PV1-2", "none") == "none"
+        assert msg.get("PID-30") is None
+        assert msg.get("PID-5.9") is None
+        assert msg["PID-5.9"] == ""
+        assert "PV1" not in msg and "OBX" in msg
+
+    def test_custom_encoding(self):
+        msg = HL7Message("MSH#*!/%#A#B#C#D#20250101##ADT*A01#9#P#2.3\rPID#1##55*X%Y!66")
+        assert msg.encoding == Encoding("#", "*", "!", "/", "%")
+        assert msg["MSH-9.2"] == "A01"
+        assert msg["PID-3.2.2"] == "Y"
+
+    def test_short_msh2_takes_defaults(self):
+        assert HL7Message("MSH|^~|A").encoding == Encoding("|", "^", "~", "\\", "&")
+
+    def test_no_msh(self):
+        msg = HL7Message("PID|1||X")
+        assert msg.encoding == DEFAULT_ENCODING
+        assert msg.get("MSH-10") is None
+        assert msg["PID-3"] == "X"
+
+    def test_fields(self):
+        msg = HL7Message(ORU)
+        assert msg.fields("OBX", 2)[:4] == ["OBX", "2", "NM", "NA"]
+        assert msg.fields("MSH")[9] == "CTRL1"
+        assert msg.fields("PV1") is None
+
+
+class TestSet:
+    def test_set_field_renders_only_edit(self):
+        msg = HL7Message(ORU)
+        msg["MSH-10"] = "NEW"
+        assert str(msg) == ORU.replace("CTRL1", "NEW")
+        assert msg["MSH-10"] == "NEW"
+
+    def test_unedited_render_is_original(self):
+        msg = HL7Message(ORU)
+        assert msg.render() is msg.text
+
+    def test_pads_fields_and_components(self):
+        msg = HL7Message("MSH|^~\\&|A\rPID|1")
+        msg["PID-5.3"] = "Q"
+        msg["PID-3.1.2"] = "S"
+        assert msg.render() == "MSH|^~\\&|A\rPID|1||&S||^^Q"
+
+    def test_component_keeps_other_repetitions(self):
+        msg = HL7Message(ORU)
+        msg["PID-3.1"] = "999"
+        assert msg["PID-3"] == "999^^^MRN&1.2.3&ISO~456^^^SSN"
+
+    def test_occurrence(self):
+        msg = HL7Message(ORU)
+        msg["OBX(2)-5"] = "141"
+        assert msg.render().endswith("OBX|2|NM|NA||141")
+        assert msg["OBX-5"] == "98"
+
+    def test_missing_segment(self):
+        with pytest.raises(KeyError):
+            HL7Message(ORU)["PV1-2"] = "X"
+
+    def test_encoding_fields_are_read_only(self):
+        msg = HL7Message(ORU)
+        for path in ("MSH-1", "MSH-2"):
+            with pytest.raises(ValueError):
+                msg[path] = "X"
+
+    def test_edits_in_several_segments_splice_into_the_text(self):
+        msg = HL7Message("MSH|^~\\&|A|B\rPID|1|X\rOBX|1")
+        msg["OBX-4"] = "D"
+        msg["MSH-4"] = "BB"
+        msg["PID-1"] = "7"
+        msg["PID-1"] = "8"
+        assert msg.render() == "MSH|^~\\&|A|BB\rPID|8|X\rOBX|1|||D"
+        assert msg["OBX-3"] == "" and msg.get("OBX-5") is None
+        assert msg.fields("OBX") == ["OBX", "1", "", "", "D"]
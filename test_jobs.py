@@ -0,0 +1,78 @@
+import time
+
+from jobs import JobRegistry, SendJob
+from resultlog import ResultLog
+from runner import SendOptions
+
+MESSAGE = "MSH|^~\\&|A|B|C|D|20250101||ADT^A01|MSG1|P|2.3\rPID|1"
+
+
+def simulated(**overrides):
+    return SendOptions(host="127.0.0.1", port=1, simulate_ack=True, **overrides)
+
+
+class TestSendJob:
+    def test_runs_to_completion_in_background(self):
+        job = SendJob(1, [MESSAGE, MESSAGE], simulated(repeat_count=3), num_messages=2).start()
+        assert job.wait(5)
+        assert job.done and not job.running
+        assert job.status_text == "Finished"
+        assert len(job.results["ack_records"]) == 6
+        assert job.results["batch_end_time"] is not None
+        assert not job.results["cancelled"]
+
+    def test_cancel_cuts_inter_cycle_wait_short(self):
+        job = SendJob(1, [MESSAGE], simulated(num_cycles=3, interval_seconds=60), num_messages=1).start()
+        deadline = time.monotonic() + 5
+        while not job.results["ack_records"] and time.monotonic() < deadline:
+            time.sleep(0.01)
+        started = time.monotonic()
+        job.cancel()
+        assert job.wait(2)
+        assert time.monotonic() - started < 1.0
+        assert job.cancelled
+        assert job.results["cancelled"]
+        assert job.status_text == "Cancelled"
+        assert len(job.results["ack_records"]) == 1
+
+    def test_send_error_is_reported(self):
+        # Nothing listens on port 1, so the first attempt fails and the run stops.
+        job = SendJob(1, [MESSAGE], SendOptions(host="127.0.0.1", port=1, timeout=1), num_messages=1).start()
+        assert job.wait(5)
+        assert job.status_text == "Stopped on error"
+        assert job.results["error_message"]
+
+
+class TestJobRegistry:
+    def test_jobs_run_concurrently(self):
+        registry = JobRegistry()
+        slow = registry.submit([MESSAGE], simulated(num_cycles=2, interval_seconds=60), 1, label="slow")
+        fast = registry.submit([MESSAGE], simulated(), 1, label="fast")
+        assert fast.wait(5)
+        assert slow.running
+        assert [job.label for job in registry.jobs()] == ["fast", "slow"]
+        assert registry.running() == [slow]
+        registry.cancel_all()
+        assert slow.wait(2)
+
+    def test_forgets_oldest_finished_jobs(self):
+        registry = JobRegistry(max_finished=2)
+        for _ in range(4):
+            registry.submit([MESSAGE], simulated(), 1).wait(5)
+        registry.submit([MESSAGE], simulated(), 1).wait(5)
+        assert [job.job_id for job in registry.jobs()] == [5, 4, 3]
+        assert registry.get(1) is None
+
+    def test_remove_cancels_running_job(self):
+        registry = JobRegistry()
+        job = registry.submit([MESSAGE], simulated(num_cycles=2, interval_seconds=60), 1)
+        registry.remove(job.job_id)
+        assert job.wait(2)
+        assert registry.get(job.job_id) is None
+
+    def test_jobs_logged_to_result_log(self, tmp_path):
+        log = ResultLog(str(tmp_path / "results.db"))
+        job = JobRegistry(result_log=log).submit([MESSAGE], simulated(repeat_count=2), 1, label="logged")
+        assert job.wait(5)
+        run = log.run(job.run_id)
+        assert (run["label"], run["status"], run["attempts"]) == ("logged", "finished", 2)
@@ -0,0 +1,116 @@
+import time
+
+import pytest
+
+from loadgen import (
+    TokenBucket,
+    constant_profile,
+    profile_integral,
+    ramp_profile,
+    run_open_loop_sync,
+    spike_profile,
+    step_profile,
+)
+from mllp import ack_control_id
+from test_mllp import LoopbackReceiver, SAMPLE_MESSAGE
+
+
+class SlowReceiver(LoopbackReceiver):
+    """LoopbackReceiver that stalls before each ACK."""
+
+    def __init__(self, delay, **kwargs):
+        self.delay = delay
+        super().__init__(**kwargs)
+
+    def _ack_for(self, frame):
+        time.sleep(self.delay)
+        return super()._ack_for(frame)
+
+
+# ============================================================
+# Profiles and TokenBucket
+# ============================================================
+
+class TestProfiles:
+    def test_ramp(self):
+        rate_at = ramp_profile(0, 100, 10)
+        assert rate_at(0) == 0
+        assert rate_at(5) == 50
+        assert rate_at(20) == 100
+
+    def test_step(self):
+        rate_at = step_profile([10, 20, 30], 2)
+        assert [rate_at(t) for t in (0, 2.5, 4, 99)] == [10, 20, 30, 30]
+
+    def test_spike(self):
+        rate_at = spike_profile(10, 100, 5, 1)
+        assert [rate_at(t) for t in (4.9, 5, 5.9, 6)] == [10, 100, 100, 10]
+
+    def test_integral(self):
+        assert profile_integral(ramp_profile(0, 100, 10), 10) == pytest.approx(500)
+        assert profile_integral(step_profile([10, 20, 30], 2), 5) == pytest.approx(90)
+        assert profile_integral(constant_profile(7), 0) == 0
+
+
+class TestTokenBucket:
+    def test_constant_rate_due_times(self):
+        bucket = TokenBucket(constant_profile(10), 1.0)
+        dues = list(iter(bucket.take, None))
+        assert len(dues) == 10
+        assert dues[1] == pytest.approx(0.1)
+
+    def test_zero_rate_skips_ahead(self):
+        bucket = TokenBucket(step_profile([0, 10], 0.5), 1.0)
+        dues = list(iter(bucket.take, None))
+        assert dues[0] >= 0.5
+        assert len(dues) == 5
+
+
+# ============================================================
+# run_open_loop
+# ============================================================
+
+class TestRunOpenLoop:
+    def test_holds_target_rate(self):
+        server = LoopbackReceiver(echo_control_id=True)
+        records = []
+        try:
+            report = run_open_loop_sync([SAMPLE_MESSAGE], "127.0.0.1", server.port, constant_profile(200), 0.5,
+                                        connections=2, generate_message_id=True, timeout=2,
+                                        on_record=lambda r: records.append((time.perf_counter(), r)))
+            ended = time.perf_counter()
+        finally:
+            server.close()
+        # Records come in as the ACKs do, not all at the end of the run.
+        assert records[0][0] < ended - 0.3
+        records = [r for _, r in records]
+        assert report["scheduled"] == 100
+        assert report["completed"] == 100
+        assert report["target_rate"] == pytest.approx(200)
+        assert all(ack_control_id(r["ack"]) == r["message_id"] for r in records)
+
+    def test_cancelled_run_targets_the_profile_over_the_part_it_reached(self):
+        server = LoopbackReceiver(echo_control_id=True)
+        stop_at = time.perf_counter() + 0.5
+        try:
+            report = run_open_loop_sync([SAMPLE_MESSAGE], "127.0.0.1", server.port, ramp_profile(100, 300, 2.0),
+                                        2.0, generate_message_id=True, timeout=2,
+                                        should_stop=lambda: time.perf_counter() >= stop_at)
+        finally:
+            server.close()
+        assert report["cancelled"]
+        # The ramp averages 125/s over the half second reached, not its 200/s over the whole run.
+        assert report["target_rate"] == pytest.approx(125, rel=0.1)
+
+    def test_latency_includes_queueing_behind_slow_receiver(self):
+        server = SlowReceiver(0.05, echo_control_id=True)
+        records = []
+        try:
+            report = run_open_loop_sync([SAMPLE_MESSAGE], "127.0.0.1", server.port, constant_profile(100), 0.2,
+                                        generate_message_id=True, timeout=5, on_record=records.append)
+        finally:
+            server.close()
+        # 20 sends due over 0.2s but the receiver clears one per 50ms, so later sends wait.
+        assert report["scheduled"] == 20
+        assert records[-1]["latency"] > 0.5
+        assert report["achieved_rate"] < report["target_rate"]
@@ -0,0 +1,125 @@
+import re
+import urllib.error
+import urllib.request
+
+import pytest
+
+from loadgen import constant_profile
+import metrics
+from mllp import ConnectionPool, send_hl7_message
+from receiver import ResponderConfig, ThreadedReceiver
+from runner import SendOptions, new_results, run_send
+
+MESSAGES = [f"MSH|^~\\&|A|B|C|D|20250101||ADT^A01|{i}|P|2.3\rPID|{i}" for i in range(1, 11)]
+
+
+@pytest.fixture(scope="module")
+def server():
+    with ThreadedReceiver(ResponderConfig(ae_ratio=0.5, seed=3)) as receiver:
+        yield receiver
+
+
+@pytest.fixture
+def telemetry():
+    yield metrics.enable()
+    metrics.disable()
+
+
+def sample(text: str, name: str):
+    match = re.search(rf"^{re.escape(name)} (\S+)$", text, re.MULTILINE)
+    return float(match.group(1)) if match else None
+
+
+class TestSendMetrics:
+    def test_off_by_default(self):
+        assert metrics.active() is None
+        assert send_hl7_message("MSH|A", "127.0.0.1", 1).startswith("Error:")
+
+    @pytest.mark.parametrize("overrides", [{}, {"use_pool": False}, {"window": 4}, {"connections": 2, "window": 4}])
+    def test_counts_every_attempt(self, server, telemetry, overrides):
+        options = SendOptions(host="127.0.0.1", port=server.port, repeat_count=2, **overrides)
+        pool = ConnectionPool()
+        results = new_results(len(MESSAGES), options, pool)
+        seen = []
+        run_send(MESSAGES, options, results, pool=pool, on_record=seen.append)
+        pool.close()
+        assert telemetry.sent == telemetry.acked == 20
+        assert sum(telemetry.statuses.values()) == 20 and set(telemetry.statuses) <= {"AA", "AE"}
+        assert telemetry.bytes_sent == sum(record.bytes_sent for record in seen)
+        assert telemetry.histograms["ack"].total == 20
+        assert telemetry.histograms["connect"].total >= 1
+        assert telemetry.in_flight == 0
+        assert telemetry.open_connections == 0
+
+    def test_open_loop(self, server, telemetry):
+        options = SendOptions(host="127.0.0.1", port=server.port, connections=2,
+                              rate_profile=constant_profile(200), load_seconds=0.2)
+        results = new_results(len(MESSAGES), options)
+        run_send(MESSAGES, options, results)
+        assert results["error_message"] is None
+        assert telemetry.sent == telemetry.acked == results["ack_records"].total > 0
+        assert telemetry.histograms["connect"].total == 2
+        assert telemetry.in_flight == 0
+        assert telemetry.open_connections == 0
+
+    def test_worker_processes_report_wire_counts(self, server, telemetry):
+        options = SendOptions(host="127.0.0.1", port=server.port, repeat_count=2, processes=2)
+        results = new_results(len(MESSAGES), options)
+        seen = []
+        run_send(MESSAGES, options, results, on_record=seen.append)
+        assert results["error_message"] is None
+        assert telemetry.sent == telemetry.acked == 20
+        assert telemetry.bytes_sent == sum(record.bytes_sent for record in seen)
+        assert telemetry.histograms["connect"].total >= 2
+        assert telemetry.histograms["first_byte"].total == 20
+        text = telemetry.render()
+        assert sample(text, "hl7_open_connections") == sample(text, "hl7_in_flight_messages") == 0
+
+    def test_stop_and_wait_records_phases(self, server, telemetry):
+        options = SendOptions(host="127.0.0.1", port=server.port)
+        run_send(MESSAGES, options, new_results(len(MESSAGES), options), pool=ConnectionPool())
+        assert telemetry.histograms["send"].total == 10
+        assert telemetry.histograms["first_byte"].total == 10
+
+    def test_errors_counted(self, telemetry):
+        options = SendOptions(host="127.0.0.1", port=1, timeout=1)
+        results = new_results(1, options)
+        run_send(MESSAGES[:1], options, results)
+        assert results["error_message"]
+        assert telemetry.errors == 1
+
+    def test_render_exposition(self, server, telemetry):
+        send_hl7_message(MESSAGES[0], "127.0.0.1", server.port)
+        text = telemetry.render()
+        assert sample(text, "hl7_messages_sent_total") == 1
+        assert sample(text, 'hl7_connect_seconds_bucket{le="+Inf"}') == 1
+        assert sample(text, "hl7_open_connections") == 0
+        assert "# TYPE hl7_send_seconds histogram" in text
+        buckets = [float(v) for v in re.findall(r'^hl7_send_seconds_bucket\{le="[^"]+"\} (\S+)$', text, re.M)]
+        assert buckets == sorted(buckets)
+
+    def test_render_counts_acks_received(self, server, telemetry):
+        options = SendOptions(host="127.0.0.1", port=server.port)
+        run_send(MESSAGES[:3], options, new_results(3, options))
+        assert sample(telemetry.render(), "hl7_acks_received_total") == 3
+
+    def test_spans_need_opentelemetry(self):
+        if metrics.trace is not None:
+            pytest.skip("opentelemetry is installed")
+        with pytest.raises(ValueError, match="opentelemetry"):
+            metrics.enable(spans=True)
+        metrics.disable()
+
+
+class TestMetricsServer:
+    def test_serves_metrics(self, telemetry):
+        telemetry.error()
+        server = metrics.MetricsServer("127.0.0.1", 0)
+        try:
+            with urllib.request.urlopen(f"http://127.0.0.1:{server.port}/metrics") as response:
+                assert response.headers["Content-Type"].startswith("text/plain")
+                assert sample(response.read().decode(), "hl7_send_errors_total") == 1
+            with pytest.raises(urllib.error.HTTPError):
+                urllib.request.urlopen(f"http://127.0.0.1:{server.port}/other")
+        finally:
+            server.close()
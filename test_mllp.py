@@ -0,0 +1,260 @@
+import os
+import socket
+import threading
+import time
+
+import pytest
+
+from mllp import (
+    MLLP_START_BLOCK,
+    MLLP_END_BLOCK,
+    AttemptTiming,
+    ConnectionPool,
+    Resolver,
+    ack_control_id,
+    send_hl7_message,
+    send_pipelined,
+)
+
+SAMPLE_MESSAGE = "MSH|^~\\&|SendingApp|SendingFac|RecvApp|RecvFac|20250101120000||ADT^A01|12345|P|2.3"
+SAMPLE_ACK = "MSH|^~\\&|RecvApp|RecvFac|SendingApp|SendingFac|20250101120001||ACK^A01|99999|P|2.3\rMSA|AA|12345\r"
+
+
+class LoopbackReceiver:
+    """
+    Minimal threaded MLLP listener that answers every frame with SAMPLE_ACK.
+    With echo_control_id the ACK's MSA-2 carries the frame's MSH-10; with reverse_batch=N the
+    listener holds N frames and answers them newest first to exercise out-of-order ACKs. With
+    silent_after=N every frame past the Nth is accepted and the connection closed without an ACK.
+    """
+
+    def __init__(self, close_after_ack=False, echo_control_id=False, reverse_batch=0, silent_after=None):
+        self.close_after_ack = close_after_ack
+        self.silent_after = silent_after
+        self.echo_control_id = echo_control_id
+        self.reverse_batch = reverse_batch
+        self.connections = 0
+        self.frames = 0
+        self._server = socket.create_server(("127.0.0.1", 0))
+        self.port = self._server.getsockname()[1]
+        self._thread = threading.Thread(target=self._serve, daemon=True)
+        self._thread.start()
+
+    def _serve(self):
+        while True:
+            try:
+                conn, _ = self._server.accept()
+            except OSError:
+                return
+            self.connections += 1
+            threading.Thread(target=self._handle, args=(conn,), daemon=True).start()
+
+    def _ack_for(self, frame):
+        if not self.echo_control_id:
+            return SAMPLE_ACK
+        control_id = frame.lstrip(MLLP_START_BLOCK).decode().split("\r")[0].split("|")[9]
+        return SAMPLE_ACK.replace("MSA|AA|12345", f"MSA|AA|{control_id}")
+
+    def _handle(self, conn):
+        buffer = b''
+        held = []
+        with conn:
+            while True:
+                try:
+                    chunk = conn.recv(4096)
+                except OSError:
+                    return
+                if not chunk:
+                    return
+                buffer += chunk
+                while MLLP_END_BLOCK in buffer:
+                    frame, buffer = buffer.split(MLLP_END_BLOCK, 1)
+                    self.frames += 1
+                    if self.silent_after is not None and self.frames > self.silent_after:
+                        return
+                    held.append(self._ack_for(frame))
+                    if len(held) < self.reverse_batch:
+                        continue
+                    conn.sendall(b''.join(MLLP_START_BLOCK + ack.encode() + MLLP_END_BLOCK
+                                          for ack in reversed(held)))
+                    held = []
+                    if self.close_after_ack:
+                        return
+
+    def close(self):
+        self._server.close()
+
+
+@pytest.fixture
+def receiver():
+    server = LoopbackReceiver()
+    yield server
+    server.close()
+
+
+# ============================================================
+# ConnectionPool
+# ============================================================
+
+class TestConnectionPool:
+    def test_reuses_connection_across_sends(self, receiver):
+        pool = ConnectionPool(timeout=2)
+        for _ in range(5):
+            ack = send_hl7_message(SAMPLE_MESSAGE, "127.0.0.1", receiver.port, pool=pool)
+            assert "MSA|AA" in ack
+        pool.close()
+        assert pool.connects == 1
+        assert receiver.connections == 1
+        assert receiver.frames == 5
+
+    def test_per_message_mode_opens_connection_each_send(self, receiver):
+        for _ in range(3):
+            send_hl7_message(SAMPLE_MESSAGE, "127.0.0.1", receiver.port)
+        assert receiver.frames == 3
+        assert receiver.connections == 3
+
+    def test_reconnects_when_peer_closes(self):
+        server = LoopbackReceiver(close_after_ack=True)
+        pool = ConnectionPool(timeout=2)
+        try:
+            for _ in range(3):
+                ack = send_hl7_message(SAMPLE_MESSAGE, "127.0.0.1", server.port, pool=pool)
+                assert "MSA|AA" in ack
+                # Let the close land so the pool sees it when it checks the idle connection.
+                time.sleep(0.1)
+        finally:
+            pool.close()
+            server.close()
+        assert pool.connects == 3
+        assert server.frames == 3
+
+    def test_written_frame_is_not_resent_when_the_ack_never_comes(self):
+        server = LoopbackReceiver(silent_after=1)
+        pool = ConnectionPool(timeout=2)
+        try:
+            assert "MSA|AA" in send_hl7_message(SAMPLE_MESSAGE, "127.0.0.1", server.port, pool=pool)
+            result = send_hl7_message(SAMPLE_MESSAGE, "127.0.0.1", server.port, pool=pool)
+        finally:
+            pool.close()
+            server.close()
+        assert result.startswith("Error:")
+        assert pool.connects == 1
+        assert server.frames == 2
+
+    def test_reuses_connections_with_high_descriptors(self, receiver):
+        # select() cannot watch fds of 1024 and up; a busy process hands those out to new sockets.
+        held = []
+        try:
+            while True:
+                fd = os.dup(0)
+                held.append(fd)
+                if fd >= 1024:
+                    break
+        except OSError:
+            pytest.skip("cannot open 1024 descriptors here")
+        pool = ConnectionPool(timeout=2)
+        try:
+            for _ in range(3):
+                assert "MSA|AA" in send_hl7_message(SAMPLE_MESSAGE, "127.0.0.1", receiver.port, pool=pool)
+        finally:
+            pool.close()
+            for fd in held:
+                os.close(fd)
+        assert pool.connects == 1
+
+    def test_connection_refused_returns_error_string(self):
+        pool = ConnectionPool(timeout=1)
+        probe = socket.create_server(("127.0.0.1", 0))
+        port = probe.getsockname()[1]
+        probe.close()
+        result = send_hl7_message(SAMPLE_MESSAGE, "127.0.0.1", port, pool=pool)
+        assert result.startswith("Error:")
+        assert pool.idle_count() == 0
+
+    def test_close_drops_idle_connections(self, receiver):
+        pool = ConnectionPool(timeout=2)
+        send_hl7_message(SAMPLE_MESSAGE, "127.0.0.1", receiver.port, pool=pool)
+        assert pool.idle_count() == 1
+        pool.close()
+        assert pool.idle_count() == 0
+
+
+# ============================================================
+# Resolver / AttemptTiming
+# ============================================================
+
+class TestPhaseTiming:
+    def test_resolver_caches_per_instance(self, monkeypatch):
+        lookups = []
+        real = socket.getaddrinfo
+        monkeypatch.setattr(socket, "getaddrinfo", lambda *args, **kw: lookups.append(args) or real(*args, **kw))
+        resolver = Resolver()
+        addresses, seconds = resolver.resolve("localhost", 2575)
+        assert "127.0.0.1" in addresses and seconds > 0
+        assert resolver.resolve("localhost", 2575) == (addresses, 0.0)
+        assert len(lookups) == 1
+
+    def test_falls_back_to_an_address_that_answers(self, receiver):
+        resolver = Resolver()
+        resolver._addresses[("test-host", receiver.port)] = ["127.0.0.2", "127.0.0.1"]
+        assert "MSA|AA" in send_hl7_message(SAMPLE_MESSAGE, "test-host", receiver.port, resolver=resolver)
+        assert resolver.resolve("test-host", receiver.port) == (["127.0.0.1", "127.0.0.2"], 0.0)
+
+    def test_pooled_attempt_phases(self, receiver):
+        pool = ConnectionPool(timeout=2)
+        first, second = AttemptTiming(), AttemptTiming()
+        send_hl7_message(SAMPLE_MESSAGE, "localhost", receiver.port, pool=pool, timing=first)
+        send_hl7_message(SAMPLE_MESSAGE, "localhost", receiver.port, pool=pool, timing=second)
+        pool.close()
+        assert first.dns > 0 and first.connect > 0
+        assert first.write > 0 and first.first_byte > 0
+        assert (second.dns, second.connect) == (0.0, 0.0)
+        assert second.write > 0 and second.first_byte > 0
+
+
+# ============================================================
+# send_pipelined
+# ============================================================
+
+def _stamped(control_id):
+    return SAMPLE_MESSAGE.replace("|12345|", f"|{control_id}|")
+
+
+class TestSendPipelined:
+    def test_ack_control_id(self):
+        assert ack_control_id(SAMPLE_ACK) == "12345"
+        assert ack_control_id("MSH|^~\\&|A\rMSA|AA") is None
+        assert ack_control_id("") is None
+
+    def test_matches_out_of_order_acks_by_control_id(self):
+        server = LoopbackReceiver(echo_control_id=True, reverse_batch=4)
+        try:
+            batch = [(f"ID{i}", _stamped(f"ID{i}")) for i in range(8)]
+            outcomes = send_pipelined(batch, "127.0.0.1", server.port, window=4, timeout=2)
+        finally:
+            server.close()
+        assert [ack_control_id(ack) for ack, _ in outcomes] == [f"ID{i}" for i in range(8)]
+        assert all(latency >= 0 for _, latency in outcomes)
+        assert server.connections == 1
+
+    def test_falls_back_to_fifo_without_control_ids(self, receiver):
+        batch = [(None, SAMPLE_MESSAGE)] * 5
+        outcomes = send_pipelined(batch, "127.0.0.1", receiver.port, window=3, timeout=2)
+        assert all("MSA|AA" in ack for ack, _ in outcomes)
+        assert receiver.frames == 5
+
+    def test_returns_connection_to_pool(self, receiver):
+        pool = ConnectionPool(timeout=2)
+        batch = [(f"ID{i}", _stamped(f"ID{i}")) for i in range(3)]
+        send_pipelined(batch, "127.0.0.1", receiver.port, window=2, pool=pool)
+        send_pipelined(batch, "127.0.0.1", receiver.port, window=2, pool=pool)
+        pool.close()
+        assert pool.connects == 1
+        assert receiver.frames == 6
+
+    def test_connection_refused_marks_every_attempt(self):
+        probe = socket.create_server(("127.0.0.1", 0))
+        port = probe.getsockname()[1]
+        probe.close()
+        outcomes = send_pipelined([("A", SAMPLE_MESSAGE), ("B", SAMPLE_MESSAGE)], "127.0.0.1", port, timeout=1)
+        assert all(ack.startswith("Error:") for ack, _ in outcomes)
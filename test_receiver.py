@@ -0,0 +1,65 @@
+import time
+
+import pytest
+
+from engine import send_messages_sync
+from hl7 import build_fake_ack, parse_ack_status
+from mllp import ConnectionPool, ack_control_id, send_hl7_message, send_pipelined
+from receiver import ResponderConfig, ThreadedReceiver
+
+SAMPLE_MESSAGE = "MSH|^~\\&|SendingApp|SendingFac|RecvApp|RecvFac|20250101120000||ADT^A01|12345|P|2.3\rPID|1"
+
+
+def _stamped(control_id):
+    return SAMPLE_MESSAGE.replace("|12345|", f"|{control_id}|")
+
+
+class TestBuildFakeAckStatus:
+    def test_status_override(self):
+        assert parse_ack_status(build_fake_ack(SAMPLE_MESSAGE, None, status="AR")) == "AR"
+
+
+class TestThreadedReceiver:
+    def test_echoes_control_id(self):
+        with ThreadedReceiver() as server:
+            ack = send_hl7_message(_stamped("ABC"), "127.0.0.1", server.port, timeout=2)
+        assert parse_ack_status(ack) == "AA"
+        assert ack_control_id(ack) == "ABC"
+        assert server.stats.frames == 1
+
+    def test_status_mix(self):
+        config = ResponderConfig(ae_ratio=0.25, ar_ratio=0.25, seed=1)
+        batch = [(f"ID{i}", _stamped(f"ID{i}")) for i in range(400)]
+        with ThreadedReceiver(config) as server:
+            outcomes = send_pipelined(batch, "127.0.0.1", server.port, window=32, timeout=2)
+        statuses = [parse_ack_status(ack) for ack, _ in outcomes]
+        assert server.stats.statuses == {s: statuses.count(s) for s in ("AA", "AE", "AR")}
+        assert 60 < statuses.count("AR") < 140
+        assert 60 < statuses.count("AE") < 140
+
+    def test_injected_latency(self):
+        with ThreadedReceiver(ResponderConfig(delay_ms=50)) as server:
+            start = time.perf_counter()
+            send_hl7_message(SAMPLE_MESSAGE, "127.0.0.1", server.port, timeout=2)
+            assert time.perf_counter() - start >= 0.045
+
+    def test_dropped_acks_time_out(self):
+        with ThreadedReceiver(ResponderConfig(drop_ratio=1.0)) as server:
+            ack = send_hl7_message(SAMPLE_MESSAGE, "127.0.0.1", server.port, timeout=0.2)
+        assert ack.startswith("Error:")
+        assert server.stats.dropped == 1
+
+    def test_keeps_connections_open(self):
+        pool = ConnectionPool(timeout=2)
+        with ThreadedReceiver() as server:
+            for _ in range(5):
+                send_hl7_message(SAMPLE_MESSAGE, "127.0.0.1", server.port, pool=pool)
+            pool.close()
+        assert server.stats.connections == 1
+
+    @pytest.mark.parametrize("connections", [1, 4])
+    def test_serves_concurrent_pipelined_load(self, connections):
+        batch = [(f"ID{i}", _stamped(f"ID{i}")) for i in range(2000)]
+        with ThreadedReceiver() as server:
+            outcomes = send_messages_sync(batch, "127.0.0.1", server.port, connections=connections, window=64)
+        assert [ack_control_id(ack) for ack, _ in outcomes] == [f"ID{i}" for i in range(2000)]
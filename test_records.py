@@ -0,0 +1,113 @@
+import threading
+
+import pytest
+
+from records import ERROR_STATUS, AckLog, AckRecord
+
+AA = "MSH|^~\\&|R|R|S|S|20250101||ACK|1|P|2.3\rMSA|AA|1"
+AE = "MSH|^~\\&|R|R|S|S|20250101||ACK|1|P|2.3\rMSA|AE|1"
+
+
+def fill(log, acks, cycle=1):
+    for i, ack in enumerate(acks, start=1):
+        log.append(AckRecord(cycle, i, 1, f"id{i}", ack, i / 1000))
+
+
+class TestAckRecord:
+    def test_status_parsed_and_dict_style_access(self):
+        record = AckRecord(1, 2, 3, "abc", AE, 0.5)
+        assert record.status == "AE"
+        assert record["message_idx"] == 2
+        assert record["ack"] == AE
+
+
+class TestAckLog:
+    def test_keeps_bodies_for_failures_sample_and_last(self):
+        log = AckLog(sample_every=10)
+        fill(log, [AA] * 25 + [AE] + [AA] * 4)
+        assert len(log) == log.total == 30
+        assert log.status_counts == {"AA": 29, "AE": 1}
+        assert log.failures == 1
+        kept = [i for i, r in enumerate(log) if r.ack is not None]
+        assert kept == [0, 10, 20, 25, 29]
+        assert log[25].status == "AE" and log[25].ack == AE
+        assert log[3].status == "AA" and log[3].ack is None
+        assert log[-1].ack == log.last_ack == AA
+
+    def test_columns_round_trip(self):
+        log = AckLog()
+        log.append(AckRecord(2, 7, 3, None, AA, 0.25))
+        record = log[0]
+        assert (record.cycle, record.message_idx, record.attempt, record.message_id, record.duration) == \
+            (2, 7, 3, None, 0.25)
+        assert record.phases is None
+
+    def test_phases_round_trip(self):
+        log = AckLog()
+        log.append(AckRecord(1, 1, 1, None, AA, 0.25, phases=(0.001, 0.002, 0.0005, 0.2)))
+        log.append(AckRecord(1, 2, 1, None, AA, 0.25))
+        assert log[0].phases == (0.001, 0.002, 0.0005, 0.2)
+        assert log[1].phases is None
+        assert list(log.columns()["phases"]["connect"])[0] == 0.002
+
+    def test_retries_and_errors(self):
+        log = AckLog()
+        log.append(AckRecord(1, 1, 1, "id1", "Error: timed out", 2.0, status=ERROR_STATUS, text="Error: timed out"))
+        log.append(AckRecord(1, 1, 1, "id1", AA, 0.25, retry=1))
+        log.append(AckRecord(1, 2, 1, "id2", AA, 0.25))
+        assert (log.total, log.retries, log.errors, log.first_attempts, log.failures) == (3, 1, 1, 2, 1)
+        assert [r.retry for r in log] == [0, 1, 0]
+        assert log[0].ack == "Error: timed out" and log[0].status == ERROR_STATUS
+        assert list(log.columns()["retry"]) == [0, 1, 0]
+
+    def test_counts_messages_and_bytes(self):
+        log = AckLog()
+        log.append(AckRecord(1, 1, 1, None, AA, 0.25, bytes_sent=900, messages=3))
+        log.append(AckRecord(1, 1, 1, None, AA, 0.25, bytes_sent=900, messages=3, retry=1))
+        log.append(AckRecord(1, 2, 1, None, AA, 0.25))
+        log.append(AckRecord(1, 3, 1, None, "Error: refused", 0.0, status=ERROR_STATUS, bytes_sent=0, messages=3))
+        # Resends add bytes but no messages, nor do tries without an ACK; records without a byte count add none.
+        assert (log.total, log.messages, log.bytes_sent) == (4, 4, 1800)
+        assert (log.unacked, log.acked_attempts) == (1, 2)
+
+    def test_bounded_window_keeps_totals(self):
+        log = AckLog(max_rows=100, sample_every=1)
+        fill(log, [AA] * 1000)
+        assert 100 <= len(log) < 125
+        assert log.total == 1000
+        assert log.dropped == 1000 - len(log)
+        assert log[-1].message_idx == 1000
+        assert log[0].message_idx == log.dropped + 1
+        assert len(log._bodies) == len(log)
+
+    def test_since_returns_only_new_records(self):
+        log = AckLog()
+        fill(log, [AA] * 3)
+        records, cursor = log.since(0)
+        assert [r.message_idx for r in records] == [1, 2, 3]
+        fill(log, [AA] * 2, cycle=2)
+        records, cursor = log.since(cursor)
+        assert [(r.cycle, r.message_idx) for r in records] == [(2, 1), (2, 2)]
+        assert log.since(cursor) == ([], 5)
+
+    def test_since_skips_dropped_rows(self):
+        log = AckLog(max_rows=10)
+        fill(log, [AA] * 50)
+        records, cursor = log.since(0)
+        assert len(records) == len(log) and cursor == 50
+
+    def test_since_while_another_thread_appends(self):
+        log = AckLog(max_rows=50)
+        writer = threading.Thread(target=fill, args=(log, [AA] * 20_000))
+        writer.start()
+        cursor = 0
+        while writer.is_alive() or cursor < log.total:
+            records, cursor = log.since(cursor)
+            if records:
+                indexes = [r.message_idx for r in records]
+                assert indexes == list(range(cursor - len(records) + 1, cursor + 1))
+        writer.join()
+
+    def test_index_out_of_range(self):
+        with pytest.raises(IndexError):
+            AckLog()[0]
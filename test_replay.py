@@ -0,0 +1,100 @@
+import pytest
+
+from hl7 import split_hl7_messages
+from loadgen import run_replay_sync
+from replay import ReplaySchedule, load_timing, message_times, parse_hl7_timestamp, replay_schedule
+from runner import SendOptions, new_results, run_send
+from test_mllp import LoopbackReceiver
+
+
+def _feed(*stamps):
+    return [f"MSH|^~\\&|A|B|C|D|{stamp}||ADT^A01|{i}|P|2.3\rPID|{i}" for i, stamp in enumerate(stamps, start=1)]
+
+
+class TestTimestamps:
+    @pytest.mark.parametrize("value, expected", [
+        ("20250101", 1735689600.0),
+        ("202501011200", 1735732800.0),
+        ("20250101120000.25", 1735732800.25),
+        ("20250101120000-0500", 1735750800.0),
+        ("20250101120000+0100^S", 1735729200.0),
+    ])
+    def test_parse(self, value, expected):
+        assert parse_hl7_timestamp(value) == pytest.approx(expected)
+
+    @pytest.mark.parametrize("value", ["", "not-a-date", "20251301"])
+    def test_unparseable(self, value):
+        assert parse_hl7_timestamp(value) is None
+
+    def test_missing_times_follow_the_previous_message(self):
+        times = message_times(_feed("", "20250101120000", "bogus", "20250101120003"))
+        assert [t - times[0] for t in times] == [0, 0, 0, 3]
+
+    def test_feed_without_times_is_rejected(self):
+        with pytest.raises(ValueError, match="MSH-7"):
+            message_times(_feed("", ""))
+
+    def test_timing_file(self, tmp_path):
+        path = tmp_path / "timing.csv"
+        path.write_text("time,control_id\n100.5,1\n\n101,2\n2025-01-01T00:00:00+00:00,3\n")
+        assert load_timing(str(path)) == [100.5, 101.0, 1735689600.0]
+        with pytest.raises(ValueError, match="2 messages"):
+            replay_schedule(["a", "b"], str(path))
+
+
+class TestReplaySchedule:
+    def test_orders_by_arrival_and_applies_speed(self):
+        schedule = ReplaySchedule([10.0, 30.0, 20.0, 20.0], speed=10)
+        assert len(schedule) == 4
+        assert schedule.duration == pytest.approx(2.0)
+        assert list(iter(schedule.take, None)) == [(0.0, 0), (1.0, 2), (1.0, 3), (2.0, 1)]
+
+    def test_due_by_counts_sends_already_taken(self):
+        schedule = ReplaySchedule([10.0, 30.0, 20.0, 20.0], speed=10)
+        schedule.take()
+        assert [schedule.due_by(t) for t in (0.0, 0.5, 1.0, 5.0)] == [1, 1, 3, 4]
+
+    def test_speed_must_be_positive(self):
+        with pytest.raises(ValueError):
+            ReplaySchedule([0.0], speed=0)
+
+
+class TestRunReplay:
+    def test_sends_on_the_captured_schedule(self):
+        # Arrivals over 3 s of capture, replayed 10x faster.
+        messages = _feed("20250101120000", "20250101120001.5", "20250101120001", "20250101120003")
+        server = LoopbackReceiver(echo_control_id=True)
+        records = []
+        try:
+            report = run_replay_sync(messages, "127.0.0.1", server.port, replay_schedule(messages, speed=10),
+                                     generate_message_id=True, on_record=records.append)
+        finally:
+            server.close()
+        assert [r["message_idx"] for r in records] == [1, 3, 2, 4]
+        start = records[0]["intended"]
+        assert [round(r["intended"] - start, 6) for r in records] == [0, 0.1, 0.15, 0.3]
+        assert report["completed"] == 4
+        assert report["p99_send_lag"] < 0.005
+        assert report["max_send_lag"] >= report["p99_send_lag"] >= report["p50_send_lag"] >= 0
+
+    def test_run_send_replays_each_message_once_per_cycle(self, tmp_path):
+        timing = tmp_path / "timing.txt"
+        timing.write_text("0\n0.01\n0.02\n")
+        messages = split_hl7_messages("\n".join(_feed("", "", "")))
+        server = LoopbackReceiver(echo_control_id=True)
+        try:
+            options = SendOptions(host="127.0.0.1", port=server.port, num_cycles=2, replay=True,
+                                  replay_timing=str(timing))
+            results = new_results(len(messages), options)
+            run_send(messages, options, results)
+        finally:
+            server.close()
+        assert results["error_message"] is None
+        assert results["ack_records"].total == 6
+        assert len(results["rate_reports"]) == 2
+
+    def test_run_send_rejects_sharded_replay(self):
+        options = SendOptions(host="unused", port=0, replay=True, processes=2)
+        results = new_results(1, options)
+        run_send(_feed("20250101"), options, results)
+        assert "single process" in results["error_message"]
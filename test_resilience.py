@@ -0,0 +1,177 @@
+import time
+
+import pytest
+
+import metrics
+from mllp import ConnectionPool
+from records import ERROR_STATUS
+from resilience import CircuitBreaker, RetryPolicy
+from runner import SendOptions, new_results, run_send
+from test_mllp import MLLP_END_BLOCK, MLLP_START_BLOCK, LoopbackReceiver, SAMPLE_ACK
+
+MESSAGES = [f"MSH|^~\\&|A|B|C|D|20250101||ADT^A01|{i}|P|2.3\rPID|{i}" for i in range(1, 4)]
+
+
+class FlakyReceiver(LoopbackReceiver):
+    """LoopbackReceiver that hangs up without an ACK on the frames numbered in drop, and NAKs those in nak."""
+
+    def __init__(self, drop=(), nak=()):
+        self.drop = set(drop)
+        self.nak = set(nak)
+        self.control_ids = []
+        super().__init__()
+
+    def _handle(self, conn):
+        buffer = b""
+        with conn:
+            while chunk := conn.recv(4096):
+                buffer += chunk
+                while MLLP_END_BLOCK in buffer:
+                    frame, buffer = buffer.split(MLLP_END_BLOCK, 1)
+                    self.frames += 1
+                    self.control_ids.append(frame.lstrip(MLLP_START_BLOCK).decode().split("|")[9])
+                    if self.frames in self.drop:
+                        return
+                    ack = SAMPLE_ACK.replace("MSA|AA", "MSA|AE") if self.frames in self.nak else SAMPLE_ACK
+                    conn.sendall(MLLP_START_BLOCK + ack.encode() + MLLP_END_BLOCK)
+
+
+def _run(messages, port, **overrides):
+    options = SendOptions(host="127.0.0.1", port=port, timeout=2, retry_backoff=0.001, **overrides)
+    pool = ConnectionPool(timeout=2)
+    results = new_results(len(messages), options, pool)
+    seen = []
+    run_send(messages, options, results, pool=pool, on_record=seen.append)
+    pool.close()
+    return results, seen
+
+
+class TestRetryPolicy:
+    class Upper:
+        def uniform(self, low, high):
+            return high
+
+    @pytest.mark.parametrize("retry, cap", [(1, 0.1), (2, 0.2), (4, 0.8), (10, 5.0)])
+    def test_exponential_backoff_is_capped(self, retry, cap):
+        assert RetryPolicy(3, 0.1, 5.0).delay(retry, self.Upper()) == pytest.approx(cap)
+
+    def test_full_jitter(self):
+        delays = [RetryPolicy(3, 1.0, 1.0).delay(1) for _ in range(200)]
+        assert all(0 <= d <= 1.0 for d in delays) and len(set(delays)) > 100
+
+    def test_nak_retry_is_opt_in(self):
+        assert not RetryPolicy(2).retries_status("AE")
+        assert RetryPolicy(2, retry_naks=True).retries_status("AR")
+        assert not RetryPolicy(2, retry_naks=True).retries_status("AA")
+
+
+class TestCircuitBreaker:
+    def test_opens_probes_and_closes(self):
+        now = [0.0]
+        breaker = CircuitBreaker(threshold=2, reset_seconds=10, clock=lambda: now[0])
+        assert not breaker.failure() and not breaker.is_open
+        assert breaker.failure() and breaker.remaining() == 10
+        now[0] = 10
+        assert breaker.remaining() == 0  # due to probe
+        assert not breaker.failure()  # the probe failed: open for another period
+        assert breaker.remaining() == 10 and breaker.trips == 1
+        breaker.success()
+        assert not breaker.is_open and breaker.failures == 0
+
+    def test_success_resets_the_count(self):
+        breaker = CircuitBreaker(threshold=2)
+        breaker.failure()
+        breaker.success()
+        breaker.failure()
+        assert not breaker.is_open
+
+    def test_disabled(self):
+        breaker = CircuitBreaker(threshold=0)
+        assert not any(breaker.failure() for _ in range(100))
+        assert breaker.remaining() == 0
+
+
+class TestRunSendResilience:
+    def test_connection_error_is_retried_with_the_same_control_id(self):
+        receiver = FlakyReceiver(drop={1})
+        results, seen = _run(MESSAGES[:2], port=receiver.port, retries=2)
+        receiver.close()
+        assert results["error_message"] is None
+        assert [(r.message_idx, r.retry, r.status) for r in seen] == [(1, 0, ERROR_STATUS), (1, 1, "AA"),
+                                                                       (2, 0, "AA")]
+        assert seen[0].message_id == seen[1].message_id == receiver.control_ids[1]
+        log = results["ack_records"]
+        assert (log.total, log.retries, log.errors, log.first_attempts) == (3, 1, 1, 2)
+        # First tries and resends are timed apart; a try without an ACK is not timed at all.
+        assert results["histogram"].total == 1 and results["retry_histogram"].total == 1
+
+    def test_without_retries_the_first_error_still_stops_the_run(self):
+        receiver = FlakyReceiver(drop={1})
+        results, seen = _run(MESSAGES, port=receiver.port)
+        receiver.close()
+        assert results["error_message"].startswith("Cycle 1, Message 1, Attempt 1: Error:")
+        assert seen == []
+
+    def test_exhausted_retries_stop_the_run(self):
+        receiver = FlakyReceiver(drop={1, 2, 3})
+        results, seen = _run(MESSAGES, port=receiver.port, retries=2)
+        receiver.close()
+        assert results["error_message"].endswith("(after 2 retries)")
+        assert [r.retry for r in seen] == [0, 1]
+
+    def test_naks_are_retried_when_asked(self):
+        receiver = FlakyReceiver(nak={1, 3})
+        results, seen = _run(MESSAGES[:2], port=receiver.port, retries=1, retry_naks=True)
+        receiver.close()
+        assert [(r.message_idx, r.retry, r.status) for r in seen] == [(1, 0, "AE"), (1, 1, "AA"), (2, 0, "AE"),
+                                                                       (2, 1, "AA")]
+        assert results["histogram"].total == 2 and results["retry_histogram"].total == 2
+
+    def test_pipelined_batch_is_resent(self):
+        receiver = FlakyReceiver(drop={1})
+        results, seen = _run(MESSAGES, port=receiver.port, window=4, retries=1)
+        receiver.close()
+        assert results["error_message"] is None
+        assert [r.status for r in seen if r.retry == 0] == [ERROR_STATUS] * 3
+        assert sorted(r.message_idx for r in seen if r.retry == 1 and r.status == "AA") == [1, 2, 3]
+
+    def test_continue_on_error(self):
+        results, seen = _run(MESSAGES, port=1, continue_on_error=True)
+        assert results["error_message"] is None
+        assert [r.status for r in seen] == [ERROR_STATUS] * 3
+        assert seen[0].text.startswith("Error:") and results["ack_records"].errors == 3
+        assert results["num_messages"] == 3
+        # Nothing was acknowledged, so nothing counts toward throughput, and nothing was written.
+        assert results["ack_records"].messages == 0 and results["ack_records"].unacked == 3
+        assert results["ack_records"].bytes_sent == 0 and all(r.bytes_sent is None for r in seen)
+
+    @pytest.mark.parametrize("overrides", [{"window": 4}, {"connections": 2}])
+    def test_failed_connects_write_no_bytes_when_pipelined(self, overrides):
+        results, seen = _run(MESSAGES, port=1, continue_on_error=True, **overrides)
+        assert [r.status for r in seen] == [ERROR_STATUS] * 3
+        assert results["ack_records"].bytes_sent == 0
+
+    def test_breaker_holds_off_a_failing_endpoint(self):
+        statuses = []
+        options = SendOptions(host="127.0.0.1", port=1, timeout=1, continue_on_error=True, breaker_threshold=2,
+                              breaker_reset_seconds=0.05)
+        results = new_results(len(MESSAGES), options)
+        start = time.perf_counter()
+        run_send(MESSAGES, options, results, on_status=statuses.append)
+        # Two failures open it; the third try is a probe after the reset, which fails and reopens it.
+        assert time.perf_counter() - start >= 0.05
+        assert results["breaker_trips"] == 1
+        assert any(s.startswith("Circuit open for 127.0.0.1:1") for s in statuses)
+        assert results["ack_records"].errors == 3
+
+    def test_metrics_keep_resends_apart(self):
+        telemetry = metrics.enable()
+        try:
+            receiver = FlakyReceiver(drop={1})
+            _run(MESSAGES[:2], port=receiver.port, retries=1)
+            receiver.close()
+        finally:
+            metrics.disable()
+        assert (telemetry.errors, telemetry.retries, telemetry.acked) == (1, 1, 2)
+        assert telemetry.histograms["ack"].total == 1
+        assert "hl7_retries_total 1" in telemetry.render()
@@ -0,0 +1,81 @@
+import os
+
+import pytest
+
+from mllp import ConnectionPool
+from receiver import ThreadedReceiver
+from resultlog import ResultLog
+from runner import SendOptions, new_results, run_send
+
+MESSAGE = "MSH|^~\\&|A|B|C|D|20250101||ADT^A01|MSG1|P|2.3\rPID|1"
+
+
+@pytest.fixture
+def log(tmp_path):
+    return ResultLog(str(tmp_path / "results.db"))
+
+
+def logged_run(log, options, messages, label="run", pool=None):
+    writer = log.open_run(options, label)
+    results = new_results(len(messages), options, pool)
+    run_send(messages, options, results, pool=pool, on_record=writer.add)
+    writer.finish(results)
+    return writer.run_id, results
+
+
+class TestResultLog:
+    def test_nothing_created_until_used(self, tmp_path):
+        ResultLog(str(tmp_path / "sub" / "results.db"))
+        assert not os.path.exists(tmp_path / "sub")
+
+    def test_logs_attempts_and_summary(self, log):
+        options = SendOptions(host="127.0.0.1", port=0, repeat_count=3, simulate_ack=True)
+        run_id, results = logged_run(log, options, [MESSAGE, MESSAGE])
+        run = log.run(run_id)
+        assert run["status"] == "finished"
+        assert run["attempts"] == 6 and run["failures"] == 0
+        # Simulated ACKs put nothing on the wire.
+        assert run["bytes"] == 0
+        assert run["p99_ms"] >= run["p50_ms"] >= 0
+        attempts = log.attempts(run_id)
+        assert [a["seq"] for a in attempts] == list(range(1, 7))
+        assert [(a["message_idx"], a["attempt"]) for a in attempts[:3]] == [(1, 1), (1, 2), (1, 3)]
+        assert all(a["status"] == "AA" and a["message_id"] for a in attempts)
+        assert all(a["connection_id"] is None for a in attempts)
+
+    def test_flushes_in_batches(self, log, monkeypatch):
+        monkeypatch.setattr("resultlog.FLUSH_EVERY", 4)
+        options = SendOptions(host="127.0.0.1", port=0, repeat_count=10, simulate_ack=True)
+        writer = log.open_run(options)
+        results = new_results(1, options)
+        run_send([MESSAGE], options, results, on_record=writer.add)
+        # 10 attempts: two full batches written, two rows still buffered.
+        assert len(log.attempts(writer.run_id)) == 8
+        assert log.run(writer.run_id)["status"] == "running"
+        writer.finish(results)
+        assert len(log.attempts(writer.run_id)) == 10
+
+    def test_runs_newest_first_and_delete(self, log):
+        options = SendOptions(host="127.0.0.1", port=0, simulate_ack=True)
+        first, _ = logged_run(log, options, [MESSAGE], "first")
+        second, _ = logged_run(log, options, [MESSAGE], "second")
+        assert [r["label"] for r in log.runs()] == ["second", "first"]
+        log.delete_run(first)
+        assert [r["run_id"] for r in log.runs()] == [second]
+        assert log.attempts(first) == []
+
+    def test_pooled_sends_record_connection(self, log):
+        with ThreadedReceiver() as server:
+            options = SendOptions(host="127.0.0.1", port=server.port, repeat_count=3)
+            pool = ConnectionPool()
+            run_id, results = logged_run(log, options, [MESSAGE], pool=pool)
+            pool.close()
+        assert results["error_message"] is None
+        assert {a["connection_id"] for a in log.attempts(run_id)} == {1}
+        assert log.run(run_id)["bytes"] > 3 * len(MESSAGE)
+
+    def test_multi_connection_sends_record_connection_slot(self, log):
+        with ThreadedReceiver() as server:
+            options = SendOptions(host="127.0.0.1", port=server.port, repeat_count=4, connections=2, window=2)
+            run_id, _ = logged_run(log, options, [MESSAGE])
+        assert [a["connection_id"] for a in log.attempts(run_id)] == [1, 2, 1, 2]
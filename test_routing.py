@@ -0,0 +1,147 @@
+import time
+
+import pytest
+
+from hl7 import MessageSource
+from hl7parse import HL7Message
+from loadgen import constant_profile
+from routing import Endpoint, Route, Router, routing_from_config, routing_to_config
+from runner import SendOptions, new_results, run_send
+from test_mllp import LoopbackReceiver
+
+
+def _message(message_type, control_id, application="APP", facility="FAC"):
+    return f"MSH|^~\\&|A|B|{application}|{facility}|20250101||{message_type}|{control_id}|P|2.3\rPID|{control_id}"
+
+
+MIXED = [_message("ADT^A01", 1), _message("ORU^R01", 2), _message("ADT^A08", 3), _message("ORM^O01", 4, "LIS"),
+         _message("ORU^R01", 5)]
+
+
+@pytest.fixture
+def receivers():
+    servers = [LoopbackReceiver(echo_control_id=True) for _ in range(2)]
+    yield servers
+    for server in servers:
+        server.close()
+
+
+class TestRoutes:
+    @pytest.mark.parametrize("route, expected", [
+        (Route("x", message_type="ADT"), [True, False, True, False, False]),
+        (Route("x", message_type="ADT^A0[2-9]"), [False, False, True, False, False]),
+        (Route("x", message_type="OR[MU]^*"), [False, True, False, True, True]),
+        (Route("x", receiving_application="LIS"), [False, False, False, True, False]),
+        (Route("x", message_type="OR?", receiving_facility="FAC"), [False, True, False, True, True]),
+        (Route("x"), [True] * 5),
+    ])
+    def test_matches(self, route, expected):
+        assert [route.matches(HL7Message(m).fields("MSH")) for m in MIXED] == expected
+
+    def test_uses_the_message_component_separator(self):
+        message = "MSH|$~\\&|A|B|LIS$EAST|LAB$1|20250101||ORU$R01|1|P|2.3"
+        router = Router([Endpoint("other", "h", 1), Endpoint("lab", "h", 2)],
+                        [Route("lab", message_type="ORU^R01", receiving_application="LIS",
+                               receiving_facility="LAB"), Route("other")])
+        assert router.route(message) == 1
+
+    def test_first_matching_route_wins(self):
+        router = Router([Endpoint("adt", "h", 1), Endpoint("rest", "h", 2)],
+                        [Route("adt", message_type="ADT"), Route("rest")])
+        assert [router.route(m) for m in MIXED] == [0, 1, 0, 1, 1]
+
+    def test_invalid_routing(self):
+        with pytest.raises(ValueError, match="unknown endpoint"):
+            Router([Endpoint("a", "h", 1)], [Route("b")])
+        with pytest.raises(ValueError, match="unique"):
+            Router([Endpoint("a", "h", 1), Endpoint("a", "h", 2)], [])
+
+    def test_single_endpoint_needs_no_routes(self):
+        assert Router([Endpoint("only", "h", 1)], []).route(MIXED[0]) == 0
+
+    def test_config_round_trip(self):
+        endpoints = (Endpoint("adt", "adt-host", 2575, 50.0), Endpoint("lab", "lab-host", 2576))
+        routes = (Route("adt", message_type="ADT"), Route("lab", receiving_facility="LAB*"))
+        assert routing_from_config(routing_to_config(endpoints, routes)) == (endpoints, routes)
+        assert routing_from_config({"HOST": "h", "PORT": 1}) == ((), ())
+
+
+class TestRunRouted:
+    def test_routes_to_endpoints_in_parallel(self, receivers):
+        adt, rest = receivers
+        options = SendOptions(host="unused", port=0, repeat_count=2,
+                              endpoints=(Endpoint("adt", "127.0.0.1", adt.port),
+                                         Endpoint("rest", "127.0.0.1", rest.port)),
+                              routes=(Route("adt", message_type="ADT"), Route("rest")))
+        results = new_results(len(MIXED), options)
+        seen = []
+        run_send(MIXED, options, results, on_record=seen.append)
+        assert results["error_message"] is None
+        assert (adt.frames, rest.frames) == (4, 6)
+        assert sorted(r.message_idx for r in seen) == [1, 1, 2, 2, 3, 3, 4, 4, 5, 5]
+        assert results["ack_records"].total == 10
+        assert results["histogram"].total == 10
+        totals = {name: r["ack_records"].total for name, r in results["endpoints"].items()}
+        assert totals == {"adt": 4, "rest": 6}
+
+    def test_lazy_source_and_pipelined_endpoints(self, receivers):
+        source = MessageSource.from_buffer("\r".join(MIXED).encode())
+        options = SendOptions(host="unused", port=0, window=4,
+                              endpoints=tuple(Endpoint(f"e{i}", "127.0.0.1", r.port) for i, r in enumerate(receivers)),
+                              routes=(Route("e0", message_type="ORU"), Route("e1")))
+        results = new_results(None, options)
+        seen = []
+        run_send(source, options, results, on_record=seen.append)
+        assert results["error_message"] is None
+        assert [r.frames for r in receivers] == [2, 3]
+        assert {r.message_idx: r.message_id for r in seen}.keys() == {1, 2, 3, 4, 5}
+
+    def test_unrouted_message_fails_before_sending(self, receivers):
+        options = SendOptions(host="unused", port=0, endpoints=(Endpoint("adt", "127.0.0.1", receivers[0].port),),
+                              routes=(Route("adt", message_type="ADT"),))
+        results = new_results(len(MIXED), options)
+        run_send(MIXED, options, results)
+        assert results["error_message"] == "Error: message 2 (ORU^R01) matches no route"
+        assert receivers[0].frames == 0
+
+    def test_endpoint_error_is_named(self, receivers):
+        options = SendOptions(host="unused", port=0, timeout=1,
+                              endpoints=(Endpoint("up", "127.0.0.1", receivers[0].port),
+                                         Endpoint("down", "127.0.0.1", 1)),
+                              routes=(Route("down", message_type="ORU"), Route("up")))
+        results = new_results(len(MIXED), options)
+        run_send(MIXED, options, results)
+        assert results["error_message"].startswith("Endpoint down: Cycle 1, Message 1")
+        assert not results["cancelled"]
+
+    def test_endpoint_rate_limit(self, receivers):
+        options = SendOptions(host="unused", port=0, repeat_count=4,
+                              endpoints=(Endpoint("slow", "127.0.0.1", receivers[0].port, max_rate=50),))
+        results = new_results(len(MIXED), options)
+        start = time.perf_counter()
+        run_send(MIXED[:3], options, results)
+        # 12 attempts at 50/s: the last is due 11 slots (0.22 s) after the first.
+        assert time.perf_counter() - start >= 0.2
+        assert results["ack_records"].total == 12
+
+    def test_rate_limited_parallel_endpoint_keeps_its_connections(self, receivers):
+        options = SendOptions(host="unused", port=0, repeat_count=4, connections=2, use_pool=False,
+                              endpoints=(Endpoint("slow", "127.0.0.1", receivers[0].port, max_rate=40),))
+        results = new_results(len(MIXED), options)
+        run_send(MIXED[:5], options, results)
+        # 20 attempts in batches of 4 (a tenth of a second's worth) over the same two connections.
+        assert results["error_message"] is None and results["ack_records"].total == 20
+        assert receivers[0].connections == 2
+        assert results["connects"] == results["endpoints"]["slow"]["connects"] == 2
+
+    def test_open_loop_rate_is_shared_by_routed_messages(self, receivers):
+        adt, rest = receivers
+        options = SendOptions(host="unused", port=0, rate_profile=constant_profile(100), load_seconds=0.4,
+                              endpoints=(Endpoint("adt", "127.0.0.1", adt.port),
+                                         Endpoint("rest", "127.0.0.1", rest.port)),
+                              routes=(Route("adt", message_type="ADT"), Route("rest")))
+        results = new_results(len(MIXED), options)
+        run_send(MIXED, options, results)
+        assert results["error_message"] is None
+        # 100/s in total: 2 of 5 messages are ADT, so that endpoint offers 40/s and the other 60/s.
+        assert (adt.frames, rest.frames) == (16, 24)
@@ -0,0 +1,113 @@
+import pytest
+
+from hl7 import MessageSource
+from loadgen import constant_profile
+from mllp import ConnectionPool, ack_control_id
+from receiver import ThreadedReceiver
+from runner import SendOptions, new_results, run_send
+
+TWO_MESSAGES = b"MSH|^~\\&|A|B|C|D|20250101||ADT^A01|1|P|2.3\rPID|1\rMSH|^~\\&|A|B|C|D|20250101||ADT^A03|2|P|2.3\rPID|2\r"
+
+
+class TestRunSend:
+    def test_lazy_source_counts_messages_and_repeats_per_cycle(self):
+        options = SendOptions(host="unused", port=0, repeat_count=2, num_cycles=2, simulate_ack=True)
+        results = new_results(None, options)
+        run_send(MessageSource.from_buffer(TWO_MESSAGES), options, results)
+        assert results["num_messages"] == 2
+        assert len(results["ack_records"]) == 8
+        assert [h.total for h in results["cycle_histograms"]] == [4, 4]
+
+    def test_should_stop_cancels(self):
+        options = SendOptions(host="unused", port=0, repeat_count=5, simulate_ack=True)
+        results = new_results(2, options)
+        seen = []
+        run_send(["MSH|A", "MSH|B"], options, results, on_record=seen.append,
+                 should_stop=lambda: len(seen) >= 3)
+        assert results["cancelled"]
+        assert len(seen) == 3
+        assert results["batch_end_time"] is not None
+
+    def test_stop_and_wait_records_phases(self):
+        with ThreadedReceiver() as receiver:
+            options = SendOptions(host="localhost", port=receiver.port, repeat_count=3)
+            pool = ConnectionPool(timeout=2)
+            results = new_results(1, options, pool)
+            run_send(["MSH|^~\\&|A|B|C|D|20250101||ADT^A01|1|P|2.3"], options, results, pool=pool)
+            pool.close()
+        phases = results["phase_histograms"]
+        assert [h.total for h in phases.values()] == [3, 3, 3, 3]
+        # Reused connections and the cached address contribute zeros after the first attempt.
+        assert phases["dns"].percentile(50) == 0 and phases["dns"].max > 0
+        records = list(results["ack_records"])
+        assert records[0].phases[1] > 0 and records[1].phases[:2] == (0.0, 0.0)
+
+    @pytest.mark.parametrize("window", [1, 4])
+    def test_batch_mode_counts_messages_and_bytes(self, window):
+        messages = [f"MSH|^~\\&|A|B|C|D|20250101||ADT^A01|{i}|P|2.3\rPID|{i}" for i in range(1, 8)]
+        with ThreadedReceiver() as receiver:
+            options = SendOptions(host="127.0.0.1", port=receiver.port, window=window, batch_size=3, repeat_count=2)
+            results = new_results(len(messages), options)
+            seen = []
+            run_send(messages, options, results, pool=ConnectionPool(), on_record=seen.append)
+            frames = receiver.stats.frames
+        assert results["error_message"] is None
+        log = results["ack_records"]
+        assert frames == log.total == 6 and results["num_messages"] == 3
+        assert [r.messages for r in seen] == [3, 3, 3, 3, 1, 1]
+        assert log.messages == 14 and log.bytes_sent == sum(r.bytes_sent for r in seen)
+        # One ACK per batch, naming the batch control ID.
+        assert all(r.status == "AA" and ack_control_id(r.ack) == r.message_id for r in seen)
+
+    def test_parallel_connections_persist_across_batches(self, monkeypatch):
+        monkeypatch.setattr("runner.PIPELINE_BATCH", 2)
+        with ThreadedReceiver() as receiver:
+            options = SendOptions(host="127.0.0.1", port=receiver.port, connections=2, window=2)
+            results = new_results(None, options)
+            run_send(MessageSource.from_buffer(TWO_MESSAGES * 5), options, results)
+        assert results["error_message"] is None and len(results["ack_records"]) == 10
+        assert receiver.stats.connections == 2
+
+    def test_batch_mode_streams_lazy_sources(self):
+        options = SendOptions(host="unused", port=0, batch_size=2, simulate_ack=True)
+        results = new_results(None, options)
+        run_send(MessageSource.from_buffer(TWO_MESSAGES * 3), options, results)
+        assert results["num_messages"] == 3 and results["ack_records"].messages == 6
+
+    def test_batch_mode_rejects_templates(self):
+        options = SendOptions(host="unused", port=0, batch_size=2, templated=True)
+        results = new_results(1, options)
+        run_send(["MSH|A"], options, results)
+        assert results["error_message"].startswith("Error: batch mode")
+
+    @pytest.mark.parametrize("connections", [1, 2])
+    def test_pipelined_acks_are_parsed_once(self, connections, monkeypatch):
+        reparsed = []
+        monkeypatch.setattr("records.parse_ack", reparsed.append)
+        with ThreadedReceiver() as receiver:
+            options = SendOptions(host="127.0.0.1", port=receiver.port, window=4, connections=connections)
+            results = new_results(3, options)
+            run_send(["MSH|^~\\&|A|B|C|D|20250101||ADT^A01|1|P|2.3"] * 3, options, results)
+        assert results["ack_records"].status_counts == {"AA": 3}
+        assert reparsed == []
+
+    def test_pipelined_and_simulated_sends_have_no_phases(self):
+        with ThreadedReceiver() as receiver:
+            options = SendOptions(host="127.0.0.1", port=receiver.port, window=4)
+            results = new_results(2, options)
+            run_send(["MSH|^~\\&|A|B|C|D|20250101||ADT^A01|1|P|2.3"] * 2, options, results)
+        assert results["error_message"] is None
+        assert all(h.total == 0 for h in results["phase_histograms"].values())
+        assert results["ack_records"][0].phases is None
+
+    def test_open_loop_records_carry_their_send_time(self):
+        with ThreadedReceiver() as receiver:
+            options = SendOptions(host="127.0.0.1", port=receiver.port, rate_profile=constant_profile(100),
+                                  load_seconds=0.5)
+            results = new_results(1, options)
+            run_send(["MSH|^~\\&|A|B|C|D|20250101||ADT^A01|1|P|2.3"], options, results)
+        assert results["error_message"] is None
+        timestamps = [r.timestamp for r in results["ack_records"]]
+        assert len(timestamps) == 50
+        # Due 10 ms apart, so the first and last sends are about 0.49 s apart.
+        assert timestamps[-1] - timestamps[0] == pytest.approx(0.49, abs=0.05)
@@ -0,0 +1,158 @@
+import json
+import subprocess
+import sys
+
+import pytest
+
+from sender import EXIT_NAK_THRESHOLD, EXIT_OK, EXIT_SEND_ERROR, iter_input_files, load_messages, main
+from test_mllp import LoopbackReceiver, SAMPLE_ACK
+
+TWO_MESSAGES = (
+    "MSH|^~\\&|A|B|C|D|20250101||ADT^A01|1|P|2.3\nPID|1\n"
+    "MSH|^~\\&|A|B|C|D|20250101||ADT^A03|2|P|2.3\nPID|2\n"
+)
+
+
+class NakReceiver(LoopbackReceiver):
+    """LoopbackReceiver that rejects every frame."""
+
+    def _ack_for(self, frame):
+        return SAMPLE_ACK.replace("MSA|AA", "MSA|AR")
+
+
+@pytest.fixture
+def receiver():
+    server = LoopbackReceiver()
+    yield server
+    server.close()
+
+
+@pytest.fixture
+def hl7_dir(tmp_path):
+    (tmp_path / "a.hl7").write_text(TWO_MESSAGES)
+    (tmp_path / "nested").mkdir()
+    (tmp_path / "nested" / "b.txt").write_text(TWO_MESSAGES)
+    (tmp_path / "notes.md").write_text("ignored")
+    return tmp_path
+
+
+class TestInputs:
+    def test_directories_expand_to_hl7_files(self, hl7_dir):
+        files = list(iter_input_files([str(hl7_dir)]))
+        assert [f.rsplit("/", 1)[-1] for f in files] == ["a.hl7", "b.txt"]
+        assert len(list(load_messages([str(hl7_dir)]))) == 4
+
+    def test_defaults_to_sample_message(self):
+        assert len(load_messages([])) == 1
+
+
+class TestMain:
+    def test_streams_jsonl_results(self, hl7_dir, tmp_path, receiver):
+        out = tmp_path / "results.jsonl"
+        code = main([str(hl7_dir / "a.hl7"), "--host", "127.0.0.1", "--port", str(receiver.port),
+                     "--repeat", "2", "-o", str(out)])
+        rows = [json.loads(line) for line in out.read_text().splitlines()]
+        assert code == EXIT_OK
+        assert len(rows) == 4
+        assert {row["status"] for row in rows} == {"AA"}
+
+    def test_csv_output_with_connections(self, hl7_dir, tmp_path, receiver):
+        out = tmp_path / "results.csv"
+        code = main([str(hl7_dir), "--host", "127.0.0.1", "--port", str(receiver.port),
+                     "-c", "2", "--format", "csv", "-o", str(out)])
+        lines = out.read_text().splitlines()
+        assert code == EXIT_OK
+        assert lines[0].startswith("cycle,message_idx")
+        assert len(lines) == 5
+
+    def test_nak_threshold_exit_code(self, tmp_path):
+        server = NakReceiver()
+        try:
+            code = main(["--host", "127.0.0.1", "--port", str(server.port), "--max-nak-rate", "0.5",
+                         "-o", str(tmp_path / "out.jsonl")])
+        finally:
+            server.close()
+        assert code == EXIT_NAK_THRESHOLD
+
+    def test_send_error_exit_code(self, tmp_path):
+        code = main(["--host", "127.0.0.1", "--port", "1", "--timeout", "1", "-o", str(tmp_path / "out.jsonl")])
+        assert code == EXIT_SEND_ERROR
+
+    def test_continue_on_error_counts_errors_as_naks(self, tmp_path, capsys):
+        code = main(["--host", "127.0.0.1", "--port", "1", "--timeout", "1", "--retries", "1", "--retry-backoff", "0",
+                     "--continue-on-error", "--max-nak-rate", "0.5", "-o", str(tmp_path / "out.jsonl")])
+        assert code == EXIT_NAK_THRESHOLD
+        rows = [json.loads(line) for line in (tmp_path / "out.jsonl").read_text().splitlines()]
+        assert [(row["retry"], row["status"]) for row in rows] == [(0, "ERROR"), (1, "ERROR")]
+        assert "retries=1 errors=2 breaker_trips=0" in capsys.readouterr().err
+        with pytest.raises(SystemExit):
+            main(["--simulate", "--retries", "-1"])
+
+    def test_batch_size_reports_bytes(self, hl7_dir, tmp_path, receiver, capsys):
+        code = main([str(hl7_dir), "--host", "127.0.0.1", "--port", str(receiver.port), "--batch-size", "3",
+                     "-o", str(tmp_path / "out.jsonl")])
+        assert code == EXIT_OK
+        assert len((tmp_path / "out.jsonl").read_text().splitlines()) == 2
+        summary = capsys.readouterr().err
+        assert "bytes_per_sec=" in summary and "bytes_per_msg=" in summary
+        with pytest.raises(SystemExit):
+            main(["--simulate", "--batch-size", "2", "--template"])
+
+    def test_rate_requires_duration(self):
+        with pytest.raises(SystemExit):
+            main(["--simulate", "--rate", "10"])
+
+    def test_duration_requires_rate_or_interval(self, capsys):
+        with pytest.raises(SystemExit):
+            main(["--simulate", "--duration", "5"])
+        assert "--duration requires --rate or a positive --interval" in capsys.readouterr().err
+
+    def test_replay_options(self, hl7_dir, tmp_path, receiver):
+        with pytest.raises(SystemExit):
+            main(["--simulate", "--replay", "--rate", "10", "--duration", "1"])
+        with pytest.raises(SystemExit):
+            main(["--simulate", "--timing", str(tmp_path / "timing.txt")])
+        code = main([str(hl7_dir / "a.hl7"), "--host", "127.0.0.1", "--port", str(receiver.port), "--replay",
+                     "--speed", "100", "-o", str(tmp_path / "out.jsonl")])
+        assert code == EXIT_OK
+        assert len((tmp_path / "out.jsonl").read_text().splitlines()) == 2
+
+    def test_routes_config(self, hl7_dir, tmp_path, receiver):
+        config = tmp_path / "routes.json"
+        config.write_text(json.dumps({
+            "ENDPOINTS": [{"name": "a01", "host": "127.0.0.1", "port": receiver.port},
+                          {"name": "rest", "host": "127.0.0.1", "port": receiver.port, "max_rate": 100}],
+            "ROUTES": [{"endpoint": "a01", "message_type": "ADT^A01"}, {"endpoint": "rest"}]}))
+        code = main([str(hl7_dir / "a.hl7"), "--routes", str(config), "-o", str(tmp_path / "out.jsonl")])
+        assert code == EXIT_OK
+        assert sorted(json.loads(line)["message_idx"] for line in (tmp_path / "out.jsonl").read_text().splitlines()) \
+            == [1, 2]
+        config.write_text(json.dumps({"ROUTES": [{"endpoint": "missing"}]}))
+        with pytest.raises(SystemExit):
+            main(["--simulate", "--routes", str(config)])
+
+    def test_template_placeholders(self, tmp_path):
+        (tmp_path / "t.hl7").write_text("MSH|^~\\&|A|B|C|D|20250101||ADT^A01|T{{seq}}|P|2.3\nPID|1\n")
+        out = tmp_path / "out.jsonl"
+        code = main([str(tmp_path / "t.hl7"), "--simulate", "--template", "--keep-message-id", "--repeat", "3",
+                     "-o", str(out)])
+        assert code == EXIT_OK
+        assert len(out.read_text().splitlines()) == 3
+
+    def test_invalid_template_rejected(self, tmp_path):
+        (tmp_path / "t.hl7").write_text("MSH|^~\\&|A|B|C|D|20250101||ADT^A01|{{bogus}}|P|2.3\n")
+        with pytest.raises(SystemExit):
+            main([str(tmp_path / "t.hl7"), "--simulate", "--template"])
+
+    def test_invalid_template_in_a_later_message_rejected_before_sending(self, tmp_path):
+        (tmp_path / "t.hl7").write_text("MSH|^~\\&|A|B|C|D|20250101||ADT^A01|{{seq}}|P|2.3\n"
+                                        "MSH|^~\\&|A|B|C|D|20250101||ADT^A01|{{bogus}}|P|2.3\n")
+        out = tmp_path / "out.jsonl"
+        with pytest.raises(SystemExit):
+            main([str(tmp_path / "t.hl7"), "--simulate", "--template", "-o", str(out)])
+        assert not out.exists()
+
+    def test_startup_skips_streamlit_and_pandas(self):
+        probe = "import sys, sender; print('streamlit' in sys.modules or 'pandas' in sys.modules)"
+        out = subprocess.run([sys.executable, "-c", probe], capture_output=True, text=True, check=True)
+        assert out.stdout.strip() == "False"
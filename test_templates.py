@@ -0,0 +1,97 @@
+import re
+
+import pytest
+
+from hl7 import MessageSource, parse_ack_status
+from runner import SendOptions, new_results, run_send
+from templates import MessageTemplate, check_templates
+
+TEMPLATE = ("MSH|^~\\&|SND|FAC|RCV|FAC|{{now}}||ADT^A01|CTL{{seq:4}}|P|2.5\r"
+            "PID|1||{{random:8}}^^^HOSP^MR||{{faker:name}}||19800101|M\r"
+            "PV1|1|I|||||||||||||||||V{{seq}}")
+
+
+def fields(text, segment, index):
+    line = next(s for s in text.split("\r") if s.startswith(segment))
+    return line.split("|")[index]
+
+
+class TestMessageTemplate:
+    def test_renders_fresh_variants(self):
+        template = MessageTemplate(TEMPLATE, seed=1)
+        first, second = template.render(), template.render()
+        assert fields(first, "MSH", 9) == "CTL0001"
+        assert fields(second, "MSH", 9) == "CTL0002"
+        assert fields(first, "PV1", 19) == "V1"
+        assert re.fullmatch(r"\d{14}", fields(first, "MSH", 6))
+        assert re.fullmatch(r"\d{8}\^\^\^HOSP\^MR", fields(first, "PID", 3))
+        assert re.fullmatch(r"[A-Z]+\^[A-Z]+", fields(first, "PID", 5))
+        assert "{{" not in first
+
+    def test_message_id_overrides_templated_control_id(self):
+        template = MessageTemplate(TEMPLATE)
+        text = template.render("abc123")
+        assert fields(text, "MSH", 9) == "abc123"
+        assert fields(text, "PV1", 19) == "V1"
+
+    def test_buffers_are_a_framed_message(self):
+        buffers = MessageTemplate("MSH|^~\\&|A|B|C|D|{{now:%Y}}||ADT^A01|{{uuid}}|P|2.3").buffers()
+        assert buffers[0] == b"\x0b" and buffers[-1] == b"\x1c\r"
+        text = b"".join(buffers[1:-1]).decode()
+        assert re.fullmatch(r"[0-9a-f]{32}", fields(text, "MSH", 9))
+        assert re.fullmatch(r"\d{4}", fields(text, "MSH", 6))
+
+    def test_literal_message_renders_unchanged(self):
+        message = "MSH|^~\\&|A|B|C|D|20250101||ADT^A01|MSG1|P|2.3\rPID|1"
+        assert MessageTemplate(message).render() == message
+
+    def test_short_msh_gets_control_id(self):
+        assert fields(MessageTemplate("MSH|^~\\&|A").render("id9"), "MSH", 9) == "id9"
+        assert MessageTemplate("MSH|^~\\&|{{seq}}").render() == "MSH|^~\\&|1"
+
+    def test_faker_name_uses_the_message_component_separator(self):
+        text = MessageTemplate("MSH#$~\\&#A#B#C#D#1##ADT$A01#1#P#2.3\rPID#1###{{faker:name}}").render()
+        assert re.fullmatch(r"[A-Z]+\$[A-Z]+", text.split("\r")[1].split("#")[4])
+
+    def test_same_seed_same_randoms(self):
+        one = MessageTemplate("PID|1||{{random:10}}", seed=7)
+        two = MessageTemplate("PID|1||{{random:10}}", seed=7)
+        assert [one.render() for _ in range(3)] == [two.render() for _ in range(3)]
+
+    @pytest.mark.parametrize("text", ["PID|{{nope}}", "PID|{{faker}}", "PID|{{faker:not_a_provider_xyz}}"])
+    def test_invalid_placeholders_rejected(self, text):
+        with pytest.raises(ValueError):
+            MessageTemplate(text)
+
+    def test_check_templates_covers_every_message(self):
+        check_templates(["PID|{{seq}}", "PID|{{uuid}}|{{seq}}"])
+        with pytest.raises(ValueError, match="message 3: .*nope"):
+            check_templates(["PID|{{seq}}", "PID|{{seq}}", "PID|{{nope}}"])
+        with pytest.raises(ValueError, match="message 2"):
+            check_templates(["PID|{{seq:4}}", "PID|{{seq:x}}"])
+
+
+class TestTemplatedRuns:
+    def test_every_repeat_and_cycle_renders_a_new_variant(self):
+        options = SendOptions(host="unused", port=0, repeat_count=3, num_cycles=2, simulate_ack=True,
+                              generate_message_id=False, templated=True)
+        results = new_results(1, options)
+        seen = []
+        run_send(["MSH|^~\\&|A|B|C|D|20250101||ADT^A01|N{{seq}}|P|2.3\rPID|1"], options, results,
+                 on_record=seen.append)
+        assert [r.message_id for r in seen] == [None] * 6
+        assert results["ack_records"].status_counts == {"AA": 6}
+        # Simulated ACKs echo the rendered MSH-10 in MSA-2.
+        assert [r.ack.split("MSA|AA|")[1].split("\r")[0] for r in seen] == [f"N{i}" for i in range(1, 7)]
+        assert all(parse_ack_status(r.ack) == "AA" for r in seen)
+
+    def test_lazy_source_counters_run_across_cycles(self):
+        options = SendOptions(host="unused", port=0, repeat_count=2, num_cycles=2, simulate_ack=True,
+                              generate_message_id=False, templated=True)
+        results = new_results(None, options)
+        seen = []
+        source = MessageSource.from_buffer(b"MSH|^~\\&|A|B|C|D|1||ADT^A01|A{{seq}}|P|2.3\r"
+                                           b"MSH|^~\\&|A|B|C|D|1||ADT^A01|B{{seq}}|P|2.3\r")
+        run_send(source, options, results, on_record=seen.append)
+        ids = [r.ack.split("MSA|AA|")[1].split("\r")[0] for r in seen]
+        assert ids == ["A1", "A2", "B1", "B2", "A3", "A4", "B3", "B4"]
@@ -0,0 +1,101 @@
+import pickle
+
+import pytest
+
+from hl7 import MessageSource
+from loadgen import ramp_profile
+from receiver import ThreadedReceiver
+from runner import SendOptions, new_results, run_send
+from workers import shard_messages, worker_options
+
+MESSAGES = [f"MSH|^~\\&|A|B|C|D|20250101||ADT^A01|{i}|P|2.3\rPID|{i}" for i in range(1, 11)]
+
+
+@pytest.fixture(scope="module")
+def server():
+    with ThreadedReceiver() as receiver:
+        yield receiver
+
+
+class TestSharding:
+    def test_list_is_dealt_round_robin(self):
+        assert shard_messages(list(range(7)), 3) == [[0, 3, 6], [1, 4], [2, 5]]
+
+    def test_lazy_source_shards_are_reiterable_and_picklable(self):
+        source = MessageSource.from_buffer("\r".join(MESSAGES).encode())
+        shards = shard_messages(source, 3)
+        assert [len(list(shard)) for shard in shards] == [4, 3, 3]
+        assert list(pickle.loads(pickle.dumps(shards[1]))) == list(shards[1])
+
+    def test_worker_options_split_the_rate(self):
+        options = SendOptions(host="h", port=1, processes=4, load_seconds=10,
+                              rate_profile=ramp_profile(0, 400, 10))
+        profile = pickle.loads(pickle.dumps(worker_options(options, 4).rate_profile))
+        assert worker_options(options, 4).processes == 1
+        assert profile(0) == 0
+        assert profile(5) == pytest.approx(50)
+        assert profile(60) == pytest.approx(100)
+
+
+class TestRunMultiprocess:
+    def test_simulated_run_merges_workers(self):
+        options = SendOptions(host="unused", port=0, processes=3, repeat_count=2, num_cycles=2,
+                              simulate_ack=True)
+        results = new_results(len(MESSAGES), options)
+        seen = []
+        run_send(MESSAGES, options, results, on_record=seen.append)
+        assert results["error_message"] is None
+        assert results["ack_records"].total == 40
+        assert results["histogram"].total == 40
+        assert [h.total for h in results["cycle_histograms"]] == [20, 20]
+        assert results["num_messages"] == 10
+        assert sorted({r.message_idx for r in seen}) == list(range(1, 11))
+        assert results["ack_records"].last_ack.startswith("MSH")
+
+    def test_batches_keep_their_shard_numbers(self):
+        options = SendOptions(host="unused", port=0, processes=2, batch_size=2, simulate_ack=True)
+        results = new_results(len(MESSAGES), options)
+        seen = []
+        run_send(MESSAGES, options, results, on_record=seen.append)
+        assert results["error_message"] is None
+        # Each worker packs its 5 messages into batches 1-3; batch numbers are not message numbers.
+        assert sorted(r.message_idx for r in seen) == [1, 1, 2, 2, 3, 3]
+        assert results["ack_records"].messages == 10
+
+    def test_pipelined_against_receiver(self, server):
+        options = SendOptions(host="127.0.0.1", port=server.port, processes=2, window=4, connections=2)
+        results = new_results(None, options)
+        seen = []
+        statuses = []
+        run_send(MessageSource.from_buffer("\r".join(MESSAGES).encode()), options, results,
+                 on_record=seen.append, on_status=statuses.append)
+        assert results["error_message"] is None
+        assert results["ack_records"].status_counts == {"AA": 10}
+        assert {r.connection_id for r in seen} == {1, 2, 3, 4}
+        assert statuses[-1].startswith("2 workers: 10 sent")
+
+    def test_stop_and_wait_phases_are_merged(self, server):
+        options = SendOptions(host="127.0.0.1", port=server.port, processes=2)
+        results = new_results(len(MESSAGES), options)
+        seen = []
+        run_send(MESSAGES, options, results, on_record=seen.append)
+        assert results["error_message"] is None
+        assert [h.total for h in results["phase_histograms"].values()] == [10] * 4
+        assert all(len(r.phases) == 4 for r in seen)
+
+    def test_error_stops_run(self):
+        options = SendOptions(host="127.0.0.1", port=1, processes=2, timeout=1)
+        results = new_results(len(MESSAGES), options)
+        run_send(MESSAGES, options, results)
+        assert results["error_message"].startswith("Worker ")
+        assert not results["cancelled"]
+        assert results["batch_end_time"] is not None
+
+    def test_should_stop_cancels_workers(self):
+        options = SendOptions(host="unused", port=0, processes=2, num_cycles=2, interval_seconds=30,
+                              simulate_ack=True)
+        results = new_results(len(MESSAGES), options)
+        run_send(MESSAGES, options, results, should_stop=lambda: results["ack_records"].total >= 10)
+        assert results["cancelled"]
+        assert results["ack_records"].total == 10
+        assert results["batch_end_time"] - results["batch_start_time"] < 15
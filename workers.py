@@ -0,0 +1,297 @@
+"""
+Multi-process sending, so one load-generator box can use more than one core.
+
+A single process tops out on CPU (framing, template rendering, ACK parsing) long before a clustered
+interface engine does. run_multiprocess deals message i of the stream to worker i % processes; each
+worker is a spawned process running runner.run_send on its shard with its own connections and
+latency histograms. Workers stream their records and histogram snapshots back over a queue, and the
+coordinator merges them into one results dict (the runner.new_results shape) while the run goes, so
+totals, throughput and percentiles are live for the UI and CLI just as in a single-process run.
+
+Lazy sources are not split up front: every worker reads the whole stream and keeps its own share,
+which costs a little parsing per worker but keeps memory flat for any input size.
+"""
+import dataclasses
+import itertools
+import multiprocessing
+import queue
+import time
+
+from histogram import LatencyHistogram
+import metrics
+from mllp import ConnectionPool
+from records import AckRecord
+from runner import SendOptions, new_results, record_phases, record_retry, run_send
+
+# A worker sends a report after this many records or this many seconds, whichever comes first.
+REPORT_EVERY = 500
+REPORT_INTERVAL = 0.25
+# Resolution of the open-loop rate profile handed to workers.
+PROFILE_STEP = 0.1
+
+
+class _Shard:
+    """Every count-th message of a re-iterable source, starting at index; picklable when the source is."""
+
+    def __init__(self, source, index: int, count: int):
+        self.source = source
+        self.index = index
+        self.count = count
+
+    def __iter__(self):
+        return itertools.islice(self.source, self.index, None, self.count)
+
+
+class SampledProfile:
+    """
+    A rate profile tabulated every PROFILE_STEP seconds. Profiles are usually closures, which cannot
+    be pickled into a spawned process or sent to an agent; the table can.
+    """
+
+    def __init__(self, rates):
+        self.rates = list(rates)
+
+    @classmethod
+    def sample(cls, profile, seconds: float, scale=1.0):
+        """Tabulate profile over seconds, scaled (e.g. to one worker's share of the rate)."""
+        return cls(profile(i * PROFILE_STEP) * scale for i in range(int(seconds / PROFILE_STEP) + 1))
+
+    def __call__(self, t: float):
+        return self.rates[min(int(t / PROFILE_STEP), len(self.rates) - 1)]
+
+
+def shard_messages(messages, processes: int):
+    """Split messages into processes interleaved shards: lists are sliced, lazy sources wrapped."""
+    if isinstance(messages, list):
+        return [messages[index::processes] for index in range(processes)]
+    return [_Shard(messages, index, processes) for index in range(processes)]
+
+
+def shard_options(options: SendOptions, shards: int, **changes):
+    """The options one of shards workers runs with: its share of any open-loop rate, plus changes."""
+    profile = options.rate_profile
+    if profile is not None:
+        profile = SampledProfile.sample(profile, options.load_seconds, 1 / shards)
+    return dataclasses.replace(options, rate_profile=profile, **changes)
+
+
+def worker_options(options: SendOptions, processes: int):
+    """The options each worker process runs with: single-process, with its share of any open-loop rate."""
+    return shard_options(options, processes, processes=1)
+
+
+SUMMARY_KEYS = ("error_message", "cancelled", "num_messages", "connects", "rate_reports", "breaker_trips")
+
+
+class Reporter:
+    """
+    Shard side: batches records into reports, each with a snapshot of the histograms, and put()s them
+    on reports (a queue, or anything with a put method). With telemetry (a metrics.SendMetrics) each
+    report also carries the wire-level counts gathered since the last one.
+    """
+
+    def __init__(self, index: int, reports, results, telemetry=None):
+        self.index = index
+        self.reports = reports
+        self.results = results
+        self.telemetry = telemetry
+        self.rows = []
+        self.last_report = time.perf_counter()
+
+    def add(self, record):
+        # ACK bodies are only kept by the coordinator for failures and the latest ACK, so AAs travel without one.
+        self.rows.append((record.cycle, record.message_idx, record.attempt, record.message_id, record.status,
+                          record.error_code, record.text, record.duration, record.timestamp, record.bytes_sent,
+                          record.connection_id, record.phases, record.retry, record.messages,
+                          record.ack if record.status != "AA" else None))
+        if len(self.rows) >= REPORT_EVERY or time.perf_counter() - self.last_report >= REPORT_INTERVAL:
+            self.report()
+
+    def report(self, summary=None):
+        if self.rows and self.rows[-1][-1] is None:
+            self.rows[-1] = self.rows[-1][:-1] + (self.results["ack_records"].last_ack,)
+        transport = self.telemetry.take_transport() if self.telemetry is not None else None
+        self.reports.put((self.index, self.rows, self.results["histogram"].copy(),
+                          [h.copy() for h in self.results["cycle_histograms"]], summary, transport))
+        self.rows = []
+        self.last_report = time.perf_counter()
+
+
+def _worker(index: int, shard, options: SendOptions, reports, stop, instrumented=False):
+    # A spawned process starts with instrumentation off; its wire-level counts travel with its reports.
+    telemetry = metrics.enable() if instrumented else None
+    pool = ConnectionPool(timeout=options.timeout)
+    results = new_results(len(shard) if isinstance(shard, list) else None, options, pool)
+    reporter = Reporter(index, reports, results, telemetry)
+    try:
+        # Report at the end of every cycle too, so nothing sits unreported through an inter-cycle wait.
+        run_send(shard, options, results, pool=pool, on_record=reporter.add,
+                 on_cycle=lambda cycle, results: reporter.report(), should_stop=stop.is_set, sleep=stop.wait)
+    except Exception as e:
+        results["error_message"] = results["error_message"] or f"Error: {e}"
+    finally:
+        pool.close()
+        reporter.report({key: results[key] for key in SUMMARY_KEYS})
+
+
+class Merger:
+    """
+    Coordinator side: folds shard reports into one results dict. names label each shard in error
+    messages; shard_connections is how many connection ids each shard numbers from 1.
+    """
+
+    def __init__(self, options: SendOptions, results, on_record, names, shard_connections: int):
+        self.options = options
+        self.shards = len(names)
+        self.results = results
+        self.on_record = on_record
+        self.names = names
+        self.shard_connections = shard_connections
+        self.histograms = {}
+        self.summaries = {}
+
+    def add(self, index: int, rows, histogram, cycle_histograms, summary, transport=None):
+        log = self.results["ack_records"]
+        telemetry = metrics.active()
+        if telemetry is not None and transport is not None:
+            telemetry.merge_transport(index, transport, final=summary is not None)
+        for (cycle, msg_idx, attempt, message_id, status, error_code, text, duration, timestamp, bytes_sent,
+             connection_id, phases, retry, messages, ack) in rows:
+            # Map the worker's shard-local message and connection numbers back to run-wide ones. Batches
+            # are numbered per shard; only single messages map back to run-wide numbers.
+            if connection_id is not None:
+                connection_id += index * self.shard_connections
+            if self.options.batch_size <= 1:
+                msg_idx = (msg_idx - 1) * self.shards + index + 1
+            record = AckRecord(cycle, msg_idx, attempt, message_id, ack, duration, status=status,
+                               timestamp=timestamp, bytes_sent=bytes_sent, connection_id=connection_id,
+                               error_code=error_code, text=text,
+                               phases=tuple(phases) if phases is not None else None, retry=retry,
+                               messages=messages)
+            log.append(record)
+            record_phases(self.results, record)
+            record_retry(self.results, record)
+            if telemetry is not None:
+                telemetry.observe(record)
+            if self.on_record:
+                self.on_record(record)
+        self.histograms[index] = (histogram, cycle_histograms)
+        merged = LatencyHistogram()
+        cycles = []
+        for run_histogram, worker_cycles in self.histograms.values():
+            merged.merge(run_histogram)
+            for cycle, cycle_histogram in enumerate(worker_cycles):
+                if cycle == len(cycles):
+                    cycles.append(LatencyHistogram())
+                cycles[cycle].merge(cycle_histogram)
+        self.results["histogram"] = merged
+        self.results["cycle_histograms"] = cycles
+        if summary is not None:
+            self.summaries[index] = summary
+
+    def fail(self, index: int, message: str):
+        telemetry = metrics.active()
+        if telemetry is not None:
+            telemetry.forget(index)
+        self.summaries[index] = {"error_message": message, "cancelled": False, "num_messages": None,
+                                 "connects": None, "rate_reports": [], "breaker_trips": 0}
+
+    def finish(self, cancelled: bool):
+        results = self.results
+        summaries = [self.summaries[index] for index in sorted(self.summaries)]
+        errors = [f"{self.names[index]}: {summary['error_message']}"
+                  for index, summary in sorted(self.summaries.items()) if summary["error_message"]]
+        results["error_message"] = errors[0] if errors else None
+        # Workers stopped because another one failed report cancelled too; only a caller's stop counts.
+        results["cancelled"] = cancelled or (not errors and any(s["cancelled"] for s in summaries))
+        counts = [s["num_messages"] for s in summaries]
+        if None not in counts:
+            results["num_messages"] = sum(counts)
+        connects = [s["connects"] for s in summaries if s["connects"] is not None]
+        if connects:
+            results["connects"] = sum(connects)
+        for summary in summaries:
+            results["rate_reports"].extend(summary["rate_reports"])
+        results["breaker_trips"] = sum(s.get("breaker_trips", 0) for s in summaries)
+
+
+def collect_reports(reports, merger: Merger, stop, ended, on_status, should_stop, noun: str):
+    """
+    Feed reports (a queue of report tuples) to merger until every shard has sent its final one.
+    stop.set() tells all shards to stop; it is called on should_stop() or the first shard error.
+    ended(index) says why a shard can no longer report (process exited, connection closed), or None.
+    Returns whether the caller cancelled the run.
+    """
+    results = merger.results
+    cancelled = False
+    ended_before = {}
+    while len(merger.summaries) < merger.shards:
+        if not stop.is_set() and should_stop():
+            cancelled = True
+            stop.set()
+        try:
+            report = reports.get(timeout=0.1)
+        except queue.Empty:
+            # A shard that died without a final report (killed, crashed, disconnected) would hang the run.
+            # Shards flush their reports before they end, so one seen ended on the previous pass that
+            # still has not reported never will.
+            for index, reason in ended_before.items():
+                if index not in merger.summaries:
+                    merger.fail(index, f"Error: {reason}")
+                    stop.set()
+            ended_before = {index: reason for index in range(merger.shards)
+                            if (reason := ended(index)) is not None}
+            continue
+        merger.add(*report)
+        summary = report[4]
+        if summary is not None and summary["error_message"]:
+            stop.set()
+        elapsed = time.perf_counter() - results["batch_start_time"]
+        total = results["ack_records"].total
+        on_status(f"{merger.shards} {noun}: {total} sent, {total / elapsed:.0f} msg/s, "
+                  f"p99 {results['histogram'].percentile(99) * 1000:.1f} ms")
+    return cancelled
+
+
+def run_multiprocess(messages, options: SendOptions, results, on_record=None, on_status=None, should_stop=None):
+    """
+    Run a send job across options.processes worker processes, filling results in place like
+    runner.run_send. on_record(record) fires in this process for every attempt, with run-wide
+    message numbers; connection ids are numbered per worker (worker k's connections follow worker
+    k-1's). on_status(text) reports merged throughput and p99 as reports arrive. should_stop() is
+    polled here and relayed to every worker. The first worker error stops the others and is recorded
+    in results["error_message"].
+    """
+    processes = options.processes
+    ctx = multiprocessing.get_context("spawn")
+    reports = ctx.Queue()
+    stop = ctx.Event()
+    options_for_worker = worker_options(options, processes)
+    instrumented = metrics.active() is not None
+    workers = [ctx.Process(target=_worker, args=(index, shard, options_for_worker, reports, stop, instrumented),
+                           name=f"send-worker-{index + 1}", daemon=True)
+               for index, shard in enumerate(shard_messages(messages, processes))]
+    merger = Merger(options, results, on_record, [f"Worker {index + 1}" for index in range(processes)],
+                    options.connections)
+
+    def ended(index):
+        code = workers[index].exitcode
+        return None if code is None else f"worker process exited with code {code}"
+
+    if on_status:
+        on_status(f"Starting {processes} worker processes...")
+    for worker in workers:
+        worker.start()
+    try:
+        cancelled = collect_reports(reports, merger, stop, ended, on_status or (lambda text: None),
+                                    should_stop or (lambda: False), "workers")
+    finally:
+        stop.set()
+        for worker in workers:
+            worker.join(timeout=5)
+            if worker.is_alive():
+                worker.terminate()
+        reports.close()
+    merger.finish(cancelled)
+    results["batch_end_time"] = time.perf_counter()
+    return results